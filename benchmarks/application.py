@@ -0,0 +1,65 @@
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from benchmarks.common import synthetic_image, wait_until
+
+if TYPE_CHECKING:
+    from main_page import MainPage
+    from components.image_canvas import ImageCanvas
+
+# Kept alive for the whole run, Qt allows one application per process
+_application = None
+
+
+def start_main_page(**options) -> "MainPage":
+    """The real main window on the offscreen platform, returned once its segment agent has loaded the encoder. Options go to MainPage"""
+    global _application
+    from PyQt6.QtWidgets import QApplication
+
+    _application = QApplication.instance() or QApplication([])
+    from main_page import MainPage
+
+    page = MainPage(**options)
+    wait_until(lambda: getattr(page, "segment_agent", None) is not None and page.segment_agent.is_encoder_loaded())
+    return page
+
+
+def write_image(file_name: str, width: int, height: int, seed: int) -> str:
+    from PIL import Image
+
+    Image.fromarray(synthetic_image(width, height, seed)).save(file_name)
+    return os.path.abspath(file_name)
+
+
+def open_image(page: "MainPage", file_path: str) -> "ImageCanvas":
+    """Open a file the way choosing it in the dialog does and wait until it is displayed and hashed"""
+    canvas = page.image_canvas
+    page._image_chosen_listener(file_path)
+    wait_until(lambda: canvas.image_path == file_path and getattr(canvas, "image", None) is not None and canvas.image_digest is not None)
+    return canvas
+
+
+def polygon_columns(rings: list[np.ndarray], first_id: int = 0) -> dict[str, np.ndarray]:
+    """Attribute columns of imported polygons, labelled with a handful of classes"""
+    count = len(rings)
+    centers = np.array([ring.mean(axis=0) for ring in rings]).reshape(-1, 2)
+    return {
+        "polygon_id": np.arange(first_id, first_id + count),
+        "group_id": np.array(["None"] * count, dtype=object),
+        "label": np.array([f"class {index % 5}" for index in range(count)], dtype=object),
+        "seed_pnt_x": centers[:, 0],
+        "seed_pnt_y": centers[:, 1],
+        "red": np.full(count, 30),
+        "green": np.full(count, 144),
+        "blue": np.full(count, 255),
+        "alpha": np.full(count, 75),
+    }
+
+
+def insert_polygons(canvas: "ImageCanvas", rings: list[np.ndarray]):
+    """Add polygons through the canvas import path and wait until every batch is in the scene"""
+    target = len(canvas.annotations.active_rows()) + len(rings)
+    canvas._insert_imported_polygons("benchmark", (polygon_columns(rings, canvas.annotations.allocate_id()), rings))
+    wait_until(lambda: len(canvas.annotations.active_rows()) >= target, step_ms=1)
@@ -0,0 +1,240 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+
+from utils.checkpoint_downloader import checkpoint_path
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(function: Callable[[], object], repeat: int, warmup: int = 1) -> list[float]:
+    """Seconds taken by each of repeat calls, after warmup calls that are not counted"""
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Statistics of a list of seconds, in milliseconds"""
+    milliseconds = np.array(samples) * 1000
+    return {
+        "min": float(milliseconds.min()),
+        "median": float(np.median(milliseconds)),
+        "mean": float(milliseconds.mean()),
+        "p95": float(np.percentile(milliseconds, 95)),
+        "max": float(milliseconds.max()),
+        "stdev": float(statistics.stdev(milliseconds)) if len(milliseconds) > 1 else 0.0,
+    }
+
+
+def _git(*args: str) -> str | None:
+    try:
+        return subprocess.run(["git", *args], cwd=REPOSITORY_DIRECTORY, capture_output=True, text=True, timeout=10, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _version(distribution: str) -> str | None:
+    from importlib import metadata
+
+    try:
+        return metadata.version(distribution)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def environment() -> dict:
+    """What a result depends on besides the code: the commit, the interpreter, library versions and the hardware"""
+    import cv2
+    import torch
+    from PyQt6.QtCore import PYQT_VERSION_STR, QT_VERSION_STR
+
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": None if status is None else status != "",
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "segment_anything": _version("segment_anything"),
+        "shapely": _version("shapely"),
+        "geopandas": _version("geopandas"),
+        "pyogrio": _version("pyogrio"),
+        "pycocotools": _version("pycocotools"),
+        "pyqt": PYQT_VERSION_STR,
+        "qt": QT_VERSION_STR,
+    }
+
+
+class BenchmarkRun:
+    """Results of one run of the suite, written as a single JSON document together with the environment and the settings"""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.environment = environment()
+        self.results: list[dict] = []
+
+    def time(self, suite: str, name: str, function: Callable[[], object], repeat: int, warmup: int = 1, **params):
+        """Measure function and add the result. A failure is recorded with the error instead of ending the run"""
+        described = ", ".join(f"{key}={value}" for key, value in params.items())
+        try:
+            samples = measure(function, repeat, warmup)
+        except Exception as e:
+            self.results.append({"suite": suite, "name": name, "params": params, "error": f"{type(e).__name__}: {e}"})
+            print(f"  {suite:<13}{name:<32}{described:<36} failed, {type(e).__name__}: {e}")
+            return
+        summary = summarize(samples)
+        self.results.append({"suite": suite, "name": name, "params": params, "unit": "ms", "summary": summary, "samples": [s * 1000 for s in samples]})
+        print(f"  {suite:<13}{name:<32}{described:<36}{summary['median']:10.2f} ms median {summary['p95']:10.2f} ms p95  (n={len(samples)})")
+
+    def write(self, file_path: str):
+        with open(file_path, "w") as f:
+            json.dump({"environment": self.environment, "settings": self.settings, "results": self.results}, f, indent=2)
+
+
+def result_key(result: dict) -> tuple:
+    return (result["suite"], result["name"], tuple(sorted(result["params"].items())))
+
+
+def compare(baseline_path: str, run: BenchmarkRun):
+    """Print the median of every result next to the same result of an earlier run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {result_key(result): result for result in baseline["results"]}
+    print(f"Compared with {baseline_path} (commit {baseline['environment'].get('commit')}):")
+    for result in run.results:
+        old = previous.get(result_key(result))
+        if old is None or "summary" not in old or "summary" not in result:
+            continue
+        old_median, new_median = old["summary"]["median"], result["summary"]["median"]
+        ratio = new_median / old_median if old_median > 0 else float("inf")
+        described = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+        print(f"  {result['suite']:<13}{result['name']:<32}{described:<36}{old_median:10.2f} -> {new_median:10.2f} ms  x{ratio:.2f}")
+
+
+def synthetic_image(width: int, height: int, seed: int = 0, shapes: int = 200) -> np.ndarray:
+    """RGB image of filled circles and rectangles over a noisy background, so the encoder and exports see realistic content"""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    image = rng.normal(60, 12, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    for _ in range(shapes):
+        color = tuple(int(c) for c in rng.integers(80, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(max(8, min(width, height) // 60), max(16, min(width, height) // 12)))
+        if rng.random() < 0.5:
+            cv2.circle(image, (x, y), size, color, -1)
+        else:
+            cv2.rectangle(image, (x - size, y - size // 2), (x + size, y + size // 2), color, -1)
+    return image
+
+
+def blob_rings(count: int, width: int, height: int, seed: int = 0, points: int = 96) -> list[np.ndarray]:
+    """Irregular closed outlines spread over an image, (points, 2) float64 each"""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, points, endpoint=False)
+    radius = max(4.0, np.sqrt(width * height / max(count, 1)) / 3)
+    centers = rng.uniform((radius, radius), (width - radius, height - radius), (count, 2))
+    wobble = 1 + 0.25 * np.sin(np.outer(rng.integers(2, 7, count), angles) + rng.uniform(0, 2 * np.pi, (count, 1)))
+    radii = radius * rng.uniform(0.5, 1.0, (count, 1)) * wobble
+    rings = np.stack((centers[:, :1] + radii * np.cos(angles), centers[:, 1:] + radii * np.sin(angles)), axis=-1)
+    return list(rings)
+
+
+def blob_mask(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Viewport-sized boolean mask of one irregular region, like the decoder returns for a click"""
+    import cv2
+
+    ring = blob_rings(1, width, height, seed, points=360)[0]
+    scale = min(width, height) / 4 / np.abs(ring - ring.mean(axis=0)).max()
+    ring = (ring - ring.mean(axis=0)) * scale + (width / 2, height / 2)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.round(ring).astype(np.int32)], 1)
+    return mask.astype(bool)
+
+
+def write_random_checkpoint(model_type: str, seed: int = 0):
+    """Save a randomly initialized SAM where the application looks for the checkpoint, unless one is already there.
+
+    \nRandom weights run exactly the same operations as the released ones, so latencies are comparable without a download.
+    """
+    path = checkpoint_path(model_type)
+    if os.path.exists(path):
+        return
+    import torch
+    from segment_anything import sam_model_registry
+
+    start = perf_counter()
+    torch.manual_seed(seed)
+    sam = sam_model_registry[model_type](checkpoint=None)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(sam.state_dict(), path + ".tmp")
+    os.replace(path + ".tmp", path)
+    print(f"Wrote a random-weight {model_type} checkpoint to {os.path.abspath(path)} in {perf_counter() - start:.1f}s")
+
+
+def enter_workdir(directory: str):
+    """Run from a scratch directory holding the random checkpoints, so real checkpoints, caches and autosaves are never touched"""
+    from utils.annotation_journal import AUTOSAVE_DIRECTORY
+
+    os.makedirs(directory, exist_ok=True)
+    assets = os.path.join(directory, "assets")
+    if not os.path.exists(assets):
+        try:
+            os.symlink(os.path.join(REPOSITORY_DIRECTORY, "assets"), assets, target_is_directory=True)
+        except OSError:
+            shutil.copytree(os.path.join(REPOSITORY_DIRECTORY, "assets"), assets)
+    os.chdir(directory)
+    # Autosaves of an earlier run would be restored into the canvas and change the polygon counts
+    shutil.rmtree(AUTOSAVE_DIRECTORY, ignore_errors=True)
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 600.0, step_ms: int = 5):
+    """Run the Qt event loop until condition holds"""
+    from PyQt6.QtCore import QEventLoop, QTimer
+
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Timed out waiting for the application")
+        loop = QEventLoop()
+        QTimer.singleShot(step_ms, loop.quit)
+        loop.exec()
+
+
+def wait_for_signal(signal, start: Callable[[], None], timeout: float = 600.0):
+    """Call start and run the Qt event loop until signal is emitted"""
+    emitted = []
+
+    def listener(*args):
+        emitted.append(args)
+
+    signal.connect(listener)
+    try:
+        start()
+        wait_until(lambda: bool(emitted), timeout)
+    finally:
+        signal.disconnect(listener)
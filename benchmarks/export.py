@@ -0,0 +1,53 @@
+import json
+import os
+
+from benchmarks.application import insert_polygons, open_image, write_image
+from benchmarks.common import BenchmarkRun, blob_rings, wait_for_signal, wait_until
+
+SUITE = "export"
+VECTOR_FORMATS = (".shp", ".gpkg", ".fgb", ".parquet")
+
+
+def check_coco_export(file_path: str, polygons: int):
+    """End the run if the COCO file is missing annotations, timing a broken export means nothing"""
+    with open(file_path) as file:
+        written = len(json.load(file)["annotations"])
+    if written != polygons:
+        raise RuntimeError(f"The COCO export wrote {written} of {polygons} annotations")
+
+
+def run(benchmark: BenchmarkRun, page, image_size: tuple[int, int], polygons: int, formats: list[str], repeat: int):
+    """The canvas's exports on an image holding the given number of polygons, and the vector files read back"""
+    from utils.geometry_io import read_polygons
+
+    width, height = image_size
+    canvas = open_image(page, write_image("export.png", width, height, seed=6))
+    insert_polygons(canvas, blob_rings(polygons, width, height, seed=7))
+    params = {"polygons": polygons, "image": f"{width}x{height}"}
+    os.makedirs("exports", exist_ok=True)
+
+    # The image export runs on the export lane and signals when the file is written
+    image_path = os.path.join("exports", "masked_image.png")
+    export_image = lambda: wait_for_signal(canvas.export_done_event, lambda: canvas.export_as_image(image_path))
+    benchmark.time(SUITE, "export_as_image", export_image, max(1, repeat // 4), **params)
+    coco_path = os.path.join("exports", "annotations.json")
+    # The COCO export runs in the process pool and signals when the file is written
+    export_coco = lambda: wait_for_signal(canvas.json_exported_event, lambda: canvas.export_json(coco_path))
+    benchmark.time(SUITE, "COCO export", export_coco, repeat, **params)
+    check_coco_export(coco_path, polygons)
+
+    for extension in formats:
+        vector_path = os.path.join("exports", f"annotated-shapes{extension}")
+        benchmark.time(SUITE, "export_shapefile", lambda: canvas.export_shapefile(vector_path), repeat, format=extension, **params)
+        benchmark.time(SUITE, "read back", lambda: read_polygons(vector_path), repeat, format=extension, **params)
+
+    for extension in formats:
+        # The whole import, parsing on the export lane then batched insertion, into an empty image so every format starts alike
+        import_canvas = open_image(page, write_image(f"import-{extension.lstrip('.')}.png", width, height, seed=6))
+        vector_path = os.path.join("exports", f"annotated-shapes{extension}")
+
+        def import_file():
+            import_canvas.import_shapefile(vector_path)
+            wait_until(lambda: len(import_canvas.annotations.active_rows()) >= polygons, step_ms=1)
+
+        benchmark.time(SUITE, "import_shapefile", import_file, 1, warmup=0, format=extension, **params)
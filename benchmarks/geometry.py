@@ -0,0 +1,39 @@
+import numpy as np
+from PyQt6.QtCore import QPointF
+from PyQt6.QtGui import QColor
+
+from benchmarks.application import insert_polygons, open_image, write_image
+from benchmarks.common import BenchmarkRun, blob_mask, blob_rings
+from utils.polygon import Polygon, array_to_polygon, mask_to_contour
+
+SUITE = "geometry"
+HIT_TESTS_PER_REPEAT = 20
+
+
+def run(benchmark: BenchmarkRun, page, view_size: tuple[int, int], image_size: tuple[int, int], polygon_counts: list[int], repeat: int):
+    """Contour tracing and QPolygonF building for a click's mask, then canvas imports and hit tests as the polygon count grows"""
+    width, height = image_size
+    canvas = open_image(page, write_image("geometry.png", width, height, seed=3))
+    mask = blob_mask(*view_size, seed=4)
+    contour = mask_to_contour(mask)
+    params = {"view": f"{view_size[0]}x{view_size[1]}", "contour_points": len(contour)}
+
+    benchmark.time(SUITE, "mask_to_contour", lambda: mask_to_contour(mask), repeat, **params)
+    benchmark.time(SUITE, "array_to_polygon", lambda: array_to_polygon(contour), repeat, **params)
+    color = QColor(30, 144, 255, 75)
+    benchmark.time(SUITE, "Polygon.draw", lambda: Polygon(color).draw(canvas, mask), repeat, **params)
+
+    rng = np.random.default_rng(5)
+    inserted = 0
+    for count in sorted(polygon_counts):
+        rings = blob_rings(count - inserted, width, height, seed=count)
+        benchmark.time(SUITE, "canvas import", lambda: insert_polygons(canvas, rings), 1, warmup=0, polygons=len(rings), total_polygons=count)
+        inserted = count
+
+        points = iter([QPointF(x, y) for x, y in rng.uniform((0, 0), (width, height), (repeat * HIT_TESTS_PER_REPEAT + 1, 2))])
+
+        def hit_test():
+            # What a click does first: find the topmost polygon under the cursor
+            return next((item for item in canvas.scene.items(next(points)) if isinstance(item, Polygon)), None)
+
+        benchmark.time(SUITE, "hit test", hit_test, repeat * HIT_TESTS_PER_REPEAT, polygons=count)
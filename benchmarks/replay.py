@@ -0,0 +1,197 @@
+import os
+import sys
+from time import perf_counter
+
+from PyQt6.QtCore import QPoint, QPointF, QRectF, Qt
+from PyQt6.QtGui import QWheelEvent
+from PyQt6.QtTest import QTest
+from PyQt6.QtWidgets import QApplication
+
+from benchmarks.application import open_image
+from benchmarks.common import summarize, wait_until
+from utils.task_executor import Priority, get_executor
+from utils.tool_mode import ToolMode
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from main_page import MainPage
+
+# One notch of a mouse wheel
+WHEEL_STEP = 120
+
+
+def resident_memory() -> int:
+    """Resident set size of this process in bytes. Where /proc is missing this is the peak so far, 0 where neither is available"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SessionReplayer:
+    """Drives the main window's canvas through a recorded session with synthesized mouse and key events.
+
+    \nEach action is timed from sending its events until the event loop has delivered them and no interactive task is left, so a
+    click includes the encode of a moved view, the decode, the polygon and the list update, and an image open includes the decode and
+    the autosave restore. Positions are recorded in image pixels and mapped through the replaying view, which is resized to the
+    recorded window first so the encoded screenshots match.
+    """
+
+    def __init__(self, page: "MainPage", image_directory: str = None, realtime: bool = False):
+        self.page = page
+        self.canvas = page.image_canvas
+        self.image_directory = image_directory
+        self.realtime = realtime
+        # A middle button drag spans consecutive pan actions
+        self.pan_position: QPoint = None
+        self.results: list[dict] = []
+        self.warnings: list[str] = []
+
+    def image_path(self, recorded_path: str) -> str:
+        if self.image_directory is not None:
+            return os.path.join(self.image_directory, os.path.basename(recorded_path))
+        return recorded_path
+
+    def play(self, actions: list[dict], progress: bool = True):
+        start = perf_counter()
+        for index, action in enumerate(actions):
+            if self.realtime:
+                # Idle time lets background work such as prefetching and autosave loading finish as it did while recording
+                wait_until(lambda: perf_counter() - start >= action["t"], step_ms=1)
+            if action["action"] != "pan":
+                self._end_pan()
+
+            memory_before = resident_memory()
+            action_start = perf_counter()
+            getattr(self, f"_{action['action']}")(action)
+            self._settle()
+            latency = perf_counter() - action_start
+            memory_after = resident_memory()
+
+            self.results.append(
+                {
+                    "index": index,
+                    "action": action["action"],
+                    "recorded_t": action["t"],
+                    "latency_ms": latency * 1000,
+                    "rss_bytes": memory_after,
+                    "rss_delta_bytes": memory_after - memory_before,
+                }
+            )
+            if progress and action["action"] != "pan":
+                print(f"{index + 1}/{len(actions)} {action['action']}: {latency * 1000:.1f} ms")
+        self._end_pan()
+        self._settle()
+
+    def _settle(self):
+        """Run the event loop until every event posted by the action is handled and its interactive tasks have delivered their results"""
+        QApplication.processEvents()
+        executor = get_executor()
+        wait_until(lambda: executor.pending(Priority.INTERACTIVE) == 0, step_ms=1)
+        QApplication.processEvents()
+
+    def _view_point(self, action: dict) -> QPoint:
+        return self.canvas.mapFromScene(QPointF(action["x"], action["y"]))
+
+    def _click_at(self, action: dict, button: Qt.MouseButton, modifier: Qt.KeyboardModifier = Qt.KeyboardModifier.NoModifier):
+        QTest.mouseClick(self.canvas.viewport(), button, modifier, self._view_point(action))
+
+    def _open(self, action: dict):
+        width, height = action["window"]
+        if (self.page.width(), self.page.height()) != (width, height):
+            self.page.resize(width, height)
+            QApplication.processEvents()
+        open_image(self.page, self.image_path(action["path"]))
+        viewport = self.canvas.maximumViewportSize()
+        if [viewport.width(), viewport.height()] != action["viewport"]:
+            self.warnings.append(
+                f"{os.path.basename(action['path'])} was recorded in a {action['viewport'][0]}x{action['viewport'][1]} view and is replayed in "
+                f"{viewport.width()}x{viewport.height()}, clicks land on the same pixels but encode different screenshots"
+            )
+        self.canvas.set_tool_mode(ToolMode.CREATE_MASK)
+
+    def _set_tool(self, tool_mode: ToolMode):
+        if self.canvas.tool_mode != tool_mode:
+            self.canvas.set_tool_mode(tool_mode)
+
+    def _click(self, action: dict):
+        self._set_tool(ToolMode.CREATE_MASK)
+        button = Qt.MouseButton.LeftButton if action["polarity"] else Qt.MouseButton.RightButton
+        modifier = Qt.KeyboardModifier.ControlModifier if action["refine"] else Qt.KeyboardModifier.NoModifier
+        self._click_at(action, button, modifier)
+
+    def _queue(self, action: dict):
+        self._set_tool(ToolMode.CREATE_MASK)
+        self._click_at(action, Qt.MouseButton.LeftButton, Qt.KeyboardModifier.ShiftModifier)
+
+    def _segment_queued(self, action: dict):
+        QTest.keyClick(self.canvas, Qt.Key.Key_Return)
+
+    def _clear_queued(self, action: dict):
+        QTest.keyClick(self.canvas, Qt.Key.Key_Escape)
+
+    def _erase(self, action: dict):
+        self._set_tool(ToolMode.ERASE_MASK)
+        self._click_at(action, Qt.MouseButton.LeftButton)
+
+    def _zoom(self, action: dict):
+        # The view zooms around the cursor, so it is moved over the recorded anchor first
+        position = self._view_point(action)
+        viewport = self.canvas.viewport()
+        QTest.mouseMove(viewport, position)
+        event = QWheelEvent(
+            QPointF(position),
+            QPointF(viewport.mapToGlobal(position)),
+            QPoint(),
+            QPoint(0, WHEEL_STEP * action["steps"]),
+            Qt.MouseButton.NoButton,
+            Qt.KeyboardModifier.NoModifier,
+            Qt.ScrollPhase.NoScrollPhase,
+            False,
+        )
+        QApplication.sendEvent(viewport, event)
+
+    def _pan(self, action: dict):
+        viewport = self.canvas.viewport()
+        if self.pan_position is None:
+            # The drag starts over the middle of the visible part of the image, presses outside of it are ignored
+            visible = self.canvas.mapToScene(viewport.rect()).boundingRect().intersected(QRectF(self.canvas.sceneRect()))
+            self.pan_position = self.canvas.mapFromScene(visible.center())
+            QTest.mousePress(viewport, Qt.MouseButton.MiddleButton, Qt.KeyboardModifier.NoModifier, self.pan_position)
+        scale = self.canvas.transform().m11()
+        self.pan_position += QPoint(round(action["dx"] * scale), round(action["dy"] * scale))
+        QTest.mouseMove(viewport, self.pan_position)
+
+    def _end_pan(self):
+        if self.pan_position is None:
+            return
+        QTest.mouseRelease(self.canvas.viewport(), Qt.MouseButton.MiddleButton, Qt.KeyboardModifier.NoModifier, self.pan_position)
+        self.pan_position = None
+
+    def _undo(self, action: dict):
+        self.page._undo_clicked_listener()
+
+    def _redo(self, action: dict):
+        self.page._redo_clicked_listener()
+
+    def summary(self) -> dict:
+        """Latency statistics per action type and how much resident memory each type added in total"""
+        summary = {}
+        for name in dict.fromkeys(result["action"] for result in self.results):
+            results = [result for result in self.results if result["action"] == name]
+            summary[name] = {
+                "count": len(results),
+                **summarize([result["latency_ms"] / 1000 for result in results]),
+                "rss_growth_bytes": sum(result["rss_delta_bytes"] for result in results),
+            }
+        return summary
+
@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+
+from benchmarks.common import BenchmarkRun, synthetic_image
+
+SUITE = "segmentation"
+BACKENDS = ("in-process", "process", "service")
+SEED_BATCH = 16
+
+
+def _create_agent(backend: str, model_type: str, local_agent):
+    """Agent for a backend and a function that shuts it down. The service shares the in-process model, like inference_server.py"""
+    if backend == "in-process":
+        return local_agent, lambda: None
+    if backend == "process":
+        from utils.inference_process import RemoteSegmentAgent
+
+        agent = RemoteSegmentAgent(model_type, "cpu")
+        agent.load_encoder()
+        return agent, agent.close
+
+    from utils.inference_service import InferenceService, ServiceSegmentAgent, make_server
+
+    server = make_server(InferenceService(local_agent), port=0)
+    threading.Thread(target=server.serve_forever, name="benchmark inference service", daemon=True).start()
+    agent = ServiceSegmentAgent(f"http://127.0.0.1:{server.server_port}")
+
+    def close():
+        agent.close()
+        server.shutdown()
+        server.server_close()
+
+    return agent, close
+
+
+def run(benchmark: BenchmarkRun, backends: list[str], model_type: str, view_size: tuple[int, int], repeat: int):
+    """Encoder and decoder latency of every backend on a viewport-sized synthetic screenshot.
+
+    \nThe encoder is timed as setImage followed by one click, the first click after the view moved. The process backend sends the image
+    without waiting, so setImage alone would not include the encode. No cache keys are passed, every setImage runs the encoder.
+    """
+    from segment_agent import SegmentAgent
+
+    width, height = view_size
+    image = synthetic_image(width, height, seed=1)
+    rng = np.random.default_rng(2)
+    points = rng.integers((0, 0), (width, height), (max(repeat * 4, SEED_BATCH), 2)).tolist()
+    local_agent = SegmentAgent(model_type, "cpu", load_encoder=True)
+    local_agent.embedding_cache = None
+    params = {"model_type": model_type, "view": f"{width}x{height}"}
+
+    for backend in backends:
+        agent, close = _create_agent(backend, model_type, local_agent)
+        try:
+            x, y = points[0]
+            slow_repeat = max(1, repeat // 4)
+            encode = lambda: (agent.setImage(image), agent.generateMaskFromPoint(x, y))
+            benchmark.time(SUITE, "set image + first click", encode, slow_repeat, backend=backend, **params)
+
+            agent.setImage(image)
+            clicks = iter(points)
+            benchmark.time(SUITE, "click decode", lambda: agent.generateMaskFromPoint(*next(clicks)), repeat, backend=backend, **params)
+            prompt = [([x, y], 1), ([x + 20, y + 10], 1), ([x - 15, y + 5], 0)]
+            benchmark.time(SUITE, "refine decode (3 points)", lambda: agent.generateMaskFromPoints(prompt), repeat, backend=backend, **params)
+            seeds = [tuple(point) for point in points[:SEED_BATCH]]
+            seed_decode = lambda: agent.generateMasksFromSeeds(seeds)
+            benchmark.time(SUITE, "batched seeds decode", seed_decode, slow_repeat, backend=backend, seeds=len(seeds), **params)
+        finally:
+            close()
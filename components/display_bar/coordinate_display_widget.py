@@ -17,7 +17,13 @@ class CoordinateDisplayWidget(QWidget):
 
         self.setMinimumSize(150, 75)
 
+        self.preview_timing_label = QLabel("")
+        self.preview_timing_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.preview_timing_label.setStyleSheet("color: gray; font-size: 10px;")
+        self.preview_timing_label.hide()
+
         layout.addWidget(self.coordinate_label)
+        layout.addWidget(self.preview_timing_label)
         layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
 
@@ -26,5 +32,10 @@ class CoordinateDisplayWidget(QWidget):
         self.y = y
         self.coordinate_label.setText(f"x: {x} y: {y}")
 
+    def update_preview_timing(self, text: str):
+        """Show hover preview decoder timings, an empty text hides the line"""
+        self.preview_timing_label.setText(text)
+        self.preview_timing_label.setVisible(text != "")
+
     def get_coordinates(self):
         return QPoint(self.x, self.y)
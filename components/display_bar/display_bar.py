@@ -35,6 +35,7 @@ class DisplayBar(QWidget):
 
     def close(self):
         self.hide()
-        self.display_bar_toolbox.polygon_list.clear()
-        self.display_bar_toolbox.polygon_image_label.clear()
+        self.display_bar_toolbox.polygon_model.clear()
+        self.display_bar_toolbox.clear_polygon_image()
+        self.display_bar_toolbox.thumbnail_cache.clear()
         self.display_bar_toolbox.selected_polygon = None
@@ -1,12 +1,13 @@
-from PyQt6.QtWidgets import QWidget, QLabel, QVBoxLayout, QPushButton, QScrollArea, QListWidget, QListWidgetItem, QSlider, QSizePolicy, QComboBox  # fmt: skip
-from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtGui import QPixmap, QPainter, QBrush, QTransform
+from PyQt6.QtWidgets import QWidget, QLabel, QVBoxLayout, QPushButton, QScrollArea, QListView, QAbstractItemView, QSlider, QSizePolicy, QComboBox  # fmt: skip
+from PyQt6.QtCore import Qt, pyqtSignal, QModelIndex
+from PyQt6.QtGui import QPixmap
 from utils.polygon import Polygon
 from utils.slider_strength import SliderStrength
 from typing import TYPE_CHECKING
 import os
 
-from components.display_bar.polygon_item_widget import PolygonItemWidget
+from components.display_bar.polygon_list_model import PolygonListModel, PolygonItemDelegate, POLYGON_ROLE
+from components.display_bar.thumbnail_cache import ThumbnailCache
 
 if TYPE_CHECKING:
     from components.image_canvas import ImageCanvas
@@ -28,6 +29,9 @@ class DisplayBarToolbox(QWidget):
 
         self.polygon_image_label = QLabel()
         self.polygon_image_label.setMinimumHeight(100)
+        self.thumbnail_cache = ThumbnailCache(parent=self)
+        self.thumbnail_cache.thumbnail_ready.connect(self._thumbnail_ready_listener)
+        self._requested_thumbnail_key = None
 
         self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground)
         layout = QVBoxLayout(self)
@@ -67,9 +71,16 @@ class DisplayBarToolbox(QWidget):
         scroll_area.setMaximumWidth(200)
         layout.addWidget(scroll_area, alignment=Qt.AlignmentFlag.AlignRight)
 
-        self.polygon_list = QListWidget()
+        self.polygon_model = PolygonListModel(self)
+        self.polygon_list = QListView()
+        self.polygon_list.setModel(self.polygon_model)
+        self.polygon_list.setItemDelegate(PolygonItemDelegate(self.polygon_list))
+        self.polygon_list.setUniformItemSizes(True)
+        self.polygon_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.polygon_list.setEditTriggers(QAbstractItemView.EditTrigger.DoubleClicked)
 
-        self.polygon_list.itemPressed.connect(self._list_item_clicked_listener)
+        self.polygon_list.pressed.connect(self._list_item_clicked_listener)
+        self.polygon_model.label_edited_event.connect(self._polygon_label_edited_listener)
 
         scroll_area.setWidget(self.polygon_list)
 
@@ -283,9 +294,8 @@ class DisplayBarToolbox(QWidget):
     def get_text_from_slider_index(self, index):
         return self.strength_slider_labels[index]
 
-    def _list_item_clicked_listener(self, item: QListWidgetItem):
-        listWidget: PolygonItemWidget = self.polygon_list.itemWidget(item)
-        mask = listWidget.polygon_item
+    def _list_item_clicked_listener(self, index: QModelIndex):
+        mask: Polygon = index.data(POLYGON_ROLE)
 
         if self.selected_polygon != None:
             self.selected_polygon.set_selected(False)
@@ -297,62 +307,60 @@ class DisplayBarToolbox(QWidget):
         self.image_canvas.current_mask_manager = mask.get_mask_manager()
         self.selected_polygon = mask
 
+    def _polygon_label_edited_listener(self, polygon: Polygon):
+        """Keep the annotation store in step with labels edited in the list"""
+        manager = polygon.get_mask_manager()
+        if manager is not None:
+            self.image_canvas.annotations.sync(manager)
+
     def add_polygon_to_polygon_list(self, mask: Polygon):
         self.draw_polygon_image(mask)
-        widget = PolygonItemWidget(mask)
-        item = QListWidgetItem()
-        item.setSizeHint(widget.sizeHint())
-        self.polygon_list.addItem(item)
-        self.polygon_list.setItemWidget(item, widget)
-        self.polygon_list.setCurrentItem(item)
+        self.polygon_model.add_polygons([mask])
+        self._select_row(self.polygon_model.row_of(mask))
         self.current_group_id_label.setText(f"Current Group ID: {mask.group_id}")
 
+    def add_polygons_to_polygon_list(self, masks: list[Polygon]):
+        """Append many polygons at once without redrawing the polygon image"""
+        self.polygon_model.add_polygons(masks)
+
     def update_polygon_list(self, mask):
         self.draw_polygon_image(mask)
-        items = self.polygon_list.selectedItems()
-        if len(items) == 0:
-            return
-        item = items[0]
-        self.polygon_list.setItemWidget(item, PolygonItemWidget(mask))
+        self.polygon_model.update_polygon(mask)
         self.current_group_id_label.setText(f"Current Group ID: {mask.group_id}")
 
     def remove_polygon_from_polygon_list(self, mask: Polygon):
-        for index in range(self.polygon_list.count()):
-            item = self.polygon_list.item(index)
-            widget = self.polygon_list.itemWidget(item)
-            if isinstance(widget, PolygonItemWidget) and mask.get_name() == widget.polygon_item.get_name():
-                self.polygon_list.takeItem(index)
-                self.clear_polygon_image()
-                return
+        if self.polygon_model.remove_polygon(mask):
+            self.clear_polygon_image()
+            return
         self.current_group_id_label.setText("Current Group ID: None")
 
-    def draw_polygon_image(self, polygon_item: Polygon):
-        pixmap_size = 100
-        pixmap = QPixmap(pixmap_size, pixmap_size)
-        pixmap.fill(Qt.GlobalColor.transparent)
-        painter = QPainter(pixmap)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-        # Calculate scaling
-        bounding_rect = polygon_item.boundingRect()
-
-        scale_factor = min(pixmap_size / bounding_rect.width(), pixmap_size / bounding_rect.height())
-        transform = QTransform()
-        transform.scale(scale_factor, scale_factor)
-        transform.translate(-bounding_rect.left(), -bounding_rect.top())
+    def _select_row(self, row: int | None):
+        if row is None:
+            return
+        index = self.polygon_model.index(row)
+        self.polygon_list.setCurrentIndex(index)
+        self.polygon_list.scrollTo(index)
 
-        # Apply transformation and draw polygon
-        transformed_polygon = transform.map(polygon_item.polygon())
-        painter.setBrush(QBrush(polygon_item.brush().color()))
-        painter.setPen(polygon_item.pen())
-        painter.drawPolygon(transformed_polygon)
+    def draw_polygon_image(self, polygon_item: Polygon):
+        """Show the polygon's thumbnail, rendering it in the background if it is not cached yet"""
+        key = self.thumbnail_cache.key_for(polygon_item)
+        pixmap = self.thumbnail_cache.get(key)
+        if pixmap is None:
+            self._requested_thumbnail_key = self.thumbnail_cache.request(polygon_item)
+            return
+        self._requested_thumbnail_key = key
+        self._show_polygon_image(pixmap)
 
-        painter.end()
+    def _thumbnail_ready_listener(self, key: tuple, pixmap: QPixmap):
+        if key == self._requested_thumbnail_key:
+            self._show_polygon_image(pixmap)
 
+    def _show_polygon_image(self, pixmap: QPixmap):
         self.polygon_image_label.setPixmap(pixmap)
         self.polygon_image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
     def clear_polygon_image(self):
+        self._requested_thumbnail_key = None
         self.polygon_image_label.clear()
 
     def export_image(self):
@@ -360,13 +368,9 @@ class DisplayBarToolbox(QWidget):
 
     def move_selected_list_item(self, mask: Polygon):
         self.draw_polygon_image(mask)
-        for index in range(self.polygon_list.count()):
-            item = self.polygon_list.item(index)
-            widget: PolygonItemWidget = self.polygon_list.itemWidget(item)
-
-            if mask.id == widget.polygon_item.id:
-                self.polygon_list.setCurrentItem(item)
-                listWidget: PolygonItemWidget = self.polygon_list.itemWidget(item)
-                mask = listWidget.polygon_item
-                self.current_group_id_label.setText(f"Current Group ID: {mask.group_id}")
-                return
+        row = self.polygon_model.row_of(mask)
+        if row is None:
+            return
+        self._select_row(row)
+        mask = self.polygon_model.polygon_at(row)
+        self.current_group_id_label.setText(f"Current Group ID: {mask.group_id}")
@@ -0,0 +1,117 @@
+from PyQt6.QtWidgets import QStyledItemDelegate, QLineEdit, QStyleOptionViewItem, QWidget
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, pyqtBoundSignal, pyqtSignal
+from utils.polygon import Polygon
+
+
+POLYGON_ROLE = Qt.ItemDataRole.UserRole
+
+
+class PolygonListModel(QAbstractListModel):
+    """Backs the polygon list box. Rows are looked up by polygon name through an index instead of scanning the list"""
+
+    # A label was changed in the list, unlike dataChanged this is not sent when a row shows a new polygon state
+    label_edited_event: pyqtBoundSignal = pyqtSignal(Polygon)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._polygons: list[Polygon] = []
+        self._rows: dict[str, int] = {}
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self._polygons)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        polygon = self._polygons[index.row()]
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return polygon.get_display_name()
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            return Qt.AlignmentFlag.AlignCenter
+        if role == POLYGON_ROLE:
+            return polygon
+        return None
+
+    def setData(self, index: QModelIndex, value, role: int = Qt.ItemDataRole.EditRole) -> bool:
+        if not index.isValid() or role != Qt.ItemDataRole.EditRole:
+            return False
+        polygon = self._polygons[index.row()]
+        if value == polygon.get_display_name():
+            return True
+        polygon.set_display_name(value)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole])
+        self.label_edited_event.emit(polygon)
+        return True
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlag:
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsEditable
+
+    def add_polygons(self, polygons: list[Polygon]):
+        if len(polygons) == 0:
+            return
+        first_row = len(self._polygons)
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(polygons) - 1)
+        for row, polygon in enumerate(polygons, start=first_row):
+            self._polygons.append(polygon)
+            self._rows[polygon.get_name()] = row
+        self.endInsertRows()
+
+    def update_polygon(self, polygon: Polygon):
+        """Replace the row belonging to the polygon's manager with the given polygon state"""
+        row = self.row_of(polygon)
+        if row is None:
+            return
+        self._polygons[row] = polygon
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def remove_polygon(self, polygon: Polygon) -> bool:
+        row = self.row_of(polygon)
+        if row is None:
+            return False
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._polygons[row]
+        del self._rows[polygon.get_name()]
+        for shifted_row in range(row, len(self._polygons)):
+            self._rows[self._polygons[shifted_row].get_name()] = shifted_row
+        self.endRemoveRows()
+        return True
+
+    def row_of(self, polygon: Polygon) -> int | None:
+        return self._rows.get(polygon.get_name())
+
+    def polygon_at(self, row: int) -> Polygon:
+        return self._polygons[row]
+
+    def polygons(self) -> list[Polygon]:
+        return list(self._polygons)
+
+    def clear(self):
+        self.beginResetModel()
+        self._polygons.clear()
+        self._rows.clear()
+        self.endResetModel()
+
+
+class PolygonItemDelegate(QStyledItemDelegate):
+    """Paints polygon rows at a fixed height and edits their display name in place"""
+
+    ROW_HEIGHT = 30
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def createEditor(self, parent: QWidget, option: QStyleOptionViewItem, index: QModelIndex) -> QWidget:
+        editor = QLineEdit(parent)
+        editor.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        return editor
+
+    def setEditorData(self, editor: QLineEdit, index: QModelIndex):
+        editor.setText(index.data(Qt.ItemDataRole.EditRole))
+
+    def setModelData(self, editor: QLineEdit, model: PolygonListModel, index: QModelIndex):
+        model.setData(index, editor.text(), Qt.ItemDataRole.EditRole)
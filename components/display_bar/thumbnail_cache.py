@@ -0,0 +1,86 @@
+from collections import OrderedDict
+
+import numpy as np
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+from PyQt6.QtGui import QBrush, QColor, QImage, QPainter, QPixmap
+
+from utils.task_executor import Priority, get_executor
+from utils.polygon import Polygon, array_to_polygon
+
+
+def render_thumbnail(points: np.ndarray, rgba: tuple[int, int, int, int], size: int) -> QImage:
+    """Rasterize a polygon into a size x size image. Safe to call off the GUI thread since it only paints on a QImage"""
+    image = QImage(size, size, QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(Qt.GlobalColor.transparent)
+    if len(points) < 3:
+        return image
+
+    # Scale into thumbnail space and drop points that collapse onto the same half pixel
+    minimum = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - minimum, 1e-6)
+    scaled = np.round((points - minimum) * (size / extent.max()) * 2) / 2
+    keep = np.ones(len(scaled), dtype=bool)
+    keep[1:] = np.any(scaled[1:] != scaled[:-1], axis=1)
+    scaled = scaled[keep]
+
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    painter.setPen(Qt.PenStyle.NoPen)
+    painter.setBrush(QBrush(QColor(*rgba)))
+    painter.drawPolygon(array_to_polygon(scaled))
+    painter.end()
+    return image
+
+
+class ThumbnailCache(QObject):
+    """LRU cache of polygon thumbnails keyed by polygon name, geometry version and color. Missing thumbnails are rendered on a worker"""
+
+    thumbnail_ready = pyqtSignal(object, QPixmap)
+
+    def __init__(self, capacity: int = 512, size: int = 100, parent=None):
+        super().__init__(parent)
+        self.capacity = capacity
+        self.size = size
+        self._pixmaps: OrderedDict[tuple, QPixmap] = OrderedDict()
+        self._rendering: set[tuple] = set()
+
+    def key_for(self, polygon: Polygon) -> tuple:
+        return (polygon.get_name(), polygon.geometry_version, polygon.brush().color().rgba())
+
+    def get(self, key: tuple) -> QPixmap | None:
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+        return pixmap
+
+    def request(self, polygon: Polygon) -> tuple:
+        """Start rendering the polygon's thumbnail unless it is cached or already being rendered, and return its key"""
+        key = self.key_for(polygon)
+        if key in self._pixmaps or key in self._rendering:
+            return key
+
+        points = polygon.get_points_array()
+        rgba = polygon.brush().color().getRgb()
+
+        def runnable():
+            return render_thumbnail(points, rgba, self.size)
+
+        self._rendering.add(key)
+        get_executor().submit(
+            runnable,
+            priority=Priority.INTERACTIVE,
+            on_finished=lambda image: self._thumbnail_rendered_listener(key, image),
+            on_failed=lambda _: self._rendering.discard(key),
+        )
+        return key
+
+    def _thumbnail_rendered_listener(self, key: tuple, image: QImage):
+        self._rendering.discard(key)
+        pixmap = QPixmap.fromImage(image)
+        self._pixmaps[key] = pixmap
+        while len(self._pixmaps) > self.capacity:
+            self._pixmaps.popitem(last=False)
+        self.thumbnail_ready.emit(key, pixmap)
+
+    def clear(self):
+        self._pixmaps.clear()
@@ -0,0 +1,158 @@
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+from PyQt6.QtWidgets import QGraphicsPolygonItem
+from PyQt6.QtGui import QColor, QPen
+from PyQt6.QtCore import QObject, QPoint, QTimer, Qt, pyqtSignal, pyqtBoundSignal
+
+from utils.polygon import array_to_polygon, mask_to_contour, view_to_scene
+from utils.latency_monitor import get_monitor
+from utils.task_executor import Priority, TaskHandle, get_executor
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from components.image_canvas import ImageCanvas
+
+
+PREVIEW_RATES = (5, 10, 20, 30)
+PREVIEW_BUDGETS_MS = (50, 100, 200, 500)
+DEFAULT_PREVIEW_RATE = 20
+DEFAULT_PREVIEW_BUDGET_MS = 100
+
+
+class HoverPreview(QObject):
+    """Shows the mask a click would create under the cursor, using only the prompt decoder on the current embedding.
+
+    \nAt most one decode is in flight and requests are capped at the preview rate. Cursor positions that arrive meanwhile collapse into
+    the latest one. Results that arrive after the embedding changed or later than the latency budget are dropped.
+    """
+
+    timing_updated: pyqtBoundSignal = pyqtSignal(str)
+
+    def __init__(self, canvas: "ImageCanvas"):
+        super().__init__(canvas)
+        self.canvas = canvas
+        self.enabled = False
+        self.rate = DEFAULT_PREVIEW_RATE
+        self.budget_ms = DEFAULT_PREVIEW_BUDGET_MS
+        self.outline: QGraphicsPolygonItem = None
+        self._pending_point: QPoint = None
+        self._task: TaskHandle = None
+        self._last_submitted = 0.0
+        self._generation = 0
+        self._decoder_times: deque[float] = deque(maxlen=50)
+        self._dropped = 0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._schedule)
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+        if not enabled:
+            self.invalidate()
+            self.timing_updated.emit("")
+
+    def set_rate(self, rate: int):
+        self.rate = rate
+
+    def set_budget(self, budget_ms: int):
+        self.budget_ms = budget_ms
+
+    def request(self, view_point: QPoint):
+        """Ask for a preview at the cursor. Ignored while the view has moved away from the encoded viewport"""
+        agent = getattr(self.canvas, "segment_agent", None)
+        if not self.enabled or agent is None or self.canvas.viewport_moved:
+            self.hide()
+            return
+        self._pending_point = view_point
+        self._schedule()
+
+    def invalidate(self):
+        """Forget queued work and hide the outline, used whenever the embedding or the view changes"""
+        self._generation += 1
+        self._pending_point = None
+        self._timer.stop()
+        self.hide()
+
+    def hide(self):
+        if self.outline is not None:
+            self.outline.hide()
+
+    def detach(self):
+        """Drop the outline item, called before the scene is cleared"""
+        self.invalidate()
+        if self.outline is not None and self.outline.scene() is not None:
+            self.outline.scene().removeItem(self.outline)
+        self.outline = None
+
+    def _schedule(self):
+        if self._pending_point is None or self._task is not None:
+            return
+        wait = 1 / self.rate - (perf_counter() - self._last_submitted)
+        if wait > 0:
+            if not self._timer.isActive():
+                self._timer.start(int(wait * 1000) + 1)
+            return
+        self._submit()
+
+    def _submit(self):
+        point = self._pending_point
+        self._pending_point = None
+        generation = self._generation
+        agent = self.canvas.segment_agent
+        x, y = point.x(), point.y()
+
+        def runnable():
+            start = perf_counter()
+            mask = agent.previewMask(x, y)
+            decoder_seconds = perf_counter() - start
+            get_monitor().record("preview decode", start, decoder_seconds)
+            return (None if mask is None else mask_to_contour(mask)), decoder_seconds
+
+        self._last_submitted = perf_counter()
+        submitted = self._last_submitted
+        self._task = get_executor().submit(
+            runnable,
+            priority=Priority.INTERACTIVE,
+            name="hover preview",
+            on_finished=lambda result: self._preview_ready_listener(result, generation, submitted),
+            on_failed=lambda _: self._preview_failed_listener(),
+        )
+
+    def _preview_failed_listener(self):
+        self._task = None
+        self.hide()
+
+    def _preview_ready_listener(self, result: tuple[np.ndarray, float], generation: int, submitted: float):
+        self._task = None
+        contour, decoder_seconds = result
+        latency_ms = (perf_counter() - submitted) * 1000
+
+        stale = generation != self._generation or not self.enabled or self.canvas.viewport_moved
+        if stale or latency_ms > self.budget_ms or contour is None or len(contour) < 3:
+            self._dropped += stale or latency_ms > self.budget_ms
+            self.hide()
+        else:
+            self._show(contour)
+
+        self._decoder_times.append(decoder_seconds * 1000)
+        times = np.array(self._decoder_times)
+        self.timing_updated.emit(
+            f"decoder {times[-1]:.1f} ms (p50 {np.percentile(times, 50):.1f}, p95 {np.percentile(times, 95):.1f})\n"
+            f"latency {latency_ms:.1f} ms, dropped {self._dropped}"
+        )
+        self._schedule()
+
+    def _show(self, contour: np.ndarray):
+        if self.outline is None:
+            self.outline = QGraphicsPolygonItem()
+            pen = QPen(QColor(255, 255, 255, 220), 1.5, Qt.PenStyle.DashLine)
+            pen.setCosmetic(True)
+            self.outline.setPen(pen)
+            self.outline.setZValue(2)
+            self.outline.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+            self.canvas.scene.addItem(self.outline)
+        self.outline.setPolygon(array_to_polygon(view_to_scene(self.canvas, contour)))
+        self.outline.show()
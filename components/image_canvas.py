@@ -1,41 +1,103 @@
-from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPolygonItem, QApplication
-from PyQt6.QtGui import QPixmap, QImage, QColor, QPainter, QColor, QImageReader, QKeyEvent, QCursor, QMouseEvent, QWheelEvent
-from PyQt6.QtCore import Qt, pyqtSignal, QRectF, QPoint, QEvent, QObject, QBuffer, pyqtBoundSignal
+from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QApplication, QGraphicsEllipseItem, QGraphicsItem
+from PyQt6.QtGui import QPixmap, QImage, QColor, QPainter, QColor, QImageReader, QKeyEvent, QCursor, QMouseEvent, QWheelEvent, QPen, QBrush, QTransform
+from PyQt6.QtCore import Qt, pyqtSignal, QRectF, QPoint, QPointF, QEvent, QObject, QBuffer, QTimer, pyqtBoundSignal
 
 from components.display_bar.display_bar import DisplayBar
+from components.hover_preview import HoverPreview
+from components.latency_overlay import LatencyOverlay
 
-import qimage2ndarray
-from PIL import Image, ImageDraw, ExifTags
+from PIL import Image, ImageDraw
 import io
-import json
-from datetime import datetime
-from shapely.geometry import Polygon as ShapelyPolygon
-import geopandas as gpd
-import rasterio
+from itertools import islice
+import numpy as np
 import os
+from time import perf_counter
 
-from utils.async_worker import AsyncWorker
+from utils.task_executor import Priority, TaskHandle, get_executor
 from utils.tool_mode import ToolMode
-from utils.polygon import Polygon
-from segment_agent import SegmentAgent
+from utils.latency_monitor import get_monitor
+from utils.gui_utils import show_error
+from utils.session_recorder import SessionRecorder
+from utils.polygon import Polygon, mask_to_contour, view_to_scene
+from utils.encoded_region import crop_rect_around, qtransform_matrix, translation, warp_logits
+from utils.annotation_journal import AnnotationJournal, autosave_directory, load_annotations
+from utils.project_file import Project, save_project
+from utils.tiling import covering_tile, image_digest, open_image, region_cache_key
 from utils.polygon_manager import PolygonManager
+from utils.annotation_store import AnnotationStore
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 
+# Heavy dependencies (qimage2ndarray, rasterio, geopandas/shapely, pycocotools) are imported where they are first needed to keep startup fast
 if TYPE_CHECKING:
     from main_page import MainPage
+    from segment_agent import SegmentAgent
+    from components.image_session import PrefetchedImage
 
 
-Image.MAX_IMAGE_PIXELS = None
+IMPORT_BATCH_SIZE = 500
+
+SEED_MARKER_RADIUS = 4
+
+# Pixels QGraphicsView.fitInView leaves free on every side
+FIT_MARGIN = 2
+
+
+def decode_image(file_path: str) -> QImage:
+    """Decode a file into the RGBA image the canvas displays. Safe to call on a worker thread"""
+    image = open_image(file_path)
+    return QImage(image.tobytes("raw", "RGBA"), image.size[0], image.size[1], QImage.Format.Format_RGBA8888)
+
+
+def fit_scale(image_width: int, image_height: int, view_width: int, view_height: int) -> float:
+    return min((view_width - 2 * FIT_MARGIN) / image_width, (view_height - 2 * FIT_MARGIN) / image_height)
+
+
+def fitted_view_transform(image_width: int, image_height: int, view_width: int, view_height: int) -> QTransform:
+    """Viewport transform of an image fitted into a view of the given size, before it is displayed.
+
+    \nMirrors how QGraphicsView centers a scene smaller than its viewport (integer half width, indent truncated to whole pixels), so
+    the first view of an image can be rendered and encoded ahead of time under the key the canvas will look up.
+    """
+    scale = fit_scale(image_width, image_height, view_width, view_height)
+    dx = -int(-(view_width // 2 - image_width * scale / 2))
+    dy = -int(-(view_height // 2 - image_height * scale / 2))
+    return QTransform(scale, 0, 0, scale, dx, dy)
+
+
+def render_view(image: QImage, transform: QTransform, width: int, height: int) -> np.ndarray:
+    """RGB pixels of the image as a viewport of the given size shows it, without anything drawn over it. Safe on a worker thread"""
+    import qimage2ndarray
+
+    view = QImage(width, height, QImage.Format.Format_ARGB32_Premultiplied)
+    view.fill(Qt.GlobalColor.black)
+    painter = QPainter(view)
+    # Filtered like the canvas draws it, so a zoomed out view is not encoded from aliased pixels the user never sees
+    painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+    painter.setTransform(transform)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return qimage2ndarray.rgb_view(view)
+
+
+def view_cache_key(image_digest: str, transform: QTransform, width: int, height: int) -> tuple:
+    """Embedding cache key of a rendered view: the file digest, the visible scene rectangle and the viewport size"""
+    visible = transform.inverted()[0].mapRect(QRectF(0, 0, width, height))
+    rectangle = [round(value, 3) for value in (visible.x(), visible.y(), visible.width(), visible.height())]
+    # "viewport-smooth" since render_view filters, entries cached from unfiltered screenshots under "viewport" are not reused
+    return ("viewport-smooth", image_digest, *rectangle, width, height)
 
 
 class ImageCanvas(QGraphicsView):
     """Used to display and edit an image"""
 
     image_loaded_event: pyqtBoundSignal = pyqtSignal()
+    # The message of an image that could not be decoded
+    image_load_failed_event: pyqtBoundSignal = pyqtSignal(str)
     tab_key_pressed_event = pyqtSignal()
     project_saved_event = pyqtSignal()
     export_done_event = pyqtSignal()
+    json_exported_event = pyqtSignal()
     mask_change_event = pyqtSignal(Polygon)
 
     def __init__(self, parent):
@@ -46,8 +108,6 @@ class ImageCanvas(QGraphicsView):
         self.polygon_brush_color = QColor(30, 144, 255, 75)
         self.mouse_position_x = "-"
         self.mouse_position_y = "-"
-        self.unique_polygon_id = 1
-        self.existing_mask_ids = []
         self.viewport_moved = True
         self.setStyleSheet("""ImageCanvas { border: 3px solid rgb(230, 230, 230);}""")
         self.middle_mouse_button_pressed = False
@@ -63,53 +123,172 @@ class ImageCanvas(QGraphicsView):
         self.setScene(self.scene)
         QImageReader.setAllocationLimit(0)
 
-        self.mask_managers = []
+        self.annotations = AnnotationStore()
         self.current_mask_manager = None
+        self.queued_seeds: list[tuple[QPointF, QGraphicsEllipseItem]] = []
+        self.hover_preview = HoverPreview(self)
+        self.latency_overlay = LatencyOverlay(self)
+        # Set to log the input acted on for replay_session.py
+        self.session_recorder: SessionRecorder = None
+        self.refine_masks = False
 
         self.image_path = None
-
-    def load_image(self, file_path: str):
-        """Load the given file asyncronously and display it in the image canvas scene"""
+        self.image_loader_task: TaskHandle = None
+        # Content hash of the loaded file, the embedding cache key. None until hashed, encodes are not cached meanwhile
+        self.image_digest: str = None
+        # Embedding cache keys looked up for this image, their entries are saved with a project
+        self.cache_keys_used: set[tuple] = set()
+        # A project being opened, drawn in place of the autosave once its image is loaded
+        self.pending_project: Project = None
+        # The project the annotations were opened from, its outlines and embeddings are read from its file
+        self.opened_project: Project = None
+        self.mounted_embeddings: list[tuple] = []
+
+    def load_image(self, file_path: str, prefetched: "PrefetchedImage" = None, project: Project = None):
+        """Load the given file asyncronously and display it in the image canvas scene. A prefetched image is displayed immediately.
+
+        \nWith a project, its annotations are drawn instead of the image's autosave and its embeddings are served from the project file.
+        """
+        self.close_journal()
         self.image_path = file_path
+        self.pending_project = project
+        if project is not None:
+            self._mount_project(project)
+
+        # A newer image replaces one that is still being decoded
+        if self.image_loader_task is not None:
+            self.image_loader_task.cancel()
+            self.image_loader_task = None
+
+        if prefetched is not None:
+            self.image_digest = prefetched.digest
+            self.async_image_loaded_listener(prefetched.image)
+            return
+
+        def failed(error: Exception):
+            if self.image_path == file_path:
+                self.image_load_failed_event.emit(f"Could not open {file_path}: {error}")
+
+        self.image_loader_task = get_executor().submit(
+            decode_image, file_path, priority=Priority.INTERACTIVE, on_finished=self.async_image_loaded_listener, on_failed=failed
+        )
 
-        def async_load_image():
-            image: Image.Image = Image.open(file_path)
-            image = self.rotate_image_by_exif_tag(image)
-            image = image.convert("RGBA")
-            qimage = QImage(image.tobytes("raw", "RGBA"), image.size[0], image.size[1], QImage.Format.Format_RGBA8888)
-            return qimage
+        self.image_digest = None
 
-        self.image_loader_worker = AsyncWorker(async_load_image)
-        self.image_loader_worker.setCallbackFunction(self.async_image_loaded_listener)
-        self.image_loader_worker.start()
+        def digest_ready(digest: str):
+            if self.image_path == file_path:
+                self.image_digest = digest
+
+        get_executor().submit(image_digest, file_path, priority=Priority.PREFETCH, name="hash image", on_finished=digest_ready)
 
     def async_image_loaded_listener(self, image: QImage):
         self.image: QImage = image
         self.pixmap = QPixmap.fromImage(image)
         self.image_item = self.scene.addPixmap(self.pixmap)
         self.scene.setSceneRect(self.image_item.boundingRect())
-        self.fitInView(self.image_item.boundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
+        # Rather than fitInView, whose reset of the previous zoom leaves rounding error, so fitted_view_transform predicts the view exactly
+        view_size = self.maximumViewportSize()
+        scale = fit_scale(image.width(), image.height(), view_size.width(), view_size.height())
+        self.setTransform(QTransform.fromScale(scale, scale))
+        window_size = self.main_page.size()
+        self._record_input(
+            "open",
+            path=os.path.abspath(self.image_path),
+            image=[image.width(), image.height()],
+            viewport=[view_size.width(), view_size.height()],
+            window=[window_size.width(), window_size.height()],
+        )
+        self._open_journal()
         self.image_loaded_event.emit()
 
+    def _open_journal(self):
+        """Start journaling edits to the image's autosave folder and put back the annotations saved there"""
+        image_path = self.image_path
+        directory = autosave_directory(image_path)
+        try:
+            journal = AnnotationJournal(directory, self.annotations.export_columns)
+        except OSError as e:
+            print(f"Could not open the autosave journal, edits are not saved: {e}")
+            return
+        self.annotations.journal = journal
+
+        def restored():
+            journal.restored = True
+
+        project, self.pending_project = self.pending_project, None
+        if project is not None:
+            journal.replace(project.columns, project.rings)
+            self._insert_imported_polygons(
+                project.path, (project.columns, project.simplified_rings), record=False, full_rings=project.rings, on_inserted=restored
+            )
+            return
+
+        def autosave_loaded(result):
+            if self.annotations.journal is journal and self.image is not None:
+                self._insert_imported_polygons(image_path, result, record=False, on_inserted=restored)
+
+        def autosave_failed(error: Exception):
+            message = f"{image_path}: {error}"
+            if self.annotations.journal is journal:
+                # The unreadable autosave is copied aside and replaced by what is on the canvas, so the journal can be compacted
+                # again without wiping it
+                journal.replace(*self.annotations.export_columns())
+                journal.restored = True
+                message += f"\n\nIt was copied to a backup folder in {directory}, new edits are autosaved again."
+            show_error(self.main_page, "Could not restore the autosave", message)
+
+        get_executor().submit(
+            load_annotations,
+            directory,
+            journal.sequence,
+            priority=Priority.INTERACTIVE,
+            name="load autosave",
+            on_finished=autosave_loaded,
+            on_failed=autosave_failed,
+        )
+
+    def close_journal(self):
+        """Write out and compact the autosave journal of the current image"""
+        journal = self.annotations.journal
+        if journal is None:
+            return
+        self.annotations.journal = None
+        try:
+            journal.close()
+        except OSError as e:
+            print(f"Could not write the autosave journal: {e}")
+
     def take_screenshot(self):
-        """Capture the currently displayed image data as a numpy array"""
-        area = self.viewport().rect()
-        image = QImage(area.size(), QImage.Format.Format_ARGB32_Premultiplied)
-        painter = QPainter(image)
-        visible_area = QRectF(image.rect())
-        self.render(painter, visible_area, area)
-        painter.end()
-        array = qimage2ndarray.rgb_view(image)
-        return array
+        """Capture the currently displayed image data as a numpy array.
+
+        \nOnly the image is drawn, not the annotations over it, so the pixels depend on nothing but the file and viewport_cache_key.
+        """
+        return render_view(self.image, self.viewportTransform(), self.viewport().width(), self.viewport().height())
+
+    def viewport_cache_key(self) -> tuple | None:
+        """Embedding cache key of the current screenshot, None until the file is hashed"""
+        if self.image_digest is None:
+            return None
+        return view_cache_key(self.image_digest, self.viewportTransform(), self.viewport().width(), self.viewport().height())
+
+    def _record_input(self, action: str, scene_point: QPointF = None, **fields):
+        """Log an action for replay, with its position in image pixels"""
+        if self.session_recorder is None:
+            return
+        if scene_point is not None:
+            fields = {"x": round(scene_point.x(), 2), "y": round(scene_point.y(), 2), **fields}
+        self.session_recorder.record(action, **fields)
 
     def undo_polygon(self, display_bar: DisplayBar):
         """Update currently selected polygon to its previous state"""
+        self._record_input("undo")
         if self.current_mask_manager == None:
             return
         self.current_mask_manager.displayPreviousMaskItem(display_bar)
 
     def redo_polygon(self, display_bar: DisplayBar):
         """Update currently selected polygon to its next state if one exists"""
+        self._record_input("redo")
         if self.current_mask_manager == None:
             return
         self.current_mask_manager.displayNextMaskItem(display_bar)
@@ -126,10 +305,21 @@ class ImageCanvas(QGraphicsView):
             return
 
         if event.button() == Qt.MouseButton.LeftButton or event.button() == Qt.MouseButton.RightButton:
+            self.hover_preview.hide()
 
             # Create a mask through clicking. Points are created with left click, negative points are created with right click
             if self.tool_mode == ToolMode.CREATE_MASK:
 
+                # Shift + left click queues a seed, Return then segments every queued seed in one batch
+                if event.button() == Qt.MouseButton.LeftButton and QApplication.keyboardModifiers() == Qt.KeyboardModifier.ShiftModifier:
+                    self._record_input("queue", self.mapToScene(event.pos()))
+                    self.queue_seed(self.mapToScene(event.pos()))
+                    return
+
+                refine = QApplication.keyboardModifiers() == Qt.KeyboardModifier.ControlModifier
+                if event.button() == Qt.MouseButton.LeftButton or refine:
+                    self._record_input("click", self.mapToScene(event.pos()), polarity=int(event.button() == Qt.MouseButton.LeftButton), refine=refine)
+
                 # If clicking on an existing polygon, select it and take no further action
                 if event.button() == Qt.MouseButton.LeftButton:
                     point = self.mapToScene(event.pos())
@@ -161,69 +351,228 @@ class ImageCanvas(QGraphicsView):
                     elif event.button() == Qt.MouseButton.RightButton:
                         polarity = 0
 
-                else:
+                monitor = get_monitor()
+                click_start = perf_counter()
+                # Before a new polygon is started, so a view that cannot be encoded leaves no empty annotation behind
+                if self.viewport_moved and not self._encode_view():
+                    return
+
+                if polarity is None:
                     # Start a new polygon if control is not held down
                     if self.current_mask_manager is not None:
                         self.current_mask_manager.unselectCurrentMask()
 
-                    mask_name = f"mask{self.unique_polygon_id}"
-
-                    while mask_name in self.existing_mask_ids:
-                        self.unique_polygon_id += 1
-                        mask_name = f"mask{self.unique_polygon_id}"
-
-                    self.current_mask_manager = PolygonManager(mask_name)
-                    self.current_mask_manager.setGraphicsView(self)
-                    self.unique_polygon_id += 1
-                    self.mask_managers.append(self.current_mask_manager)
+                    self.current_mask_manager = self._start_mask_manager(self.mapToScene(event.pos()))
                     polarity = 1
 
-                if self.viewport_moved:
-                    self.update_current_image()
-
                 mapped_unique_point = event.pos()
 
                 unique_point = [round(mapped_unique_point.x()), round(mapped_unique_point.y()), polarity]
 
-                mask_polygon = Polygon(
-                    self.polygon_brush_color, self.current_mask_manager, unique_point, self.unique_polygon_id, self.main_page.display_bar.display_bar_toolbox.group_dropdown.currentText()
-                )
-
-                mask_polygon.set_name(self.current_mask_manager.getName())
-                display_name = self.main_page.display_bar.get_annotation_label()
-                if display_name == "":
-                    display_name = self.current_mask_manager.getName()
-                mask_polygon.set_display_name(display_name)
+                mask_polygon = self._create_mask_polygon(self.current_mask_manager, unique_point)
 
                 self.current_mask_manager.appendMaskItem(mask_polygon)
                 self.current_mask_manager.displayNextMaskItem()
 
                 editing_existing_polygon = self.current_mask_manager.getClickedPointsCount() > 1
 
-                if editing_existing_polygon:
-                    mask_array = self.segment_agent.generateMaskFromPoints(self.current_mask_manager.getClickedPoints())
-                else:
-                    mask_array = self.segment_agent.generateMaskFromPoint(event.pos().x(), event.pos().y())
+                with monitor.span("predict"):
+                    if editing_existing_polygon:
+                        mask_array = self.segment_agent.generateMaskFromPoints(self.current_mask_manager.getClickedPoints())
+                    else:
+                        mask_array = self.segment_agent.generateMaskFromPoint(event.pos().x(), event.pos().y())
 
                 mask_polygon.draw(self, mask_array)
                 mask_polygon.set_selected(True)
+                self.annotations.sync(self.current_mask_manager)
 
                 # Update mask menu
-                if editing_existing_polygon:
-                    self.main_page.display_bar.get_toolbox().draw_polygon_image(mask_polygon)
-                    self.main_page.display_bar.get_toolbox().update_polygon_list(mask_polygon)
-                else:
-                    self.main_page.display_bar.get_toolbox().add_polygon_to_polygon_list(mask_polygon)
+                with monitor.span("list update"):
+                    if editing_existing_polygon:
+                        self.main_page.display_bar.get_toolbox().draw_polygon_image(mask_polygon)
+                        self.main_page.display_bar.get_toolbox().update_polygon_list(mask_polygon)
+                    else:
+                        self.main_page.display_bar.get_toolbox().add_polygon_to_polygon_list(mask_polygon)
+                monitor.record("click", click_start, perf_counter() - click_start)
+
+                if self.refine_masks:
+                    self.refine_polygon(mask_polygon)
 
             elif self.tool_mode == ToolMode.ERASE_MASK:
                 point = self.mapToScene(event.pos())
+                self._record_input("erase", point)
                 items = self.scene.items(point)
                 for item in items:
-                    if isinstance(item, QGraphicsPolygonItem):
+                    if isinstance(item, Polygon):
                         self.scene.removeItem(item)
+                        self.annotations.remove(item.get_mask_manager().annotation_id)
+                        if self.current_mask_manager is item.get_mask_manager():
+                            self.current_mask_manager = None
                         self.main_page.display_bar.get_toolbox().remove_polygon_from_polygon_list(item)
                         return
 
+    def _start_mask_manager(self, seed_point: QPointF) -> PolygonManager:
+        """Create the manager and store row for a new annotation seeded at the given scene point"""
+        annotation_id = self.annotations.allocate_id()
+        manager = PolygonManager(f"mask{annotation_id}", annotation_id)
+        manager.setGraphicsView(self)
+        self.annotations.add(manager, (seed_point.x(), seed_point.y()))
+        return manager
+
+    def _create_mask_polygon(self, manager: PolygonManager, unique_point: list) -> Polygon:
+        """Create a polygon for the manager using the current brush color, group and label"""
+        mask_polygon = Polygon(
+            self.polygon_brush_color,
+            manager,
+            unique_point,
+            manager.annotation_id,
+            self.main_page.display_bar.display_bar_toolbox.group_dropdown.currentText(),
+        )
+
+        mask_polygon.set_name(manager.getName())
+        display_name = self.main_page.display_bar.get_annotation_label()
+        if display_name == "":
+            display_name = manager.getName()
+        mask_polygon.set_display_name(display_name)
+        return mask_polygon
+
+    def set_refine_masks(self, refine_masks: bool):
+        self.refine_masks = refine_masks
+
+    def _image_region(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """RGB pixels of the loaded image inside the rectangle, at native resolution"""
+        import qimage2ndarray
+
+        region = self.image.copy(x0, y0, x1 - x0, y1 - y0).convertToFormat(QImage.Format.Format_RGB32)
+        return np.ascontiguousarray(qimage2ndarray.rgb_view(region))
+
+    def refine_polygon(self, mask_polygon: Polygon):
+        """Replace a polygon traced from the zoomed out viewport with one segmented on a native resolution crop around it.
+
+        \nThe crop is encoded on a worker and the coarse logits seed the decoder. Nothing happens when the view is already at or above
+        native resolution, or when the agent cannot refine (the worker-process and service agents).
+        """
+        agent = self.segment_agent
+        if not hasattr(agent, "refineMask") or agent.last_mask_logits is None or self.transform().m11() >= 1:
+            return
+        points = mask_polygon.get_points_array()
+        if len(points) < 3:
+            return
+
+        width, height = self.image.width(), self.image.height()
+        crop_rect = crop_rect_around(points.min(axis=0), points.max(axis=0), width, height)
+        # A grid tile holding the crop may already be in the embedding cache, precomputed or from an earlier refinement
+        x0, y0, x1, y1 = covering_tile(crop_rect, width, height) or crop_rect
+        crop = self._image_region(x0, y0, x1, y1)
+
+        manager: PolygonManager = mask_polygon.get_mask_manager()
+        clicked_points = manager.getClickedPoints()
+        view_points = np.array([point[0] for point in clicked_points], dtype=np.float64)
+        labels = np.array([point[1] for point in clicked_points])
+        crop_points = view_to_scene(self, view_points) - (x0, y0)
+
+        crop_to_view = qtransform_matrix(self.viewportTransform()) @ translation(x0, y0)
+        viewport_size = (self.viewport().height(), self.viewport().width())
+        mask_input = warp_logits(agent.last_mask_logits, crop_to_view, viewport_size, crop.shape[:2])
+        cache_key = None if self.image_digest is None else region_cache_key(self.image_digest, (x0, y0, x1, y1))
+        if cache_key is not None:
+            self.cache_keys_used.add(cache_key)
+
+        def runnable():
+            mask_array = agent.refineMask(crop, crop_points, labels, mask_input, cache_key)
+            return mask_to_contour(mask_array) + (x0, y0)
+
+        def refined(contour: np.ndarray):
+            # Skip if the polygon was undone, replaced by another click or erased while the crop was encoding
+            if manager.getCurrentlyDisplayedMask() is not mask_polygon or mask_polygon.scene() is not self.scene or len(contour) < 3:
+                return
+            mask_polygon.drawContour(self, contour, map=False)
+            self.annotations.sync(manager)
+            self.main_page.display_bar.get_toolbox().update_polygon_list(mask_polygon)
+
+        get_executor().submit(
+            runnable,
+            priority=Priority.INTERACTIVE,
+            name="refine mask",
+            on_finished=refined,
+            on_failed=lambda error: show_error(self.main_page, "Could not refine the mask", str(error)),
+        )
+
+    def queue_seed(self, scene_point: QPointF):
+        """Mark a seed point to be segmented with the next batch"""
+        marker = QGraphicsEllipseItem(-SEED_MARKER_RADIUS, -SEED_MARKER_RADIUS, SEED_MARKER_RADIUS * 2, SEED_MARKER_RADIUS * 2)
+        marker.setPos(scene_point)
+        marker.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIgnoresTransformations)
+        marker.setPen(QPen(QColor(255, 255, 255), 1))
+        marker.setBrush(QBrush(self.polygon_brush_color.darker(150)))
+        marker.setZValue(1)
+        self.scene.addItem(marker)
+        self.queued_seeds.append((scene_point, marker))
+
+    def clear_queued_seeds(self):
+        for _, marker in self.queued_seeds:
+            self.scene.removeItem(marker)
+        self.queued_seeds.clear()
+
+    def segment_queued_seeds(self):
+        """Segment every queued seed with one batched decoder call and add one annotation per seed.
+
+        \nSeeds are kept in scene coordinates so the view can move while queueing, seeds scrolled out of the viewport are dropped.
+        """
+        if not self.queued_seeds:
+            return
+        scene_points = [scene_point for scene_point, _ in self.queued_seeds]
+        # Remove the markers first so they are not part of the screenshot that gets encoded
+        self.clear_queued_seeds()
+        if self.viewport_moved and not self._encode_view():
+            return
+
+        viewport_rect = self.viewport().rect()
+        seeds = [(scene_point, self.mapFromScene(scene_point)) for scene_point in scene_points]
+        seeds = [(scene_point, view_point) for scene_point, view_point in seeds if viewport_rect.contains(view_point)]
+        if not seeds:
+            return
+
+        with get_monitor().span("predict"):
+            masks = self.segment_agent.generateMasksFromSeeds([(view_point.x(), view_point.y()) for _, view_point in seeds])
+        contours = list(get_executor().compute_pool.map(mask_to_contour, masks))
+
+        if self.current_mask_manager is not None:
+            self.current_mask_manager.unselectCurrentMask()
+            self.current_mask_manager = None
+
+        polygons = []
+        for (scene_point, view_point), mask_array, contour in zip(seeds, masks, contours):
+            if len(contour) < 3:
+                continue
+            manager = self._start_mask_manager(scene_point)
+            mask_polygon = self._create_mask_polygon(manager, [view_point.x(), view_point.y(), 1])
+            manager.appendMaskItem(mask_polygon)
+            manager.displayNextMaskItem()
+            mask_polygon.mask_array = mask_array
+            mask_polygon.drawContour(self, contour)
+            mask_polygon.set_selected(False)
+            self.annotations.sync(manager)
+            polygons.append(mask_polygon)
+
+        if not polygons:
+            return
+        with get_monitor().span("list update"):
+            self.main_page.display_bar.get_toolbox().add_polygons_to_polygon_list(polygons)
+        self.current_mask_manager = polygons[-1].get_mask_manager()
+        self.main_page.display_bar.get_toolbox().move_selected_list_item(polygons[-1])
+        polygons[-1].set_selected(True)
+
+    def keyPressEvent(self, event: QKeyEvent):
+        if event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter) and self.queued_seeds:
+            self._record_input("segment_queued")
+            self.segment_queued_seeds()
+        elif event.key() == Qt.Key.Key_Escape and self.queued_seeds:
+            self._record_input("clear_queued")
+            self.clear_queued_seeds()
+        else:
+            super().keyPressEvent(event)
+
     def is_point_in_canvas(self, point: QPoint) -> bool:
         relative_position = self.mapToScene(point)
         rel_x = relative_position.x()
@@ -232,16 +581,34 @@ class ImageCanvas(QGraphicsView):
 
     def update_current_image(self):
         """Capture current viewport image data and pass it into SAM model"""
-        image_array = self.take_screenshot()
-        self.segment_agent.setImage(image_array)
+        self.hover_preview.invalidate()
+        monitor = get_monitor()
+        with monitor.span("screenshot"):
+            image_array = self.take_screenshot()
+        cache_key = self.viewport_cache_key()
+        if cache_key is not None:
+            self.cache_keys_used.add(cache_key)
+        with monitor.span("set image"):
+            self.segment_agent.setImage(image_array, cache_key)
         self.viewport_moved = False
 
+    def _encode_view(self) -> bool:
+        """update_current_image for a click. False, with the error shown, if the segment agent could not encode the view"""
+        try:
+            self.update_current_image()
+        except (RuntimeError, OSError) as e:
+            show_error(self.main_page, "Could not segment the image", str(e))
+            return False
+        return True
+
     def wheelEvent(self, event: QWheelEvent):
         self.viewport_moved = True
+        self.hover_preview.invalidate()
         if event.angleDelta().y() > 0:
             factor = self.zoom_factor_base
         else:
             factor = 1 / self.zoom_factor_base
+        self._record_input("zoom", self.mapToScene(event.position().toPoint()), steps=1 if factor > 1 else -1)
         self.zoom_level *= factor
         self.scale(factor, factor)
 
@@ -285,15 +652,23 @@ class ImageCanvas(QGraphicsView):
 
         if self.middle_mouse_button_pressed:
             self.viewport_moved = True
+            self.hover_preview.invalidate()
 
             delta = event.pos() - self.last_scroll_position
+            scale = self.transform().m11()
+            self._record_input("pan", dx=round(delta.x() / scale, 2), dy=round(delta.y() / scale, 2))
             self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() - delta.x())
             self.verticalScrollBar().setValue(self.verticalScrollBar().value() - delta.y())
             self.last_scroll_position = event.pos()
         else:
+            if self.tool_mode == ToolMode.CREATE_MASK and self.is_point_in_canvas(event.pos()):
+                self.hover_preview.request(event.pos())
+            else:
+                self.hover_preview.hide()
             super().mouseMoveEvent(event)
 
     def leaveEvent(self, event: QEvent):
+        self.hover_preview.hide()
         QApplication.setOverrideCursor(Qt.CursorShape.ArrowCursor)
         super().leaveEvent(event)
 
@@ -309,9 +684,16 @@ class ImageCanvas(QGraphicsView):
         return super().eventFilter(object, event)
 
     def close(self):
-        self.existing_mask_ids.clear()
-        self.unique_polygon_id = 1
-        self.mask_managers.clear()
+        if self.image_loader_task is not None:
+            self.image_loader_task.cancel()
+            self.image_loader_task = None
+        self.close_journal()
+        self.pending_project = None
+        self.cache_keys_used.clear()
+        self._unmount_project()
+        self.annotations.clear()
+        self.queued_seeds.clear()
+        self.hover_preview.detach()
         self.scene.clear()
         self.current_mask_manager = None
         self.viewport_moved = True
@@ -327,32 +709,20 @@ class ImageCanvas(QGraphicsView):
     def get_polygon_brush_color(self):
         return self.polygon_brush_color
 
-    def set_segment_agent(self, segment_agent: SegmentAgent):
+    def set_segment_agent(self, segment_agent: "SegmentAgent"):
         self.segment_agent = segment_agent
 
     def get_scene(self) -> QGraphicsScene:
         return self.scene
 
     def get_mask_managers(self):
-        return self.mask_managers
-
-    def rotate_image_by_exif_tag(self, image: Image.Image):
-        try:
-            for orientation in ExifTags.TAGS.keys():
-                if ExifTags.TAGS[orientation] == "Orientation":
-                    exif = dict(image.getexif().items())
-
-                    if exif[orientation] == 3:
-                        image = image.rotate(180, expand=True)
-                    elif exif[orientation] == 6:
-                        image = image.rotate(270, expand=True)
-                    elif exif[orientation] == 8:
-                        image = image.rotate(90, expand=True)
-                    return image
-        except (AttributeError, KeyError, IndexError):
-            return image
+        return self.annotations.active_managers()
 
     def export_as_image(self, file_path: str):
+        rows = self.annotations.active_rows()
+        rings = list(self.annotations.geometries[rows])
+        colors = self.annotations.colors[rows].tolist()
+
         def runnable():
             buffer = QBuffer()
             buffer.open(QBuffer.OpenModeFlag.ReadWrite)
@@ -361,17 +731,11 @@ class ImageCanvas(QGraphicsView):
             size = self.image.size()
             mask_image = Image.new("RGBA", (size.width(), size.height()), (0, 0, 0, 0))
             draw = ImageDraw.Draw(mask_image)
-            polygons = []
-            for item in self.scene.items():
-                if isinstance(item, QGraphicsPolygonItem):
-                    polygons.append(item)
-
-            mask: Polygon
-            for mask in polygons:
-                polygon = mask.polygon()
-                points = [(point.x(), point.y()) for point in polygon]
-                r, g, b, a = mask.mask_color.getRgb()
-                draw.polygon(points, fill=(r, g, b, a))
+
+            for points, color in zip(rings, colors):
+                if len(points) < 3:
+                    continue
+                draw.polygon(np.asarray(points).ravel().tolist(), fill=tuple(color))
 
             if original_image.mode != "RGBA":
                 original_image = original_image.convert("RGBA")
@@ -380,142 +744,211 @@ class ImageCanvas(QGraphicsView):
             output_image.save(file_path)
             return output_image
 
-        self.image_saver_worker = AsyncWorker(runnable)
-        self.image_saver_worker.setCallbackFunction(self.export_done_event.emit)
-        self.image_saver_worker.start()
+        # The loading modal is closed whether or not the export succeeded
+        get_executor().submit(runnable, priority=Priority.EXPORT, on_finished=lambda _: self.export_done_event.emit(), on_failed=lambda _: self.export_done_event.emit())
 
     def export_json(self, file_path: str):
+        """Export the displayed polygons as COCO annotations at the resolution of the loaded image.
 
-        data: dict = {}
-
-        info = {"date_created": str(datetime.now()), "version": 1, "description": "Exported from SegmentationPainter"}
-
-        data["info"] = info
-
-        categories = [{"id": 0, "name": "coral", "supercategory": "none"}]
-
-        data["categories"] = categories
+        \nRLE encoding and writing the JSON hold the GIL, so they run in the executor's process pool and the canvas stays responsive.
+        """
+        from utils.coco_writer import write_coco_annotations
 
         image_path = "None" if self.image_path is None else self.image_path
 
-        images = [{"id": 0, "file_name": image_path, "height": 2, "width": 3, "date_captured": "unknown"}]
-
-        data["images"] = images
-
-        data["annotations"] = []
-
-        mask_manager: PolygonManager
-        for mask_manager in self.mask_managers:
+        rows = self.annotations.active_rows()
+        labels = self.annotations.label_column(rows)
+        # Plain arrays and strings, they are pickled to the process
+        annotations = [([np.asarray(self.annotations.geometries[row], dtype=np.float64)], str(label)) for row, label in zip(rows, labels)]
+
+        def failed(error: Exception):
+            show_error(self.main_page, "Could not export the annotations", f"{file_path}: {error}")
+            self.json_exported_event.emit()
+
+        get_executor().run_in_process(
+            write_coco_annotations,
+            file_path,
+            image_path,
+            self.image.width(),
+            self.image.height(),
+            annotations,
+            name="COCO export",
+            on_finished=lambda _: self.json_exported_event.emit(),
+            on_failed=failed,
+        )
 
-            maskItem: Polygon = mask_manager.getCurrentlyDisplayedMask()
-
-            if maskItem.mask_array is None:
-                continue
-
-            datastr = self.segment_agent.generate_coco_annotations(self.image_path, 0, maskItem.mask_array)
+    def export_shapefile(self, file_path: str):
+        """Export the drawn polygons to a shapefile, GeoPackage, FlatGeobuf or GeoParquet file depending on the extension"""
+        from utils.geometry_io import write_polygons
 
-            data["annotations"].append(datastr)
+        transform, crs = self._get_geotransform()
+        columns, rings = self.annotations.export_columns()
+        # WARNING THROWN HERE DUE TO NO CRS, IT'S FINE THOUGH?
+        write_polygons(file_path, columns, rings, transform, crs)
+
+    def save_project(self, file_path: str):
+        """Save the annotations and the cached embeddings of this image to a .sgmt project on a worker.
+
+        \nSaving over the opened project writes a temporary file, which replaces the project once its memory map is dropped.
+        """
+        columns, rings = self.annotations.export_columns()
+        agent = self.segment_agent
+        cache_keys = list(self.cache_keys_used)
+        image_path = self.image_path
+        image_size = (self.image.width(), self.image.height())
+        project = self.opened_project
+        saving_over = project is not None and os.path.abspath(file_path) == os.path.abspath(project.path)
+        saved_path = f"{file_path}.saving" if saving_over else file_path
 
-        with open(file_path, "w") as f:
-            json.dump(data, f)
+        def runnable():
+            embeddings = agent.cached_embeddings(cache_keys) if hasattr(agent, "cached_embeddings") else {}
+            save_project(saved_path, image_path, image_size, columns, rings, embeddings)
+            if saving_over:
+                # Read while still on the worker, the map is dropped on the GUI thread
+                project.detach_rings()
+
+        def finished(_):
+            if saving_over:
+                try:
+                    self._replace_project_file(project, saved_path)
+                except OSError as e:
+                    show_error(self.main_page, "Could not save the project", f"{file_path} could not be replaced, the project was saved to {saved_path}: {e}")
+            self.project_saved_event.emit()
+
+        def failed(error: Exception):
+            print(f"Could not save the project {file_path}: {error}")
+            self.project_saved_event.emit()
+
+        get_executor().submit(runnable, priority=Priority.EXPORT, name="save project", on_finished=finished, on_failed=failed)
+
+    def _mount_project(self, project: Project):
+        """Serve the project's saved embeddings from its file"""
+        self.opened_project = project
+        if getattr(self.segment_agent, "embedding_cache", None) is not None:
+            embeddings = project.embeddings()
+            self.segment_agent.embedding_cache.mount(embeddings)
+            self.mounted_embeddings.extend(embeddings)
+
+    def _unmount_project(self):
+        self.opened_project = None
+        if self.mounted_embeddings:
+            self.segment_agent.embedding_cache.unmount(self.mounted_embeddings)
+            self.mounted_embeddings.clear()
+
+    def _replace_project_file(self, project: Project, saved_path: str):
+        """Move a project saved over the opened one into place and serve the embeddings from the new file"""
+        opened = self.opened_project is project
+        if opened:
+            self._unmount_project()
+        project.release()
+        os.replace(saved_path, project.path)
+        if opened:
+            self._mount_project(Project(project.path))
 
-    def export_shapefile(self, file_path: str):
-        extension = os.path.splitext(self.image_path)[-1]
+    def import_shapefile(self, file_path: str):
+        """Import polygons from a vector file. Parsing and coordinate transforms run on a worker, scene insertion runs in batches"""
 
-        transform, crs = None, None
-        if extension in [".tif", ".tiff"] and self.image_path:
-            with rasterio.open(self.image_path) as src:
-                transform, crs = src.transform, src.crs
+        notes: list[str] = []
 
-        rows = []
+        def runnable():
+            from utils.geometry_io import read_polygons
+
+            transform, _ = self._get_geotransform()
+            return read_polygons(file_path, transform, notes)
+
+        image = self.image
+
+        def parsed(result):
+            # Dropped if another image was opened while the file was being read, its polygons belong to the previous one
+            if self.image is not image:
+                return
+            self._insert_imported_polygons(file_path, result)
+            if notes:
+                show_error(self.main_page, "Shapefile partly imported", "\n".join(notes))
+
+        get_executor().submit(
+            runnable,
+            priority=Priority.EXPORT,
+            on_finished=parsed,
+            on_failed=lambda error: show_error(self.main_page, "Error importing shapefile", f"{file_path}: {error}"),
+        )
+
+    def _insert_imported_polygons(
+        self, file_path: str, result, record: bool = True, full_rings: list[np.ndarray] = None, on_inserted: Callable[[], None] = None
+    ):
+        """Add imported polygons to the scene a batch at a time so the event loop keeps running between batches.
+
+        \nrecord is False for polygons read back from the autosave journal, they are only journaled again if their id was taken meanwhile.
+        full_rings are the full resolution outlines when the rings in result are simplified for display. on_inserted is called once
+        the last batch is in, not if the import is abandoned.
+        """
+        if result is None:
+            if on_inserted is not None:
+                on_inserted()
+            return
+        columns, rings = result
+
+        # Indexing every insertion individually is what makes large imports slow, so rebuild the index once at the end
+        self.scene.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.NoIndex)
+        remaining_rows = iter(range(len(rings)))
+        toolbox = self.main_page.display_bar.display_bar_toolbox
+        image = self.image
+
+        def insert_batch():
+            # Stop if the image was closed or another one opened while the import was still running
+            if self.image is not image:
+                self.scene.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.BspTreeIndex)
+                return
+
+            # The index is only left off while another batch is queued, a batch that raises must not leave the scene unindexed
+            more_batches = False
+            try:
+                batch = list(islice(remaining_rows, IMPORT_BATCH_SIZE))
+                polygons = []
+
+                for index in batch:
+                    unique_point_x = columns["seed_pnt_x"][index]
+                    unique_point_y = columns["seed_pnt_y"][index]
+                    annotation_id = self.annotations.claim_id(columns["polygon_id"][index])
+
+                    manager = PolygonManager(f"mask{annotation_id}", annotation_id)
+                    manager.setGraphicsView(self)
+
+                    first_point = [unique_point_x, unique_point_y, 1]
+                    polygon_color = QColor(int(columns["red"][index]), int(columns["green"][index]), int(columns["blue"][index]), int(columns["alpha"][index]))
+                    mask_polygon = Polygon(polygon_color, manager, first_point)
+                    manager.clicked_points.append([[unique_point_x, unique_point_y], 1])
+                    mask_polygon.set_name(manager.getName())
+                    mask_polygon.set_display_name(columns["label"][index])
+                    mask_polygon.id = annotation_id
+                    mask_polygon.group_id = columns["group_id"][index]
+                    manager.appendMaskItem(mask_polygon)
+                    manager.displayNextMaskItem()
+                    mask_polygon.drawFixed(rings[index], None if full_rings is None else full_rings[index])
+                    mask_polygon.setZValue(10)
+                    renumbered = not record and annotation_id != columns["polygon_id"][index]
+                    self.annotations.add(manager, (unique_point_x, unique_point_y), record=record or renumbered)
+                    polygons.append(mask_polygon)
+
+                toolbox.add_polygons_to_polygon_list(polygons)
+
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    QTimer.singleShot(0, insert_batch)
+                    more_batches = True
+                    return
+            finally:
+                if not more_batches:
+                    self.scene.setItemIndexMethod(QGraphicsScene.ItemIndexMethod.BspTreeIndex)
 
-        for item in self.scene.items():
-            if isinstance(item, QGraphicsPolygonItem):
-                label = item.get_display_name()
-                polygon_id = item.id
-                group_id = item.group_id
-                color = item.mask_color
-                r, g, b, a = color.red(), color.green(), color.blue(), color.alpha()
+            print(f"Successfully imported {len(rings)} polygons from {file_path}")
+            if on_inserted is not None:
+                on_inserted()
 
-                polygon = item.polygon()
-                points = [(point.x(), point.y()) for point in polygon]
+        insert_batch()
 
-                if len(points) < 3:
-                    continue
+    def _get_geotransform(self):
+        """Return the affine transform and CRS of the loaded image if it is a GeoTIFF, otherwise (None, None)"""
+        from utils.geometry_io import read_georeference
 
-                # If using a tiff file, apply transformation; otherwise, flip Y
-                transformed_points = [transform * (x, y) for x, y in points] if transform else [(x, -y) for x, y in points]
-
-                poly = ShapelyPolygon(transformed_points)
-                seed_point = QPoint(round(item.unique_point[0]), round(item.unique_point[1]))
-                seed_point = self.mapToScene(seed_point)
-
-                rows.append(
-                    {
-                        "polygon_id": polygon_id,
-                        "group_id": group_id,
-                        "label": label,
-                        "geometry": poly,
-                        "seed_pnt_x": seed_point.x(),
-                        "seed_pnt_y": seed_point.y(),
-                        "red": r,
-                        "green": g,
-                        "blue": b,
-                        "alpha": a,
-                    }
-                )
-
-        gdf = gpd.GeoDataFrame(rows, columns=["polygon_id", "group_id", "label", "geometry", "seed_pnt_x", "seed_pnt_y", "red", "green", "blue", "alpha"], crs=crs if crs else None)
-        # WARNING THROWN HERE DUE TO NO CRS, IT'S FINE THOUGH?
-        gdf.to_file(file_path)
+        return read_georeference(self.image_path)
 
-    def import_shapefile(self, file_path: str):
-        try:
-            gdf = gpd.read_file(file_path)
-
-            required_columns = {"polygon_id", "group_id", "label", "geometry", "seed_pnt_x", "seed_pnt_y", "red", "green", "blue", "alpha"}
-            if not required_columns.issubset(gdf.columns):
-                raise ValueError(f"Shapefile is missing required columns: {required_columns - set(gdf.columns)}")
-
-            transform = None
-            if os.path.splitext(self.image_path)[-1] in [".tif", ".tiff"]:
-                with rasterio.open(self.image_path) as src:
-                    transform = ~src.transform
-
-            for _, row in reversed(list(gdf.iterrows())):
-                polygon_id = row["polygon_id"]
-                group_id = row["group_id"]
-                label = row["label"]
-                geometry = row["geometry"]
-                unique_point_x = row["seed_pnt_x"]
-                unique_point_y = row["seed_pnt_y"]
-                r, g, b, a = row["red"], row["green"], row["blue"], row["alpha"]
-
-                manager = PolygonManager(f"polygon")
-                manager.setGraphicsView(self)
-
-                if transform:
-                    points = [transform * (x, y) for x, y in geometry.exterior.coords]
-                else:
-                    points = [(x, -y) for x, y in geometry.exterior.coords]
-
-                first_point = [unique_point_x, unique_point_y, 1]
-                polygon_color = QColor(r, g, b, a)
-                mask_polygon = Polygon(polygon_color, manager, first_point)
-                manager.clicked_points.append([[unique_point_x, unique_point_y], 1])
-                mask_polygon.set_name(manager.getName())
-                mask_polygon.set_display_name(label)
-                mask_polygon.id = polygon_id
-                mask_polygon.group_id = group_id
-                self.existing_mask_ids.append(manager.getName())
-                manager.appendMaskItem(mask_polygon)
-                manager.displayNextMaskItem()
-                mask_polygon.drawFixed(points)
-                mask_polygon.setZValue(10)
-                self.mask_managers.append(manager)
-                self.main_page.display_bar.display_bar_toolbox.add_polygon_to_polygon_list(mask_polygon)
-
-            print(f"Successfully imported {len(gdf)} polygons from {file_path}")
-
-        except Exception as e:
-            print(f"Error importing shapefile: {e}")
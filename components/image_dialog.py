@@ -1,13 +1,18 @@
 from PyQt6.QtWidgets import QWidget, QLabel, QVBoxLayout, QPushButton
 from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtGui import QPixmap, QDragEnterEvent, QDragLeaveEvent, QDropEvent
+import os
 import utils.gui_utils
+from utils.project_file import PROJECT_EXTENSION
+from utils.tiling import IMAGE_EXTENSIONS, find_images
 
 
 class ChooseImageDialog(QWidget):
     """A window that prompts the user to select an image"""
 
     image_chosen = pyqtSignal(str)
+    # Several files or a folder dropped at once, opened as an image session
+    images_chosen = pyqtSignal(list)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -80,19 +85,23 @@ class ChooseImageDialog(QWidget):
         event.accept()
 
     def dropEvent(self, event: QDropEvent):
-        chosenFiles = event.mimeData().urls()
-        if len(chosenFiles) > 1:
-            self.setStyleSheet(self.common_style)
-            return
-        path = chosenFiles[0].toLocalFile()
-        if path == "":
-            event.ignore()
         self.setStyleSheet(self.common_style)
-        if path.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff")):
-            self.image_chosen.emit(path)
+        paths = [url.toLocalFile() for url in event.mimeData().urls() if url.toLocalFile() != ""]
+        if len(paths) == 1 and paths[0].lower().endswith(PROJECT_EXTENSION):
+            self.image_chosen.emit(paths[0])
             event.accept()
-        else:
+            return
+        if len(paths) == 1 and os.path.isdir(paths[0]):
+            paths = find_images(paths[0])
+        images = [path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS)]
+        if not images:
             event.ignore()
+            return
+        if len(images) == 1:
+            self.image_chosen.emit(images[0])
+        else:
+            self.images_chosen.emit(images)
+        event.accept()
 
     def selectImage(self):
         path = utils.gui_utils.get_file_path()
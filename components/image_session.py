@@ -0,0 +1,139 @@
+from typing import TYPE_CHECKING, NamedTuple
+
+from PyQt6.QtCore import QObject, QSize
+from PyQt6.QtGui import QImage
+
+from components.image_canvas import decode_image, fitted_view_transform, render_view, view_cache_key
+from utils.task_executor import Priority, TaskHandle, current_task, get_executor
+from utils.tiling import decoded_size_bytes, image_digest
+
+if TYPE_CHECKING:
+    from segment_agent import SegmentAgent
+
+
+PREFETCH_AHEAD = 2
+DEFAULT_PREFETCH_BUDGET_BYTES = 1024**3
+
+
+class PrefetchedImage(NamedTuple):
+    image: QImage
+    digest: str
+
+
+class ImageSession(QObject):
+    """An ordered list of images annotated one after another.
+
+    \nWhile one image is open, the next PREFETCH_AHEAD images and the previous one are decoded on the prefetch lane, and the view each
+    opens with is rendered and encoded into the embedding cache, so moving to them skips both the decode and the first encode. Decoded
+    images are kept within budget_bytes, counting the ones still being decoded by their header size, and an image that would not fit is
+    not prefetched at all. Images outside the window are dropped. Annotations are not held here, each image's autosave
+    journal puts them back when it is opened again.
+    """
+
+    def __init__(self, paths: list[str], prefetch_ahead: int = PREFETCH_AHEAD, budget_bytes: int = DEFAULT_PREFETCH_BUDGET_BYTES, parent=None):
+        super().__init__(parent)
+        self.paths = paths
+        self.index = 0
+        self.prefetch_ahead = prefetch_ahead
+        self.budget_bytes = budget_bytes
+        self._prefetched: dict[str, PrefetchedImage] = {}
+        self._tasks: dict[str, TaskHandle] = {}
+        self._task_bytes: dict[str, int] = {}
+
+    @property
+    def current_path(self) -> str:
+        return self.paths[self.index]
+
+    def position_text(self) -> str:
+        return f"{self.index + 1}/{len(self.paths)}"
+
+    def has_previous(self) -> bool:
+        return self.index > 0
+
+    def has_next(self) -> bool:
+        return self.index < len(self.paths) - 1
+
+    def move(self, step: int) -> str:
+        self.index = max(0, min(len(self.paths) - 1, self.index + step))
+        return self.current_path
+
+    def take(self, path: str) -> PrefetchedImage | None:
+        """The decoded image for the path if it was prefetched, removed from the session so the canvas owns it"""
+        return self._prefetched.pop(path, None)
+
+    def keep(self, path: str, prefetched: PrefetchedImage):
+        """Hold on to an image that is being left, so going back to it is instant too"""
+        if path in self._window() and prefetched.digest is not None and self._fits(prefetched.image.sizeInBytes()):
+            self._prefetched[path] = prefetched
+
+    def _window(self) -> list[str]:
+        """Paths worth keeping decoded, nearest first"""
+        indices = [self.index + offset for offset in range(1, self.prefetch_ahead + 1)] + [self.index - 1]
+        return [self.paths[index] for index in indices if 0 <= index < len(self.paths)]
+
+    def _used_bytes(self) -> int:
+        return sum(prefetched.image.sizeInBytes() for prefetched in self._prefetched.values()) + sum(self._task_bytes.values())
+
+    def _fits(self, size_bytes: int) -> bool:
+        return self._used_bytes() + size_bytes <= self.budget_bytes
+
+    def prefetch(self, agent: "SegmentAgent", view_size: QSize):
+        """Start decoding and encoding the neighbours of the current image. view_size is the canvas viewport without scroll bars"""
+        window = self._window()
+        for path in [path for path in self._prefetched if path not in window]:
+            del self._prefetched[path]
+        # The current image's task keeps running, its embedding is what the first click looks up
+        for path in [path for path in self._tasks if path not in window and path != self.current_path]:
+            self._tasks.pop(path).cancel()
+            self._task_bytes.pop(path, None)
+
+        # Only an in-process agent can encode without replacing the image it is segmenting
+        encode = hasattr(agent, "compute_image_state") and getattr(agent, "embedding_cache", None) is not None
+        width, height = view_size.width(), view_size.height()
+
+        for path in window:
+            if path in self._prefetched or path in self._tasks or path == self.current_path:
+                continue
+            try:
+                size_bytes = decoded_size_bytes(path)
+            except (OSError, ValueError):
+                # Not decodable either, opening it reports the error
+                continue
+            if not self._fits(size_bytes):
+                continue
+
+            def runnable(path=path) -> PrefetchedImage:
+                digest = image_digest(path)
+                image = decode_image(path)
+                current_task().raise_if_cancelled()
+                if encode:
+                    transform = fitted_view_transform(image.width(), image.height(), width, height)
+                    agent.compute_image_state(render_view(image, transform, width, height), view_cache_key(digest, transform, width, height))
+                return PrefetchedImage(image, digest)
+
+            self._task_bytes[path] = size_bytes
+            self._tasks[path] = get_executor().submit(
+                runnable,
+                priority=Priority.PREFETCH,
+                name=f"prefetch {path}",
+                on_finished=lambda prefetched, path=path: self._prefetched_listener(path, prefetched),
+                on_failed=lambda _, path=path: self._task_settled(path),
+                on_cancelled=lambda path=path: self._task_settled(path),
+            )
+
+    def _task_settled(self, path: str):
+        self._tasks.pop(path, None)
+        self._task_bytes.pop(path, None)
+
+    def _prefetched_listener(self, path: str, prefetched: PrefetchedImage):
+        self._task_settled(path)
+        # The embedding is in the disk cache either way, the decoded image is only kept if it is still wanted and fits
+        if path in self._window() and path != self.current_path and self._fits(prefetched.image.sizeInBytes()):
+            self._prefetched[path] = prefetched
+
+    def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._task_bytes.clear()
+        self._prefetched.clear()
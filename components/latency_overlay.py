@@ -0,0 +1,55 @@
+from PyQt6.QtWidgets import QLabel, QWidget
+from PyQt6.QtGui import QFont
+from PyQt6.QtCore import Qt, QTimer
+
+from utils.latency_monitor import REPORTED_PERCENTILES, get_monitor
+
+REFRESH_INTERVAL_MS = 500
+OVERLAY_MARGIN = 8
+
+
+class LatencyOverlay(QLabel):
+    """Live per-stage latency table drawn over the top left corner of the canvas.
+
+    \nShowing the overlay enables the latency monitor and hiding it disables it again, so the spans cost nothing while it is off.
+    The overlay is a child widget, not a scene item, so it is never part of the screenshot that gets encoded.
+    """
+
+    def __init__(self, parent: QWidget):
+        super().__init__(parent)
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 170); color: rgb(230, 230, 230); padding: 6px; border-radius: 4px;")
+        font = QFont("Monospace")
+        font.setStyleHint(QFont.StyleHint.TypeWriter)
+        self.setFont(font)
+        self.move(OVERLAY_MARGIN, OVERLAY_MARGIN)
+        self.hide()
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(REFRESH_INTERVAL_MS)
+        self._timer.timeout.connect(self.refresh)
+
+    def set_enabled(self, enabled: bool):
+        get_monitor().set_enabled(enabled)
+        if enabled:
+            self.refresh()
+            self.show()
+            self.raise_()
+            self._timer.start()
+        else:
+            self._timer.stop()
+            self.hide()
+
+    def refresh(self):
+        summary = get_monitor().summary()
+        header = f"{'stage':<16}{'n':>6}{'last':>9}" + "".join(f"{f'p{p}':>9}" for p in REPORTED_PERCENTILES)
+        lines = [header]
+        for name, stage in summary.items():
+            if stage["count"] == 0:
+                continue
+            values = "".join(f"{stage[f'p{p}']:9.1f}" for p in REPORTED_PERCENTILES)
+            lines.append(f"{name:<16}{stage['count']:>6}{stage['last']:9.1f}{values}")
+        if len(lines) == 1:
+            lines.append("no samples yet, times in ms")
+        self.setText("\n".join(lines))
+        self.adjustSize()
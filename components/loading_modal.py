@@ -105,6 +105,18 @@ class LoadingModal(QtWidgets.QWidget):
         self.hide()
         return res
 
+    def set_progress(self, done: int, total: int):
+        """Show byte progress under the modal text"""
+        megabyte = 1024 * 1024
+        if total > 0:
+            self.title.setText(f"{self.text}\n{done / megabyte:.0f} / {total / megabyte:.0f} MB ({100 * done / total:.0f}%)")
+        else:
+            self.title.setText(f"{self.text}\n{done / megabyte:.0f} MB")
+
+    def set_text(self, text: str):
+        self.text = text
+        self.title.setText(text)
+
     def start(self):
         self.show()
 
@@ -1,17 +1,18 @@
-from PyQt6.QtWidgets import QMenuBar
-from PyQt6.QtGui import QAction, QActionGroup, QColor
-from PyQt6.QtCore import Qt, pyqtSignal, QRectF, QPoint, QEvent, QObject, QBuffer, pyqtBoundSignal
-
-from segment_agent import SegmentAgent
-from utils.async_worker import AsyncWorker
-from utils.checkpoint_downloader import CheckpointDownloader
-from utils.polygon import Polygon
-from utils.tool_mode import ToolMode
+from PyQt6.QtWidgets import QMenuBar, QMenu
+from PyQt6.QtGui import QAction, QActionGroup
+from PyQt6.QtCore import pyqtSignal
+
+from components.hover_preview import DEFAULT_PREVIEW_BUDGET_MS, DEFAULT_PREVIEW_RATE, PREVIEW_BUDGETS_MS, PREVIEW_RATES
 import utils.gui_utils as utils
 
 
 class MenuBar(QMenuBar):
     select_image_event = pyqtSignal()
+    select_folder_event = pyqtSignal()
+    open_project_event = pyqtSignal()
+    save_project_event = pyqtSignal()
+    previous_image_event = pyqtSignal()
+    next_image_event = pyqtSignal()
     close_canvas_event = pyqtSignal()
     export_image_event = pyqtSignal()
     export_json_event = pyqtSignal()
@@ -21,6 +22,12 @@ class MenuBar(QMenuBar):
     redo_clicked_event = pyqtSignal()
     color_masks_by_type_event = pyqtSignal()
     toggle_display_bar_event = pyqtSignal()
+    toggle_hover_preview_event = pyqtSignal(bool)
+    toggle_latency_overlay_event = pyqtSignal(bool)
+    dump_latency_event = pyqtSignal()
+    toggle_refine_masks_event = pyqtSignal(bool)
+    preview_rate_event = pyqtSignal(int)
+    preview_budget_event = pyqtSignal(int)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -35,6 +42,26 @@ class MenuBar(QMenuBar):
         self.open_act.setShortcut("Ctrl+O")
         self.open_act.triggered.connect(lambda: self.select_image_event.emit())
 
+        self.open_folder_act = QAction(utils.createIcon("file_open.png"), "Open Image Folder", self)
+        self.open_folder_act.setShortcut("Ctrl+Shift+O")
+        self.open_folder_act.triggered.connect(lambda: self.select_folder_event.emit())
+
+        self.open_project_act = QAction(utils.createIcon("file_open.png"), "Open Project", self)
+        self.open_project_act.triggered.connect(lambda: self.open_project_event.emit())
+
+        self.save_project_act = QAction(utils.createIcon("export.png"), "Save Project", self)
+        self.save_project_act.setShortcut("Ctrl+S")
+        self.save_project_act.triggered.connect(lambda: self.save_project_event.emit())
+
+        self.previous_image_act = QAction("Previous Image", self)
+        self.previous_image_act.setShortcut("PgUp")
+        self.previous_image_act.triggered.connect(lambda: self.previous_image_event.emit())
+
+        self.next_image_act = QAction("Next Image", self)
+        self.next_image_act.setShortcut("PgDown")
+        self.next_image_act.triggered.connect(lambda: self.next_image_event.emit())
+        self.set_session_navigation(False, False)
+
         self.close_act = QAction(utils.createIcon("close.png"), "Close Image", self)
         self.close_act.triggered.connect(lambda: self.close_canvas_event.emit())
 
@@ -58,15 +85,39 @@ class MenuBar(QMenuBar):
         self.redo_act.setShortcut("Ctrl+Y")
         self.redo_act.triggered.connect(lambda: self.redo_clicked_event.emit())
 
+        self.refine_masks_act = QAction("Refine Masks at Native Resolution", self)
+        self.refine_masks_act.setCheckable(True)
+        self.refine_masks_act.toggled.connect(lambda checked: self.toggle_refine_masks_event.emit(checked))
+
         self.bulk_coloring_act = QAction(utils.createIcon("palette.png"), "Color Masks by Type", self)
         self.bulk_coloring_act.triggered.connect(lambda: self.color_masks_by_type_event.emit())
 
         self.toggle_view_act = QAction(utils.createIcon("right_menu_open.png"), "Toggle Mask Menu", self)
         self.toggle_view_act.triggered.connect(lambda: self.toggle_display_bar_event.emit())
 
+        self.hover_preview_act = QAction("Hover Preview", self)
+        self.hover_preview_act.setCheckable(True)
+        self.hover_preview_act.setShortcut("Ctrl+P")
+        self.hover_preview_act.toggled.connect(lambda checked: self.toggle_hover_preview_event.emit(checked))
+
+        self.latency_overlay_act = QAction("Latency Overlay", self)
+        self.latency_overlay_act.setCheckable(True)
+        self.latency_overlay_act.setShortcut("Ctrl+Shift+L")
+        self.latency_overlay_act.toggled.connect(lambda checked: self.toggle_latency_overlay_event.emit(checked))
+
+        self.dump_latency_act = QAction("Dump Latency Samples", self)
+        self.dump_latency_act.triggered.connect(lambda: self.dump_latency_event.emit())
+
         file_menu = self.addMenu("File")
         file_menu.addAction(self.open_act)
+        file_menu.addAction(self.open_folder_act)
+        file_menu.addAction(self.open_project_act)
+        file_menu.addAction(self.save_project_act)
         file_menu.addAction(self.close_act)
+        file_menu.addSeparator()
+        file_menu.addAction(self.previous_image_act)
+        file_menu.addAction(self.next_image_act)
+        file_menu.addSeparator()
         file_menu.addAction(self.export_act)
         # file_menu.addAction(self.export_json_act)
         file_menu.addAction(self.export_shapefile_act)
@@ -75,6 +126,32 @@ class MenuBar(QMenuBar):
         edit_menu = self.addMenu("Edit")
         edit_menu.addAction(self.undo_act)
         edit_menu.addAction(self.redo_act)
+        edit_menu.addSeparator()
+        edit_menu.addAction(self.refine_masks_act)
         # edit_menu.addAction(self.bulk_coloring_act)
         view_menu = self.addMenu("View")
         view_menu.addAction(self.toggle_view_act)
+        view_menu.addSeparator()
+        view_menu.addAction(self.hover_preview_act)
+        self._add_choice_menu(view_menu, "Preview Rate", [(f"{rate} per second", rate) for rate in PREVIEW_RATES], DEFAULT_PREVIEW_RATE, self.preview_rate_event)
+        budgets = [(f"{budget} ms", budget) for budget in PREVIEW_BUDGETS_MS]
+        self._add_choice_menu(view_menu, "Preview Latency Budget", budgets, DEFAULT_PREVIEW_BUDGET_MS, self.preview_budget_event)
+        view_menu.addSeparator()
+        view_menu.addAction(self.latency_overlay_act)
+        view_menu.addAction(self.dump_latency_act)
+
+    def set_session_navigation(self, has_previous: bool, has_next: bool):
+        self.previous_image_act.setEnabled(has_previous)
+        self.next_image_act.setEnabled(has_next)
+
+    def _add_choice_menu(self, parent_menu: QMenu, title: str, choices: list[tuple[str, int]], default: int, signal):
+        """Add a submenu of mutually exclusive options that emits the chosen value"""
+        menu = parent_menu.addMenu(title)
+        group = QActionGroup(menu)
+        for text, value in choices:
+            action = QAction(text, menu)
+            action.setCheckable(True)
+            action.setChecked(value == default)
+            action.triggered.connect(lambda _, value=value: signal.emit(value))
+            group.addAction(action)
+            menu.addAction(action)
@@ -0,0 +1,44 @@
+import argparse
+import warnings
+
+from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE, SAM_CHECKPOINTS, CheckpointDownloader
+from utils.inference_service import DEFAULT_PORT, InferenceService, make_server
+
+
+warnings.simplefilter(action="ignore", category=FutureWarning)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve one segmentation model to several Image Segmenter sessions over localhost HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, keep it on localhost unless the network is trusted")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--model-type", default=DEFAULT_MODEL_TYPE, choices=sorted(SAM_CHECKPOINTS))
+    parser.add_argument("--device", default=None, help="torch device, defaults to cuda when available")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0, help="how long to collect decoder requests before running them together")
+    parser.add_argument("--max-batch", type=int, default=16)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    downloader = CheckpointDownloader([args.model_type])
+    if not downloader.all_checkpoints_downloaded():
+        raise SystemExit(f"No {args.model_type} checkpoint found, start the application once to download it")
+
+    from segment_agent import SegmentAgent
+
+    agent = SegmentAgent(args.model_type, args.device, load_encoder=True)
+    service = InferenceService(agent, args.batch_window_ms / 1000, args.max_batch)
+    server = make_server(service, args.host, args.port)
+    print(f"Serving {args.model_type} on {agent.device} at http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
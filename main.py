@@ -1,19 +1,97 @@
 import sys
-import ctypes
+import argparse
 import warnings
 
-from PyQt6.QtWidgets import QApplication
 
-from main_page import MainPage
+warnings.simplefilter(action="ignore", category=FutureWarning)
 
 
-warnings.simplefilter(action="ignore", category=FutureWarning)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Image Segmenter")
+    parser.add_argument(
+        "--profile-startup",
+        nargs="?",
+        const="startup_profile.json",
+        default=None,
+        metavar="PATH",
+        help="time imports and startup phases until the segment agent is ready or fails to load, write the report to PATH and exit",
+    )
+    parser.add_argument(
+        "--inference-process",
+        action="store_true",
+        help="run the segmentation model in a separate process so inference does not stall the interface",
+    )
+    parser.add_argument(
+        "--inference-server",
+        default=None,
+        metavar="URL",
+        help="use a running inference_server.py (e.g. http://127.0.0.1:8765) instead of loading a model",
+    )
+    parser.add_argument(
+        "--record-session",
+        default=None,
+        metavar="PATH",
+        help="log clicks, zooms, pans, undo/redo and erases to PATH for replay_session.py",
+    )
+    return parser.parse_args()
 
-if __name__ == "__main__":
-    myappid = "ccom.segmentationpainter.segmentationpainter.1.0"
-    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)  # set taskbar icon
-    app = QApplication([])
-    window = MainPage()
-    window.show()
+
+def main():
+    args = parse_args()
+
+    profiler = None
+    if args.profile_startup is not None:
+        from utils.startup_profiler import StartupProfiler
+
+        profiler = StartupProfiler()
+        profiler.install()
+
+    def phase(name: str):
+        from contextlib import nullcontext
+
+        return profiler.phase(name) if profiler is not None else nullcontext()
+
+    with phase("import PyQt6"):
+        from PyQt6.QtWidgets import QApplication
+        from PyQt6.QtCore import QTimer
+
+    with phase("import main_page"):
+        from main_page import MainPage
+        from utils.task_executor import get_executor
+
+    if sys.platform == "win32":
+        import ctypes
+
+        myappid = "ccom.segmentationpainter.segmentationpainter.1.0"
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)  # set taskbar icon
+
+    with phase("create QApplication"):
+        app = QApplication(sys.argv[:1])
+        app.aboutToQuit.connect(get_executor().shutdown)
+    with phase("create MainPage"):
+        window = MainPage(
+            inference_process=args.inference_process,
+            inference_server=args.inference_server,
+            record_session=args.record_session,
+        )
+    with phase("show window"):
+        window.show()
+
+    if profiler is not None:
+        QTimer.singleShot(0, lambda: profiler.mark("first event loop tick"))
+
+        def write_profile(mark: str, exit_code: int):
+            profiler.mark(mark)
+            profiler.uninstall()
+            profiler.write(args.profile_startup)
+            app.exit(exit_code)
+
+        window.segment_agent_ready_event.connect(lambda: write_profile("segment agent ready", 0))
+        # A failed checkpoint download or model load would otherwise leave the profiled run waiting forever
+        window.segment_agent_failed_event.connect(lambda error: write_profile("segment agent failed", 1))
 
     sys.exit(app.exec())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,61 @@
+import os
+
 from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QColorDialog, QLayout
 from PyQt6.QtGui import QAction, QColor
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, pyqtSignal, pyqtBoundSignal
 
 from components.display_bar.display_bar import DisplayBar
 from components.image_canvas import ImageCanvas
 from components.image_dialog import ChooseImageDialog
+from components.image_session import ImageSession, PrefetchedImage
 from components.loading_modal import LoadingModal
 from components.color_modal import ColorModal
 from components.menu_bar import MenuBar
 from components.tool_bar import ToolBar
 
-from segment_agent import SegmentAgent
-from utils.async_worker import AsyncWorker
+from utils.task_executor import Priority, get_executor
+from utils.latency_monitor import get_monitor
+from utils.session_recorder import SessionRecorder
 from utils.checkpoint_downloader import CheckpointDownloader
 from utils.tool_mode import ToolMode
+from utils.project_file import PROJECT_EXTENSION, Project
+from utils.tiling import find_images
 import utils.gui_utils as utils
 
+from typing import TYPE_CHECKING
+
+# segment_agent pulls in torch and segment_anything, so it is imported on the loader thread instead of at startup
+if TYPE_CHECKING:
+    from segment_agent import SegmentAgent
+
 
 class MainPage(QMainWindow):
     """The main page of the application. This page handles creation of the top menu bar and the left tool bar.
     \nIt also creates a dialog for choosing images, handles loading screens, and manages the image canvas responsible for displaying and editing images.
     \nWindow visibility and segment agent creation is also handled here."""
 
-    def __init__(self):
+    segment_agent_ready_event: pyqtBoundSignal = pyqtSignal()
+    segment_agent_failed_event: pyqtBoundSignal = pyqtSignal(str)
+
+    def __init__(self, inference_process: bool = False, inference_server: str = None, record_session: str = None):
         super().__init__()
+        self.inference_process = inference_process
+        self.inference_server = inference_server
         self.margin_height: int = 200
         self.margin_width: int = 400
         self.loading_modal: LoadingModal = None
         self.image_canvas = ImageCanvas(self)
+        if record_session is not None:
+            self.image_canvas.session_recorder = SessionRecorder(record_session)
         self.display_bar = DisplayBar(self.image_canvas)
+        self.image_session: ImageSession = None
 
         self.display_bar.display_bar_toolbox.export_image_event.connect(self.export_image)
         self.display_bar.display_bar_toolbox.strength_slider_change_event.connect(self._update_sam_strength_listener)
         self.image_canvas.tab_key_pressed_event.connect(self._tab_key_pressed_listener)
+        # Connected once, a prefetched image of a session is displayed before load_image returns
+        self.image_canvas.image_loaded_event.connect(self._image_canvas_loaded_listener)
+        self.image_canvas.image_load_failed_event.connect(self._image_canvas_load_failed_listener)
 
         self._init_window()
 
@@ -56,10 +79,12 @@ class MainPage(QMainWindow):
         self.tool_bar = self._init_tool_bar()
         self.actions: list[QAction] = self.tool_bar.get_actions()
 
-        downloader = CheckpointDownloader()
+        self.checkpoint_downloader = downloader = CheckpointDownloader()
         if not downloader.all_checkpoints_downloaded():
             self.show_loading_modal("Downloading\ncheckpoints")
             downloader.checkpoints_downloaded.connect(self._load_segment_agent)
+            downloader.download_progress.connect(self.loading_modal.set_progress)
+            downloader.download_failed.connect(self._checkpoint_download_failed_listener)
             downloader.download_sam_checkpoints()
         else:
             self._load_segment_agent()
@@ -70,6 +95,11 @@ class MainPage(QMainWindow):
         self.setMenuBar(menu_bar)
         menu_bar.setEnabled(False)
         menu_bar.select_image_event.connect(self.select_image)
+        menu_bar.select_folder_event.connect(self.select_folder)
+        menu_bar.open_project_event.connect(self.select_project)
+        menu_bar.save_project_event.connect(self.save_project)
+        menu_bar.previous_image_event.connect(lambda: self.move_in_session(-1))
+        menu_bar.next_image_event.connect(lambda: self.move_in_session(1))
         menu_bar.close_canvas_event.connect(self.close_image_canvas)
         menu_bar.export_image_event.connect(self.export_image)
         menu_bar.export_json_event.connect(self.export_json)
@@ -79,6 +109,14 @@ class MainPage(QMainWindow):
         menu_bar.redo_clicked_event.connect(self._redo_clicked_listener)
         # menu_bar.color_masks_by_type_event.connect(self._change_polygon_colors_listener) disabled for now due to crash/bad gui
         menu_bar.toggle_display_bar_event.connect(self._toggle_display_bar_listener)
+        menu_bar.toggle_refine_masks_event.connect(self.image_canvas.set_refine_masks)
+        hover_preview = self.image_canvas.hover_preview
+        menu_bar.toggle_hover_preview_event.connect(hover_preview.set_enabled)
+        menu_bar.preview_rate_event.connect(hover_preview.set_rate)
+        menu_bar.preview_budget_event.connect(hover_preview.set_budget)
+        hover_preview.timing_updated.connect(self.display_bar.get_coordinate_display_widget().update_preview_timing)
+        menu_bar.toggle_latency_overlay_event.connect(self.image_canvas.latency_overlay.set_enabled)
+        menu_bar.dump_latency_event.connect(self.dump_latency_samples)
         return menu_bar
 
     def _init_tool_bar(self):
@@ -90,6 +128,12 @@ class MainPage(QMainWindow):
         tool_bar.palette_event.connect(self._change_brush_color_listener)
         return tool_bar
 
+    def _checkpoint_download_failed_listener(self, error: str):
+        """Leave the modal up with the error, the next launch resumes the partial download"""
+        print(f"Checkpoint download failed: {error}")
+        self.loading_modal.set_text("Download failed\nRestart to resume")
+        self.segment_agent_failed_event.emit(f"Checkpoint download failed: {error}")
+
     def show_loading_modal(self, text: str):
         """Displays a loading modal"""
         self.loading_modal = LoadingModal(self, text)
@@ -101,22 +145,70 @@ class MainPage(QMainWindow):
             self.loading_modal.stop()
 
         def runnable():
+            if self.inference_server is not None:
+                from utils.inference_service import ServiceSegmentAgent
+
+                return ServiceSegmentAgent(self.inference_server)
+
+            if self.inference_process:
+                from utils.inference_process import RemoteSegmentAgent
+
+                return RemoteSegmentAgent()
+
+            from segment_agent import SegmentAgent
+
             return SegmentAgent()
 
-        self.agent_loader_worker = AsyncWorker(runnable)
-        self.agent_loader_worker.job_done.connect(self._segment_agent_loaded_listener)
-        self.agent_loader_worker.start()
+        get_executor().submit(
+            runnable,
+            priority=Priority.INTERACTIVE,
+            on_finished=self._segment_agent_loaded_listener,
+            on_failed=self._segment_agent_failed_listener,
+        )
 
-    def _segment_agent_loaded_listener(self, agent: SegmentAgent):
-        """Callback that is fired when SAM finishes loading"""
+    def _segment_agent_failed_listener(self, error: Exception):
+        utils.show_error(self, "Failed to load the segment agent", str(error))
+        self.segment_agent_failed_event.emit(f"Failed to load the segment agent: {error}")
+
+    def _segment_agent_loaded_listener(self, agent: "SegmentAgent"):
+        """Callback that is fired when the SAM decoder is ready. The image encoder keeps loading in the background"""
         self.segment_agent = agent
+        get_executor().submit(
+            agent.load_encoder,
+            priority=Priority.PREFETCH,
+            on_finished=lambda _: self.segment_agent_ready_event.emit(),
+            on_failed=self._encoder_failed_listener,
+        )
         self.image_canvas.set_segment_agent(self.segment_agent)
         self.choose_image_dialog = ChooseImageDialog(self)
         self.choose_image_dialog.image_chosen.connect(self._image_chosen_listener)
+        self.choose_image_dialog.images_chosen.connect(self.open_session)
         self.container_layout.addWidget(self.choose_image_dialog)
 
+    def _encoder_failed_listener(self, error: Exception):
+        utils.show_error(self, "Failed to load the image encoder", f"{error}\n\nClicks cannot be segmented until the checkpoint is fixed.")
+        self.segment_agent_failed_event.emit(f"Failed to load the image encoder: {error}")
+
     def _image_chosen_listener(self, file_path: str):
-        """Load the given file into the image canvas"""
+        """Load the given file into the image canvas, or the project and its image for a .sgmt file"""
+        if file_path.lower().endswith(PROJECT_EXTENSION):
+            self.open_project(file_path)
+            return
+        self._end_session()
+        self._open_image(file_path)
+
+    def open_project(self, file_path: str):
+        """Open a project's image with the project's annotations"""
+        try:
+            project = Project(file_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not open the project {file_path}: {e}")
+            return
+        self._end_session()
+        self._open_image(project.image_path, project=project)
+
+    def _open_image(self, file_path: str, prefetched: PrefetchedImage = None, project: Project = None):
+        """Show the image canvas and load the file into it, behind the loading modal unless the image was prefetched"""
         self.display_bar.close()
         self.image_canvas.close()
         self.choose_image_dialog.hide()
@@ -124,18 +216,19 @@ class MainPage(QMainWindow):
         self.central_layout.addWidget(self.display_bar)
         self.image_canvas.show()
         self.display_bar.show()
-        self.show_loading_modal("Loading image")
+        if prefetched is None:
+            self.show_loading_modal("Loading image")
 
         self.margin_height = 50
         self.margin_width = 50
         self.container_layout.setContentsMargins(self.margin_width, self.margin_height, self.margin_width, self.margin_height)
 
-        self.image_canvas.load_image(file_path)
-        self.image_canvas.image_loaded_event.connect(self._image_canvas_loaded_listener)
+        self.image_canvas.load_image(file_path, prefetched, project)
 
     def _image_canvas_loaded_listener(self):
         """Callback that is fired when the image canvas loads the given file"""
-        self.loading_modal.stop()
+        if self.loading_modal is not None:
+            self.loading_modal.stop()
 
         self.actions[0].setChecked(True)
 
@@ -145,6 +238,72 @@ class MainPage(QMainWindow):
         self.menu_bar.setEnabled(True)
         self.tool_bar.setEnabled(True)
 
+        session = self.image_session
+        if session is not None:
+            session.prefetch(self.segment_agent, self.image_canvas.maximumViewportSize())
+            self.menu_bar.set_session_navigation(session.has_previous(), session.has_next())
+            self.setWindowTitle(f"Image Segmenter - {os.path.basename(session.current_path)} ({session.position_text()})")
+
+    def _image_canvas_load_failed_listener(self, message: str):
+        """Take down the loading modal and go back to choosing an image"""
+        if self.loading_modal is not None:
+            self.loading_modal.stop()
+        self.close_image_canvas()
+        utils.show_error(self, "Could not open the image", message)
+
+    def open_session(self, file_paths: list[str]):
+        """Open several images to annotate one after another, the next ones are prefetched while the first is open"""
+        if not file_paths:
+            return
+        self._end_session()
+        self.image_session = ImageSession(file_paths, parent=self)
+        self._open_image(self.image_session.current_path)
+
+    def move_in_session(self, step: int):
+        """Open the previous or next image of the session, keeping the one being left decoded"""
+        session = self.image_session
+        if session is None or self.image_canvas.image is None:
+            return
+        if (step < 0 and not session.has_previous()) or (step > 0 and not session.has_next()):
+            return
+        left_path = session.current_path
+        left_image = PrefetchedImage(self.image_canvas.image, self.image_canvas.image_digest)
+
+        file_path = session.move(step)
+        session.keep(left_path, left_image)
+        self._open_image(file_path, session.take(file_path))
+
+    def _end_session(self):
+        if self.image_session is None:
+            return
+        self.image_session.close()
+        self.image_session = None
+        self.menu_bar.set_session_navigation(False, False)
+        self.setWindowTitle("Image Segmenter")
+
+    def select_folder(self):
+        """Called from the menu bar. Opens every image in a folder as a session"""
+        folder = utils.get_folder_path()
+        if folder == "":
+            return
+        self.open_session(find_images(folder))
+
+    def select_project(self):
+        """Called from the menu bar. Opens a .sgmt project"""
+        file_path = utils.get_project_path()
+        if file_path == "":
+            return
+        self.open_project(file_path)
+
+    def save_project(self):
+        """Save the annotations and cached embeddings of the open image to a .sgmt project"""
+        if self.image_canvas.image is None:
+            return
+        path = utils.save_project_path()
+        if path == "":
+            return
+        self.image_canvas.save_project(path)
+
     def select_image(self):
         """Called from the menu bar. Selects and loads an image into the image canvas"""
         file_path = utils.get_file_path()
@@ -156,6 +315,7 @@ class MainPage(QMainWindow):
         """Closes currently displayed image canvas, reverting to image selection state"""
         if self.image_canvas == None:
             return
+        self._end_session()
         self.choose_image_dialog.show()
         self.image_canvas.close()
         self.display_bar.close()
@@ -186,14 +346,20 @@ class MainPage(QMainWindow):
         path = utils.save_json_path(image_path)
         if path == "":
             return
-        self.image_canvas.export_json(path)
+        try:
+            self.image_canvas.export_json(path)
+        except Exception as e:
+            utils.show_error(self, "Could not export the annotations", f"{path}: {e}")
 
     def export_shapefile(self):
         """Export the drawn masks to a shapefile"""
         path = utils.save_shapefile_path()
         if path == "":
             return
-        self.image_canvas.export_shapefile(path)
+        try:
+            self.image_canvas.export_shapefile(path)
+        except Exception as e:
+            utils.show_error(self, "Could not export the shapefile", f"{path}: {e}")
 
     def import_shapefile(self):
         path = utils.import_shapefile_path()
@@ -201,6 +367,21 @@ class MainPage(QMainWindow):
             return
         self.image_canvas.import_shapefile(path)
 
+    def dump_latency_samples(self):
+        """Write the recorded latency spans to a JSON lines file for offline analysis"""
+        path = utils.save_latency_path()
+        if path == "":
+            return
+        monitor = get_monitor()
+        get_executor().submit(
+            monitor.dump,
+            path,
+            priority=Priority.EXPORT,
+            name="dump latency samples",
+            on_finished=lambda count: print(f"Wrote {count} latency samples to {path}"),
+            on_failed=lambda error: print(f"Could not write latency samples: {error}"),
+        )
+
     def _export_image_finished_listener(self):
         """Callback that is fired when an export is finished"""
         self.menu_bar.setEnabled(True)
@@ -251,12 +432,7 @@ class MainPage(QMainWindow):
                     self.image_canvas.set_polygon_brush_color(color)
 
     def _change_polygon_colors_listener(self):
-        mask_list = self.display_bar.display_bar_toolbox.polygon_list
-        unique_types = []
-        for i in range(mask_list.count()):
-            mask_type = mask_list.itemWidget(mask_list.item(i)).mask_item.get_display_name()
-            if mask_type not in unique_types:
-                unique_types.append(mask_type)
+        unique_types = self.image_canvas.annotations.labels_in_use()
 
         color_modal = ColorModal(self, unique_types)
         color_modal.apply_color_signal.connect(self._execute_polygon_color_changes_listener)
@@ -264,9 +440,14 @@ class MainPage(QMainWindow):
         color_modal.start()
 
     def _execute_polygon_color_changes_listener(self, mask_class: str, color: QColor):
-        for manager in self.image_canvas.mask_managers:
-            if mask_class == manager.getCurrentlyDisplayedMask().get_display_name():
-                manager.getCurrentlyDisplayedMask().set_color(color)
+        annotations = self.image_canvas.annotations
+        annotations.recolor(annotations.filter_rows(label=mask_class), color)
+
+    def closeEvent(self, event):
+        self.image_canvas.close_journal()
+        if self.image_canvas.session_recorder is not None:
+            self.image_canvas.session_recorder.close()
+        super().closeEvent(event)
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -0,0 +1,111 @@
+import argparse
+import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE, SAM_CHECKPOINTS, CheckpointDownloader
+from utils.embedding_cache import CACHE_DIRECTORY, EmbeddingCache
+from utils.tiling import find_images, image_digest, open_image, region_cache_key, tile_grid
+
+
+warnings.simplefilter(action="ignore", category=FutureWarning)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Encode every native resolution tile of the images in a folder into the embedding cache, so refining masks on them is instant"
+    )
+    parser.add_argument("folder", help="folder of images and GeoTIFFs")
+    parser.add_argument("--recursive", action="store_true", help="include images in subfolders")
+    parser.add_argument("--model-type", default=DEFAULT_MODEL_TYPE, choices=sorted(SAM_CHECKPOINTS))
+    parser.add_argument("--device", default=None, help="torch device, defaults to cuda when available. Entries are only used on the same device")
+    parser.add_argument("--batch-size", type=int, default=4, help="tiles encoded together in one encoder pass")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for the encoder, defaults to all cores")
+    parser.add_argument("--cache-dir", default=CACHE_DIRECTORY)
+    parser.add_argument("--cache-size-gb", type=float, default=None, help="raise the cache's size limit, saved with the cache for the application")
+    return parser.parse_args()
+
+
+def read_image(file_path: str) -> tuple[str, np.ndarray]:
+    """File digest and RGB pixels, read on a thread while the previous image is encoding"""
+    digest = image_digest(file_path)
+    pixels = np.asarray(open_image(file_path))[:, :, :3]
+    return digest, pixels
+
+
+def main():
+    args = parse_args()
+
+    paths = find_images(args.folder, args.recursive)
+    if not paths:
+        raise SystemExit(f"No images found in {args.folder}")
+
+    downloader = CheckpointDownloader([args.model_type])
+    if not downloader.all_checkpoints_downloaded():
+        raise SystemExit(f"No {args.model_type} checkpoint found, start the application once to download it")
+
+    import torch
+    from segment_agent import SegmentAgent
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    agent = SegmentAgent(args.model_type, args.device, load_encoder=True)
+    agent.embedding_cache = EmbeddingCache(args.cache_dir)
+    if args.cache_size_gb is not None:
+        agent.embedding_cache.set_max_bytes(int(args.cache_size_gb * 1024**3))
+    print(f"Encoding {len(paths)} images with {args.model_type} on {agent.device}, {torch.get_num_threads()} threads, batches of {args.batch_size}")
+
+    failures: list[tuple[str, str]] = []
+    encoded_total = 0
+    start_total = perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        next_image = reader.submit(read_image, paths[0])
+        for number, path in enumerate(paths, start=1):
+            start = perf_counter()
+            try:
+                digest, pixels = next_image.result()
+            except Exception as e:
+                failures.append((path, f"{type(e).__name__}: {e}"))
+                print(f"[{number}/{len(paths)}] {path}: failed to read, {failures[-1][1]}")
+                continue
+            finally:
+                if number < len(paths):
+                    next_image = reader.submit(read_image, paths[number])
+
+            height, width = pixels.shape[:2]
+            tiles = tile_grid(width, height)
+            pending = [(tile, region_cache_key(digest, tile)) for tile in tiles]
+            pending = [(tile, key) for tile, key in pending if not agent.is_cached(key)]
+            try:
+                for batch_start in range(0, len(pending), args.batch_size):
+                    batch = pending[batch_start : batch_start + args.batch_size]
+                    crops = [np.ascontiguousarray(pixels[y0:y1, x0:x1]) for (x0, y0, x1, y1), _ in batch]
+                    agent.compute_image_states(crops, [key for _, key in batch])
+            except Exception as e:
+                failures.append((path, f"{type(e).__name__}: {e}"))
+                print(f"[{number}/{len(paths)}] {path}: failed to encode, {failures[-1][1]}")
+                continue
+
+            seconds = perf_counter() - start
+            encoded_total += len(pending)
+            rate = f", {len(pending) / seconds:.2f} tiles/s" if pending else ""
+            print(f"[{number}/{len(paths)}] {path}: {width}x{height}, {len(tiles)} tiles, {len(pending)} encoded in {seconds:.1f}s{rate}")
+
+    seconds = perf_counter() - start_total
+    cache_size = agent.embedding_cache.size()
+    print(f"Encoded {encoded_total} tiles from {len(paths) - len(failures)} images in {seconds:.1f}s, cache holds {cache_size / 1024**3:.2f} GB")
+    if cache_size > agent.embedding_cache.max_bytes * 0.9:
+        print("The cache is close to its size limit and evicts the oldest entries first, raise it with --cache-size-gb")
+    if failures:
+        print(f"{len(failures)} images failed:")
+        for path, error in failures:
+            print(f"  {path}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
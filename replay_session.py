@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import warnings
+from datetime import datetime
+
+
+warnings.simplefilter(action="ignore", category=FutureWarning)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replay a session recorded with main.py --record-session on the offscreen platform and report per-action latency and memory growth"
+    )
+    parser.add_argument("session", help="session log written by main.py --record-session")
+    parser.add_argument("--image-dir", default=None, help="look for the recorded images in this directory instead of their recorded paths")
+    parser.add_argument("--random-weights", action="store_true", help="use randomly initialized SAM weights instead of the checkpoints in sam_checkpoints")
+    parser.add_argument("--inference-process", action="store_true", help="replay with the model in a separate process, like main.py")
+    parser.add_argument("--inference-server", default=None, metavar="URL", help="replay against a running inference_server.py, like main.py")
+    parser.add_argument("--realtime", action="store_true", help="wait between actions as long as the user did instead of replaying back to back")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for torch, defaults to all cores")
+    parser.add_argument("--workdir", default=None, help="scratch directory for autosaves and the embedding cache, reused between runs if given")
+    parser.add_argument("--output", default=None, help="report file, defaults to replay-<time>.json in the current directory")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Resolved before moving into the scratch directory
+    output = os.path.abspath(args.output or f"replay-{datetime.now():%Y%m%d-%H%M%S}.json")
+    image_directory = None if args.image_dir is None else os.path.abspath(args.image_dir)
+    checkpoints = os.path.abspath("sam_checkpoints")
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    from utils.session_recorder import read_session
+
+    try:
+        header, actions = read_session(args.session)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Could not read the session: {e}")
+
+    import torch
+    from benchmarks.application import start_main_page
+    from benchmarks.common import enter_workdir, environment, write_random_checkpoint
+    from benchmarks.replay import SessionReplayer, resident_memory
+    from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE
+    from utils.embedding_cache import CACHE_DIRECTORY
+    from utils.latency_monitor import get_monitor
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    enter_workdir(args.workdir or tempfile.mkdtemp(prefix="segmenter-replay-"))
+    # Every replay starts with a cold cache, embeddings of an earlier run would skip the encodes being measured
+    shutil.rmtree(CACHE_DIRECTORY, ignore_errors=True)
+    if args.random_weights:
+        write_random_checkpoint(DEFAULT_MODEL_TYPE)
+    elif not os.path.exists("sam_checkpoints") and os.path.isdir(checkpoints):
+        os.symlink(checkpoints, "sam_checkpoints", target_is_directory=True)
+    print(f"Replaying {len(actions)} actions recorded {header.get('started')} in {os.getcwd()}")
+
+    page = start_main_page(inference_process=args.inference_process, inference_server=args.inference_server)
+    page.show()
+    get_monitor().set_enabled(True)
+    replayer = SessionReplayer(page, image_directory, args.realtime)
+    memory_start = resident_memory()
+    replayer.play(actions)
+    memory_end = resident_memory()
+
+    canvas = page.image_canvas
+    report = {
+        "session": os.path.abspath(args.session),
+        "recorded": header.get("started"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("session", "output", "workdir")},
+        "environment": environment(),
+        "summary": replayer.summary(),
+        "stages": get_monitor().summary(),
+        "memory": {"start_bytes": memory_start, "end_bytes": memory_end, "growth_bytes": memory_end - memory_start},
+        "scene_items": len(canvas.scene.items()),
+        "annotations": len(canvas.annotations.active_rows()),
+        "warnings": replayer.warnings,
+        "actions": replayer.results,
+    }
+    canvas.close()
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"\n{'action':<16}{'count':>7}{'median ms':>12}{'p95 ms':>10}{'max ms':>10}{'RSS MB':>10}")
+    for name, stats in report["summary"].items():
+        growth = stats["rss_growth_bytes"] / 2**20
+        print(f"{name:<16}{stats['count']:>7}{stats['median']:>12.1f}{stats['p95']:>10.1f}{stats['max']:>10.1f}{growth:>+10.1f}")
+    print(f"\nResident memory {memory_start / 2**20:.0f} MB -> {memory_end / 2**20:.0f} MB, {report['scene_items']} scene items")
+    for warning in replayer.warnings:
+        print(f"Warning: {warning}")
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
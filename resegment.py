@@ -0,0 +1,220 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import warnings
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+import numpy as np
+
+from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE, SAM_CHECKPOINTS, CheckpointDownloader
+from utils.embedding_cache import CACHE_DIRECTORY, EmbeddingCache
+from utils.encoded_region import crop_rect_around
+from utils.slider_strength import SliderStrength
+from utils.tiling import TILE_STRIDE, covering_tile, find_images, image_digest, open_image, region_cache_key
+
+
+warnings.simplefilter(action="ignore", category=FutureWarning)
+
+SEED_EXTENSIONS = (".shp", ".gpkg", ".fgb", ".parquet", ".geoparquet")
+OUTPUT_FORMATS = (".shp", ".gpkg", ".fgb", ".parquet")
+# Attributes given to points from a CSV, matching what the application uses for a new polygon
+DEFAULT_GROUP = "None"
+DEFAULT_COLOR = (30, 144, 255, 75)
+
+# The segment agent of a worker process, created once by _init_worker
+_agent = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Segment the seed points of exported annotations again on native resolution crops and write them in the same schema"
+    )
+    parser.add_argument("folder", help="folder of images and GeoTIFFs")
+    parser.add_argument("output_dir", help="folder for the new vector files, named after each image")
+    parser.add_argument("--recursive", action="store_true", help="include images in subfolders")
+    parser.add_argument("--seeds-dir", default=None, help="folder of exported vector files named after each image, defaults to each image's folder")
+    parser.add_argument("--points", default=None, metavar="CSV", help="read seeds from a CSV with image, x and y (pixel) columns instead, label and group_id are optional")
+    parser.add_argument("--format", default=".shp", choices=OUTPUT_FORMATS, help="output file type")
+    parser.add_argument("--model-type", default=DEFAULT_MODEL_TYPE, choices=sorted(SAM_CHECKPOINTS))
+    parser.add_argument("--device", default=None, help="torch device, defaults to cuda when available")
+    parser.add_argument("--mask-level", default=SliderStrength.AUTO.name, choices=[strength.name for strength in SliderStrength])
+    parser.add_argument("--workers", type=int, default=1, help="images processed in parallel, each worker loads its own model")
+    parser.add_argument("--batch-size", type=int, default=4, help="crops encoded together in one encoder pass")
+    parser.add_argument("--cache-dir", default=CACHE_DIRECTORY, help="embedding cache shared with the application and precompute_embeddings.py")
+    return parser.parse_args()
+
+
+def find_seed_file(seeds_dir: str, image_path: str) -> str | None:
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    for extension in SEED_EXTENSIONS:
+        path = os.path.join(seeds_dir, stem + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_point_rows(csv_path: str) -> dict[str, list[dict]]:
+    """CSV rows grouped by the file name in their image column"""
+    rows = defaultdict(list)
+    with open(csv_path, newline="") as file:
+        for row in csv.DictReader(file):
+            rows[os.path.basename(row["image"])].append(row)
+    return rows
+
+
+def point_columns(rows: list[dict]) -> dict[str, np.ndarray]:
+    """Attribute columns for CSV points, with the defaults of a polygon created in the application"""
+    count = len(rows)
+    ids = np.arange(count)
+    return {
+        "polygon_id": ids,
+        "group_id": np.array([row.get("group_id") or DEFAULT_GROUP for row in rows], dtype=object),
+        "label": np.array([row.get("label") or f"mask{polygon_id}" for row, polygon_id in zip(rows, ids)], dtype=object),
+        "seed_pnt_x": np.array([float(row["x"]) for row in rows]),
+        "seed_pnt_y": np.array([float(row["y"]) for row in rows]),
+        "red": np.full(count, DEFAULT_COLOR[0]),
+        "green": np.full(count, DEFAULT_COLOR[1]),
+        "blue": np.full(count, DEFAULT_COLOR[2]),
+        "alpha": np.full(count, DEFAULT_COLOR[3]),
+    }
+
+
+def seed_crop(seed: np.ndarray, previous_ring: np.ndarray | None, width: int, height: int) -> tuple[int, int, int, int]:
+    """Native resolution crop for one seed: around its previous outline if there is one, otherwise a tile stride around the seed.
+
+    \nCrops snap to the grid tile holding them, so seeds close together share one embedding and precomputed tiles are reused.
+    """
+    if previous_ring is not None and len(previous_ring) >= 3:
+        rect = crop_rect_around(previous_ring.min(axis=0), previous_ring.max(axis=0), width, height)
+    else:
+        half = TILE_STRIDE // 2
+        x, y = np.clip(seed, 0, (width, height)).astype(int)
+        rect = (max(x - half, 0), max(y - half, 0), min(x + half, width), min(y + half, height))
+    return covering_tile(rect, width, height) or rect
+
+
+def _init_worker(model_type: str, device: str, cache_dir: str, threads: int):
+    global _agent
+    import torch
+    from segment_agent import SegmentAgent
+
+    torch.set_num_threads(threads)
+    _agent = SegmentAgent(model_type, device, load_encoder=True)
+    _agent.embedding_cache = EmbeddingCache(cache_dir)
+
+
+def resegment_image(image_path: str, seed_file: str | None, point_rows: list[dict] | None, output_path: str, mask_level: str, batch_size: int) -> dict:
+    """Segment every seed of one image and write the polygons. Runs in a worker process"""
+    from segment_agent import select_mask
+    from utils.geometry_io import read_georeference, read_polygons, write_polygons
+    from utils.polygon import mask_to_contour
+
+    start = perf_counter()
+    transform, crs = read_georeference(image_path)
+    if seed_file is not None:
+        columns, previous_rings = read_polygons(seed_file, transform)
+    else:
+        columns, previous_rings = point_columns(point_rows), [None] * len(point_rows)
+
+    digest = image_digest(image_path)
+    pixels = np.asarray(open_image(image_path))[:, :, :3]
+    height, width = pixels.shape[:2]
+    seeds = np.column_stack((columns["seed_pnt_x"], columns["seed_pnt_y"])).astype(np.float64)
+
+    seeds_by_crop: dict[tuple, list[int]] = defaultdict(list)
+    for index, (seed, previous_ring) in enumerate(zip(seeds, previous_rings)):
+        seeds_by_crop[seed_crop(seed, previous_ring, width, height)].append(index)
+
+    level = SliderStrength[mask_level]
+    rings: list[np.ndarray] = [None] * len(seeds)
+    crops = list(seeds_by_crop)
+    cached = sum(_agent.is_cached(region_cache_key(digest, rect)) for rect in crops)
+    for batch_start in range(0, len(crops), batch_size):
+        batch = crops[batch_start : batch_start + batch_size]
+        states = _agent.compute_image_states(
+            [np.ascontiguousarray(pixels[y0:y1, x0:x1]) for x0, y0, x1, y1 in batch],
+            [region_cache_key(digest, rect) for rect in batch],
+        )
+        for (x0, y0, x1, y1), state in zip(batch, states):
+            indices = seeds_by_crop[(x0, y0, x1, y1)]
+            points = [seeds[index : index + 1] - (x0, y0) for index in indices]
+            masks, scores = _agent.predict_batch(state, points, [np.array([1])] * len(indices))
+            for index, seed_masks, seed_scores in zip(indices, masks, scores):
+                rings[index] = mask_to_contour(select_mask(seed_masks, seed_scores, level)) + (x0, y0)
+
+    kept = np.array([len(ring) >= 3 for ring in rings], dtype=bool)
+    write_polygons(output_path, {name: np.asarray(values)[kept] for name, values in columns.items()}, [ring for ring in rings if len(ring) >= 3], transform, crs)
+    return {"seeds": len(seeds), "empty": int((~kept).sum()), "crops": len(crops), "cached": cached, "seconds": perf_counter() - start}
+
+
+def main():
+    args = parse_args()
+
+    images = find_images(args.folder, args.recursive)
+    point_rows = read_point_rows(args.points) if args.points is not None else None
+
+    jobs = []
+    for image_path in images:
+        if point_rows is not None:
+            rows = point_rows.get(os.path.basename(image_path))
+            seed_file = None
+            if not rows:
+                continue
+        else:
+            rows = None
+            seed_file = find_seed_file(args.seeds_dir or os.path.dirname(image_path), image_path)
+            if seed_file is None:
+                continue
+        output_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(image_path))[0] + args.format)
+        jobs.append((image_path, seed_file, rows, output_path))
+    if not jobs:
+        raise SystemExit(f"No images in {args.folder} have seeds")
+
+    downloader = CheckpointDownloader([args.model_type])
+    if not downloader.all_checkpoints_downloaded():
+        raise SystemExit(f"No {args.model_type} checkpoint found, start the application once to download it")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = max(1, min(args.workers, len(jobs)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Re-segmenting {len(jobs)} of {len(images)} images with {args.model_type}, {workers} workers of {threads} threads")
+
+    failures: list[tuple[str, str]] = []
+    seeds_total = 0
+    start_total = perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.model_type, args.device, args.cache_dir, threads),
+    ) as pool:
+        futures = {pool.submit(resegment_image, *job, args.mask_level, args.batch_size): job for job in jobs}
+        for number, future in enumerate(as_completed(futures), start=1):
+            image_path, _, _, output_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append((image_path, f"{type(e).__name__}: {e}"))
+                print(f"[{number}/{len(jobs)}] {image_path}: failed, {failures[-1][1]}")
+                continue
+            seeds_total += result["seeds"]
+            empty = f", {result['empty']} empty masks dropped" if result["empty"] else ""
+            print(
+                f"[{number}/{len(jobs)}] {image_path} -> {output_path}: {result['seeds']} seeds on {result['crops']} crops "
+                f"({result['cached']} cached) in {result['seconds']:.1f}s, {result['seeds'] / result['seconds']:.2f} seeds/s{empty}"
+            )
+
+    print(f"Re-segmented {seeds_total} seeds from {len(jobs) - len(failures)} images in {perf_counter() - start_total:.1f}s")
+    if failures:
+        print(f"{len(failures)} images failed:")
+        for image_path, error in failures:
+            print(f"  {image_path}: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
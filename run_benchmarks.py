@@ -0,0 +1,88 @@
+import argparse
+import os
+import tempfile
+import warnings
+from datetime import datetime
+
+
+warnings.simplefilter(action="ignore", category=FutureWarning)
+# Exports of images without a georeference have no CRS, which pyogrio warns about on every write
+warnings.filterwarnings("ignore", message="'crs' was not provided")
+
+SUITES = ("segmentation", "geometry", "export")
+
+
+def parse_args():
+    from benchmarks.export import VECTOR_FORMATS
+    from benchmarks.segmentation import BACKENDS
+    from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE, SAM_CHECKPOINTS
+
+    parser = argparse.ArgumentParser(
+        description="Time segmentation, geometry and export hot paths on CPU with synthetic images and randomly initialized SAM weights"
+    )
+    parser.add_argument("--suite", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--backend", nargs="+", choices=BACKENDS, default=list(BACKENDS), help="segment agents to time the encoder and decoder of")
+    parser.add_argument("--model-type", default=DEFAULT_MODEL_TYPE, choices=sorted(SAM_CHECKPOINTS))
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per measurement, slow measurements use a quarter")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for torch, defaults to all cores")
+    parser.add_argument("--view-size", type=int, nargs=2, default=(1280, 800), metavar=("WIDTH", "HEIGHT"), help="screenshot size sent to the encoder")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(6000, 4000), metavar=("WIDTH", "HEIGHT"), help="image the canvas benchmarks open")
+    parser.add_argument("--polygons", type=int, nargs="+", default=[100, 1000, 10000], help="polygon counts to hit test at")
+    parser.add_argument("--export-polygons", type=int, default=2000, help="polygons on the image while timing exports")
+    parser.add_argument("--formats", nargs="+", choices=VECTOR_FORMATS, default=[".shp", ".gpkg"], help="vector formats to round-trip")
+    parser.add_argument("--workdir", default=None, help="scratch directory for checkpoints and written files, reused between runs if given")
+    parser.add_argument("--output", default=None, help="results file, defaults to benchmark-<time>.json in the current directory")
+    parser.add_argument("--compare", default=None, metavar="RESULTS", help="print the change against an earlier results file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Resolved before moving into the scratch directory
+    output = os.path.abspath(args.output or f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    baseline = None if args.compare is None else os.path.abspath(args.compare)
+    if baseline is not None and not os.path.exists(baseline):
+        raise SystemExit(f"No results file at {baseline} to compare with")
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    import torch
+    from benchmarks.common import BenchmarkRun, compare, enter_workdir, write_random_checkpoint
+    from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    enter_workdir(args.workdir or tempfile.mkdtemp(prefix="segmenter-benchmark-"))
+    print(f"Working in {os.getcwd()}")
+    write_random_checkpoint(args.model_type)
+    if {"geometry", "export"} & set(args.suite):
+        # The main window always loads the default model
+        write_random_checkpoint(DEFAULT_MODEL_TYPE)
+
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "workdir")}
+    benchmark = BenchmarkRun(settings)
+    print(f"Commit {benchmark.environment['commit']}, {benchmark.environment['cpu_count']} CPUs, {torch.get_num_threads()} torch threads")
+
+    if "segmentation" in args.suite:
+        from benchmarks import segmentation
+
+        segmentation.run(benchmark, args.backend, args.model_type, tuple(args.view_size), args.repeat)
+
+    if {"geometry", "export"} & set(args.suite):
+        from benchmarks import export, geometry
+        from benchmarks.application import start_main_page
+
+        page = start_main_page()
+        if "geometry" in args.suite:
+            geometry.run(benchmark, page, tuple(args.view_size), tuple(args.image_size), args.polygons, args.repeat)
+        if "export" in args.suite:
+            export.run(benchmark, page, tuple(args.image_size), args.export_polygons, args.formats, args.repeat)
+        page.image_canvas.close()
+
+    benchmark.write(output)
+    print(f"Results written to {output}")
+    if baseline is not None:
+        compare(baseline, benchmark)
+
+
+if __name__ == "__main__":
+    main()
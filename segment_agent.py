@@ -1,82 +1,295 @@
+import threading
+from time import perf_counter
+from typing import NamedTuple
 import numpy as np
-from segment_anything import sam_model_registry, SamAutomaticMaskGenerator, SamPredictor
+import torch
+from segment_anything import SamAutomaticMaskGenerator, SamPredictor
 from utils.slider_strength import SliderStrength
-from pycocotools import mask as maskUtils
+from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE, checkpoint_path
+from utils.embedding_cache import EmbeddingCache
+from utils.model_loader import DECODER_PREFIXES, ENCODER_PREFIXES, assign_weights, build_empty_sam, finish_sam, load_state_dict_mmap
+
+
+class ImageState(NamedTuple):
+    """Everything the mask decoder needs about an encoded image"""
+
+    features: torch.Tensor
+    original_size: tuple[int, int]
+    input_size: tuple[int, int]
+
+
+def select_index(scores: np.ndarray, mask_level: SliderStrength) -> int:
+    """Index of the highest scoring mask for AUTO, otherwise of the mask matching the requested strength"""
+    if mask_level == SliderStrength.AUTO:
+        return int(np.argmax(scores))
+    return len(scores) - mask_level.value
+
+
+def select_mask(masks: np.ndarray, scores: np.ndarray, mask_level: SliderStrength) -> np.ndarray:
+    return masks[select_index(scores, mask_level)]
 
 
 class SegmentAgent:
-    """Used to generate image masks from an inputted image and points on the image"""
+    """Used to generate image masks from an inputted image and points on the image.
+
+    \nConstruction only maps the checkpoint and loads the prompt encoder and mask decoder. The image encoder is loaded by load_encoder,
+    which setImage waits for, so it can run in the background while the rest of the application starts.
+
+    \nImages passed with a cache_key are looked up in embedding_cache first, a hit skips the encoder and does not wait for it. The key
+    only needs to describe the pixels (file digest and region), the model type and device are added here. Set embedding_cache to None
+    to always encode.
+    """
 
-    def __init__(self):
-        sam_checkpoint = "./sam_checkpoints/sam_vit_b_01ec64.pth"
+    def __init__(self, model_type: str = DEFAULT_MODEL_TYPE, device: str = None, load_encoder: bool = False):
+        start = perf_counter()
+        self.model_type = model_type
+        self.device = device if device is not None else ("cuda" if torch.cuda.is_available() else "cpu")
         self.last_logits = None
         self.last_scores = None
-        model_type = "vit_b"
-        device = "cuda"
-        self.sam = sam_model_registry[model_type](checkpoint=sam_checkpoint)
-        self.sam.to(device=device)
+        self.last_mask_logits: np.ndarray = None
+        self.load_timings: dict[str, float] = {}
+        # Set once load_encoder has finished, also when it failed with _encoder_error
+        self._encoder_loaded = threading.Event()
+        self._encoder_error: Exception = None
+        # Guards the predictor's image state, hover previews decode on a worker thread while clicks decode on the GUI thread
+        self._lock = threading.RLock()
+        self.embedding_cache = EmbeddingCache()
+
+        self._state_dict = load_state_dict_mmap(checkpoint_path(model_type))
+        self.load_timings["map_checkpoint"] = perf_counter() - start
+
+        self.sam = build_empty_sam(model_type)
+        assign_weights(self.sam, self._state_dict, DECODER_PREFIXES, self.device)
         self.predictor = SamPredictor(self.sam)
         self.mask_level = SliderStrength.AUTO
+        self.load_timings["decoder_ready"] = perf_counter() - start
+        self._start_time = start
+
+        if load_encoder:
+            self.load_encoder()
+
+    def load_encoder(self):
+        """Assign the image encoder weights. Safe to call from a worker thread. A failure is raised here and by every later encode"""
+        if self._encoder_loaded.is_set():
+            return
+        try:
+            assign_weights(self.sam, self._state_dict, ENCODER_PREFIXES, self.device)
+            finish_sam(self.sam, self.device)
+        except Exception as e:
+            self._encoder_error = e
+            raise
+        finally:
+            self._state_dict = None
+            self._encoder_loaded.set()
+        self.load_timings["encoder_ready"] = perf_counter() - self._start_time
+
+    def is_encoder_loaded(self) -> bool:
+        return self._encoder_loaded.is_set() and self._encoder_error is None
+
+    def _wait_for_encoder(self):
+        self._encoder_loaded.wait()
+        if self._encoder_error is not None:
+            raise RuntimeError(f"The image encoder failed to load: {self._encoder_error}") from self._encoder_error
+
+    def setImage(self, image_array, cache_key: tuple = None):
+        if cache_key is not None and self.embedding_cache is not None:
+            state = self.compute_image_state(image_array, cache_key)
+            with self._lock:
+                self.set_image_state(state)
+            return
+        self._wait_for_encoder()
+        with self._lock:
+            self.predictor.set_image(image_array)
+
+    def _full_cache_key(self, cache_key: tuple) -> tuple:
+        return (*cache_key, self.model_type, self.device)
+
+    def is_cached(self, cache_key: tuple) -> bool:
+        return self.embedding_cache is not None and self.embedding_cache.contains(self._full_cache_key(cache_key))
+
+    def cached_embeddings(self, cache_keys) -> dict[tuple, tuple[np.ndarray, tuple[int, int], tuple[int, int]]]:
+        """Cache entries of the given keys that exist, under their full keys, for saving along with a project"""
+        if self.embedding_cache is None:
+            return {}
+        entries = {}
+        for cache_key in cache_keys:
+            full_key = self._full_cache_key(cache_key)
+            cached = self.embedding_cache.get(full_key)
+            if cached is not None:
+                entries[full_key] = cached
+        return entries
+
+    def compute_image_state(self, image_array: np.ndarray, cache_key: tuple = None) -> ImageState:
+        """Encode an RGB image without touching the predictor, so it can run alongside decoding for another image"""
+        return self.compute_image_states([image_array], [cache_key])[0]
+
+    @torch.no_grad()
+    def compute_image_states(self, image_arrays: list[np.ndarray], cache_keys: list[tuple] = None) -> list[ImageState]:
+        """Encode several RGB images in one encoder pass. Images whose cache key has an entry are loaded instead of encoded"""
+        cache_keys = cache_keys if cache_keys is not None else [None] * len(image_arrays)
+        use_cache = self.embedding_cache is not None
+        states: list[ImageState] = [None] * len(image_arrays)
+
+        uncached = []
+        for index, cache_key in enumerate(cache_keys):
+            cached = self.embedding_cache.get(self._full_cache_key(cache_key)) if cache_key is not None and use_cache else None
+            if cached is None:
+                uncached.append(index)
+            else:
+                features, original_size, input_size = cached
+                states[index] = ImageState(torch.tensor(features, device=self.device), original_size, input_size)
+        if not uncached:
+            return states
+
+        self._wait_for_encoder()
+        input_tensors = []
+        for index in uncached:
+            input_image = self.predictor.transform.apply_image(image_arrays[index])
+            input_tensors.append(torch.as_tensor(input_image, device=self.device).permute(2, 0, 1).contiguous()[None, :, :, :])
+        # preprocess pads every image to the same square size, so they stack into one batch
+        features = self.sam.image_encoder(torch.cat([self.sam.preprocess(input_tensor) for input_tensor in input_tensors]))
 
-    def setImage(self, image_array):
-        self.predictor.set_image(image_array)
+        for batch_index, (index, input_tensor) in enumerate(zip(uncached, input_tensors)):
+            image_features = features if len(uncached) == 1 else features[batch_index : batch_index + 1].clone()
+            state = states[index] = ImageState(image_features, tuple(image_arrays[index].shape[:2]), tuple(input_tensor.shape[-2:]))
+            if cache_keys[index] is not None and use_cache:
+                try:
+                    self.embedding_cache.put(self._full_cache_key(cache_keys[index]), image_features.cpu().numpy(), state.original_size, state.input_size)
+                except OSError as e:
+                    print(f"Could not cache image embedding: {e}")
+        return states
+
+    def get_image_state(self) -> ImageState:
+        return ImageState(self.predictor.features, self.predictor.original_size, self.predictor.input_size)
+
+    def set_image_state(self, state: ImageState):
+        self.predictor.features = state.features
+        self.predictor.original_size = state.original_size
+        self.predictor.input_size = state.input_size
+        self.predictor.is_image_set = True
+
+    @torch.no_grad()
+    def predict_batch(self, state: ImageState, points: list[np.ndarray], labels: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+        """Decode several point prompts of the same length against one image in a single pass.
+
+        \nPrompts are not padded because the prompt encoder still attends to "not a point" tokens, which would change the masks.
+        Returns (B, 3, H, W) masks and (B, 3) scores.
+        """
+        coords = self.predictor.transform.apply_coords(np.stack(points).astype(np.float64), state.original_size)
+        point_labels = np.stack(labels)
+        with self._lock:
+            previous_state = self.get_image_state() if self.predictor.is_image_set else None
+            self.set_image_state(state)
+            masks, scores, _ = self.predictor.predict_torch(
+                torch.as_tensor(coords, dtype=torch.float, device=self.device),
+                torch.as_tensor(point_labels, dtype=torch.int, device=self.device),
+                multimask_output=True,
+            )
+            if previous_state is not None:
+                self.set_image_state(previous_state)
+        return masks.cpu().numpy(), scores.cpu().numpy()
+
+    @torch.no_grad()
+    def predict_across_images(self, states: list[ImageState], points: list[np.ndarray], labels: list[np.ndarray]) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Decode one point prompt per image state in a single pass, the prompts all of the same length.
+
+        \nThe mask decoder adds one shared image embedding to the dense embedding of every prompt, so each prompt's own embedding is
+        added to its dense embedding instead and a zero embedding is shared, which gives the same sums. Returns (3, H, W) masks and
+        (3,) scores per prompt, at the size of its own image.
+        """
+        coords = np.stack(
+            [self.predictor.transform.apply_coords(prompt.astype(np.float64), state.original_size) for prompt, state in zip(points, states)]
+        )
+        sparse_embeddings, dense_embeddings = self.sam.prompt_encoder(
+            points=(torch.as_tensor(coords, dtype=torch.float, device=self.device), torch.as_tensor(np.stack(labels), dtype=torch.int, device=self.device)),
+            boxes=None,
+            masks=None,
+        )
+        features = torch.cat([state.features for state in states])
+        low_res_masks, scores = self.sam.mask_decoder(
+            image_embeddings=torch.zeros_like(features[:1]),
+            image_pe=self.sam.prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings + features,
+            multimask_output=True,
+        )
+        results = []
+        for index, state in enumerate(states):
+            masks = self.sam.postprocess_masks(low_res_masks[index : index + 1], state.input_size, state.original_size) > self.sam.mask_threshold
+            results.append((masks[0].cpu().numpy(), scores[index].cpu().numpy()))
+        return results
+
+    def previewMask(self, x, y) -> np.ndarray | None:
+        """Best mask for a single positive point on the current image, or None if no image is set.
+
+        \nOnly runs the prompt decoder and leaves last_logits alone, so it is cheap enough to follow the cursor.
+        """
+        with self._lock:
+            if not self.predictor.is_image_set:
+                return None
+            masks, scores, _ = self.predictor.predict(point_coords=np.array([[x, y]]), point_labels=np.array([1]), multimask_output=True)
+        return self.getBestMask(masks, scores)
 
     def generateMaskFromPoint(self, x, y):
         input_point = np.array([[x, y]])
         input_label = np.array([1])
-        masks, scores, logits = self.predictor.predict(
-            point_coords=input_point,
-            point_labels=input_label,
-            multimask_output=True,
-        )
+        with self._lock:
+            masks, scores, logits = self.predictor.predict(
+                point_coords=input_point,
+                point_labels=input_label,
+                multimask_output=True,
+            )
         self.last_logits = logits
         self.last_scores = scores
+        self.last_mask_logits = logits[select_index(scores, self.mask_level)]
         bestMask = self.getBestMask(masks, scores)
         return bestMask
 
-    def generate_coco_annotations(self, id: int, image_id: int, mask) -> dict:
-
-        mask = (mask * 255).astype(np.uint8)
-
-        category_id = 1
-        rle_encoded_mask = maskUtils.encode(np.asfortranarray(mask))
-        rle_encoded_mask["counts"] = rle_encoded_mask["counts"].decode("utf-8")
-
-        annotation = {
-            "id": id,
-            "image_id": image_id,
-            "category_id": category_id,
-            "bbox": maskUtils.toBbox(rle_encoded_mask).tolist(),
-            "area": int(mask.sum()),
-            "segmentation": rle_encoded_mask,
-            "iscrowd": 0,
-        }
-        return annotation
-
     def generateMaskFromPoints(self, points):
         input_point = np.array([point[0] for point in points])
         input_label = np.array([point[1] for point in points])
-        masks, scores, logits = self.predictor.predict(
-            point_coords=input_point,
-            point_labels=input_label,
-            multimask_output=True,
-        )
+        with self._lock:
+            masks, scores, logits = self.predictor.predict(
+                point_coords=input_point,
+                point_labels=input_label,
+                multimask_output=True,
+            )
         self.last_logits = logits
         self.last_scores = scores
+        self.last_mask_logits = logits[select_index(scores, self.mask_level)]
         bestMask = self.getBestMask(masks, scores)
         return bestMask
 
+    def refineMask(self, image_array: np.ndarray, points: np.ndarray, labels: np.ndarray, mask_input: np.ndarray, cache_key: tuple = None) -> np.ndarray:
+        """Segment again on a native resolution crop, using the coarse prediction's logits warped into the crop as mask_input.
+
+        \nThe crop is encoded without replacing the viewport embedding, which is restored before returning so later clicks still use it.
+        """
+        state = self.compute_image_state(image_array, cache_key)
+        with self._lock:
+            previous_state = self.get_image_state() if self.predictor.is_image_set else None
+            self.set_image_state(state)
+            try:
+                masks, _, _ = self.predictor.predict(
+                    point_coords=np.asarray(points, dtype=np.float64),
+                    point_labels=np.asarray(labels),
+                    mask_input=mask_input[None, :, :],
+                    multimask_output=False,
+                )
+            finally:
+                if previous_state is not None:
+                    self.set_image_state(previous_state)
+        return masks[0]
+
+    def generateMasksFromSeeds(self, seeds: list[tuple[int, int]]) -> list[np.ndarray]:
+        """Segment one object per seed point with a single batched decoder pass over the current image"""
+        with self._lock:
+            state = self.get_image_state()
+        masks, scores = self.predict_batch(state, [np.array([seed]) for seed in seeds], [np.array([1])] * len(seeds))
+        return [self.getBestMask(seed_masks, seed_scores) for seed_masks, seed_scores in zip(masks, scores)]
+
     def getBestMask(self, masks: list, scores: list) -> list:
-        if self.mask_level == SliderStrength.AUTO:
-            bestScore = 0
-            bestMask = None
-            for _, (mask, score) in enumerate(zip(masks, scores)):
-                if score > bestScore:
-                    bestScore = score
-                    bestMask = mask
-            return bestMask
-        else:
-            return masks[(self.mask_level.value) * -1]
+        return select_mask(masks, scores, self.mask_level)
 
     def segmentAll(self):
         mask_generator = SamAutomaticMaskGenerator(
@@ -0,0 +1,423 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import zlib
+from datetime import datetime
+from enum import IntEnum
+from typing import Callable, Final, Iterator, NamedTuple
+
+import numpy as np
+
+from utils.task_executor import Priority, get_executor
+
+AUTOSAVE_DIRECTORY: Final[str] = "autosave"
+JOURNAL_FILE: Final[str] = "annotations.journal"
+SNAPSHOT_FILE: Final[str] = "annotations.snapshot"
+
+JOURNAL_MAGIC: Final[bytes] = b"SGMTJRNL"
+SNAPSHOT_MAGIC: Final[bytes] = b"SGMTSNAP"
+FORMAT_VERSION: Final[int] = 1
+# Records appended since the last snapshot before the journal is compacted into a new one
+COMPACT_AFTER_RECORDS: Final[int] = 5000
+# Arrays in a snapshot start on this boundary so they can be viewed in place from a memory map
+ARRAY_ALIGNMENT: Final[int] = 64
+
+_FILE_HEADER = struct.Struct("<8sI")
+# CRC32 of everything after it, payload length, sequence number, operation, annotation id
+_RECORD_HEADER = struct.Struct("<IIQBq")
+# Seed point, RGBA color, label and group byte lengths, point count. The strings and float32 points follow
+_STATE_HEADER = struct.Struct("<dd4BHHI")
+
+# One lock per autosave folder, shared by every journal and reader of it in the process
+_directory_locks: dict[str, threading.Lock] = {}
+_directory_locks_lock = threading.Lock()
+
+
+class Operation(IntEnum):
+    CREATE = 1
+    UPDATE = 2  # refined, relabelled or recolored
+    ERASE = 3
+
+
+class AnnotationState(NamedTuple):
+    """An annotation as recorded in the journal, its outline in image pixel coordinates"""
+
+    seed_point: tuple[float, float]
+    color: tuple[int, int, int, int]
+    label: str
+    group_id: str
+    points: np.ndarray
+
+
+def autosave_directory(image_path: str) -> str:
+    """Autosave folder of an image, keyed by its absolute path"""
+    return os.path.join(AUTOSAVE_DIRECTORY, hashlib.sha1(os.path.abspath(image_path).encode()).hexdigest()[:16])
+
+
+def _directory_lock(directory: str) -> threading.Lock:
+    with _directory_locks_lock:
+        return _directory_locks.setdefault(os.path.abspath(directory), threading.Lock())
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def encode_record(sequence: int, operation: Operation, annotation_id: int, state: AnnotationState = None) -> bytes:
+    if state is None:
+        payload = b""
+    else:
+        label = state.label.encode()
+        group_id = state.group_id.encode()
+        points = np.ascontiguousarray(state.points, dtype=np.float32).reshape(-1, 2)
+        header = _STATE_HEADER.pack(*state.seed_point, *state.color, len(label), len(group_id), len(points))
+        payload = b"".join((header, label, group_id, points.tobytes()))
+    body = _RECORD_HEADER.pack(0, len(payload), sequence, operation, annotation_id)[4:] + payload
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+
+def decode_state(payload: memoryview) -> AnnotationState:
+    seed_x, seed_y, red, green, blue, alpha, label_length, group_length, point_count = _STATE_HEADER.unpack_from(payload)
+    offset = _STATE_HEADER.size
+    label = bytes(payload[offset : offset + label_length]).decode()
+    offset += label_length
+    group_id = bytes(payload[offset : offset + group_length]).decode()
+    offset += group_length
+    points = np.frombuffer(payload, dtype=np.float32, count=point_count * 2, offset=offset).reshape(-1, 2)
+    return AnnotationState((seed_x, seed_y), (red, green, blue, alpha), label, group_id, points)
+
+
+def iter_records(data: bytes) -> Iterator[tuple[int, int, Operation, int, memoryview]]:
+    """(end offset, sequence, operation, annotation id, payload) of every intact record, stopping at the first torn or corrupt one"""
+    view = memoryview(data)
+    if len(view) < _FILE_HEADER.size or _FILE_HEADER.unpack_from(view) != (JOURNAL_MAGIC, FORMAT_VERSION):
+        return
+    offset = _FILE_HEADER.size
+    while offset + _RECORD_HEADER.size <= len(view):
+        crc, length, sequence, operation, annotation_id = _RECORD_HEADER.unpack_from(view, offset)
+        end = offset + _RECORD_HEADER.size + length
+        if end > len(view) or zlib.crc32(view[offset + 4 : end]) != crc:
+            return
+        yield end, sequence, Operation(operation), annotation_id, view[offset + _RECORD_HEADER.size : end]
+        offset = end
+
+
+def write_array_file(path: str, magic: bytes, header: dict, arrays: dict[str, np.ndarray]):
+    """Write a JSON header followed by aligned arrays that map_array_file views in place. Written to a temporary file and renamed"""
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps({**header, "arrays": entries}).encode()
+    data_start = _aligned(_FILE_HEADER.size + 4 + len(header_bytes))
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(_FILE_HEADER.pack(magic, FORMAT_VERSION))
+        file.write(struct.pack("<I", len(header_bytes)))
+        file.write(header_bytes)
+        for name, array in arrays.items():
+            file.seek(data_start + entries[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def map_array_file(path: str, magic: bytes) -> tuple[dict, dict[str, np.ndarray]]:
+    """Header and read only arrays of a file written by write_array_file. Arrays are views of one memory map, nothing is read yet"""
+    # A plain ndarray over the map, slicing np.memmap itself costs microseconds per ring
+    raw = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+    if _FILE_HEADER.unpack_from(raw) != (magic, FORMAT_VERSION):
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} {magic.decode()} file")
+    (header_length,) = struct.unpack_from("<I", raw, _FILE_HEADER.size)
+    header_start = _FILE_HEADER.size + 4
+    header = json.loads(bytes(raw[header_start : header_start + header_length]))
+    data_start = _aligned(header_start + header_length)
+
+    arrays = {}
+    for name, entry in header.pop("arrays").items():
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        start = data_start + entry["offset"]
+        arrays[name] = raw[start : start + int(np.prod(shape)) * dtype.itemsize].view(dtype).reshape(shape)
+    return header, arrays
+
+
+def _columns_from_states(annotation_ids: list[int], states: list[AnnotationState]) -> tuple[dict[str, np.ndarray], list[np.ndarray]]:
+    seeds = np.array([state.seed_point for state in states], dtype=np.float64).reshape(-1, 2)
+    colors = np.array([state.color for state in states], dtype=np.int64).reshape(-1, 4)
+    columns = {
+        "polygon_id": np.array(annotation_ids, dtype=np.int64),
+        "group_id": np.array([state.group_id for state in states], dtype=object),
+        "label": np.array([state.label for state in states], dtype=object),
+        "seed_pnt_x": seeds[:, 0],
+        "seed_pnt_y": seeds[:, 1],
+        "red": colors[:, 0],
+        "green": colors[:, 1],
+        "blue": colors[:, 2],
+        "alpha": colors[:, 3],
+    }
+    return columns, [state.points for state in states]
+
+
+def annotation_arrays(columns: dict[str, np.ndarray], rings: list[np.ndarray]) -> tuple[dict, dict[str, np.ndarray]]:
+    """Header entries and flat arrays for export columns and rings: string tables with codes, and every ring's points back to back"""
+    labels, label_codes = np.unique(np.asarray(columns["label"], dtype=str), return_inverse=True)
+    groups, group_codes = np.unique(np.asarray(columns["group_id"], dtype=str), return_inverse=True)
+    arrays = {
+        "ids": np.asarray(columns["polygon_id"], dtype=np.int64),
+        "label_codes": label_codes.astype(np.int32),
+        "group_codes": group_codes.astype(np.int32),
+        "seed_points": np.column_stack((columns["seed_pnt_x"], columns["seed_pnt_y"])).astype(np.float64),
+        "colors": np.column_stack([columns[name] for name in ("red", "green", "blue", "alpha")]).astype(np.uint8),
+        **ring_arrays(rings),
+    }
+    return {"labels": labels.tolist(), "groups": groups.tolist()}, arrays
+
+
+def ring_arrays(rings: list[np.ndarray], prefix: str = "") -> dict[str, np.ndarray]:
+    lengths = [len(ring) for ring in rings]
+    return {
+        f"{prefix}ring_offsets": np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+        f"{prefix}points": np.concatenate(rings).astype(np.float32) if rings else np.empty((0, 2), dtype=np.float32),
+    }
+
+
+def annotation_columns(header: dict, arrays: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Export columns back from annotation_arrays, copied out of the arrays so a memory mapped file can be replaced"""
+    labels = np.array(header["labels"], dtype=object)
+    groups = np.array(header["groups"], dtype=object)
+    seeds = np.array(arrays["seed_points"])
+    colors = arrays["colors"].astype(np.int64)
+    columns = {
+        "polygon_id": np.array(arrays["ids"]),
+        "group_id": groups[arrays["group_codes"]] if len(groups) else np.empty(0, dtype=object),
+        "label": labels[arrays["label_codes"]] if len(labels) else np.empty(0, dtype=object),
+        "seed_pnt_x": seeds[:, 0],
+        "seed_pnt_y": seeds[:, 1],
+        "red": colors[:, 0],
+        "green": colors[:, 1],
+        "blue": colors[:, 2],
+        "alpha": colors[:, 3],
+    }
+    return columns
+
+
+def split_rings(arrays: dict[str, np.ndarray], prefix: str = "") -> list[np.ndarray]:
+    """Rings as views of one copy of the points. Windows cannot replace a file while views of its memory map are alive"""
+    offsets = arrays[f"{prefix}ring_offsets"].tolist()
+    points = np.array(arrays[f"{prefix}points"])
+    return [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def write_snapshot(path: str, sequence: int, columns: dict[str, np.ndarray], rings: list[np.ndarray]):
+    header, arrays = annotation_arrays(columns, rings)
+    write_array_file(path, SNAPSHOT_MAGIC, {"sequence": sequence, **header}, arrays)
+
+
+def read_snapshot(path: str) -> tuple[int, dict[str, np.ndarray], list[np.ndarray]]:
+    """(sequence, columns, rings) of a snapshot, read through a memory map that is dropped before returning"""
+    header, arrays = map_array_file(path, SNAPSHOT_MAGIC)
+    return header["sequence"], annotation_columns(header, arrays), split_rings(arrays)
+
+
+def _snapshot_sequence(path: str) -> int:
+    try:
+        with open(path, "rb") as file:
+            data = file.read(_FILE_HEADER.size + 4)
+            if len(data) < _FILE_HEADER.size + 4 or _FILE_HEADER.unpack_from(data) != (SNAPSHOT_MAGIC, FORMAT_VERSION):
+                return 0
+            (header_length,) = struct.unpack_from("<I", data, _FILE_HEADER.size)
+            return json.loads(file.read(header_length))["sequence"]
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def _rewrite_journal(path: str, after_sequence: int):
+    """Keep only the intact records after after_sequence, which also drops a tail torn by a crash"""
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        data = b""
+    kept = []
+    start = _FILE_HEADER.size
+    for end, sequence, _, _, _ in iter_records(data):
+        if sequence > after_sequence:
+            kept.append(memoryview(data)[start:end])
+        start = end
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(_FILE_HEADER.pack(JOURNAL_MAGIC, FORMAT_VERSION))
+        for record in kept:
+            file.write(record)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_annotations(directory: str, last_sequence: int = None) -> tuple[dict[str, np.ndarray], list[np.ndarray]] | None:
+    """Columns and rings saved in an autosave folder, in the form read_polygons returns, or None if it holds no annotations.
+
+    \nThe snapshot is read through a memory map and only the journal records after it are decoded. Records after last_sequence are
+    ignored, so edits made while this runs are not returned twice.
+    """
+    with _directory_lock(directory):
+        snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        snapshot = read_snapshot(snapshot_path) if os.path.exists(snapshot_path) else None
+        try:
+            with open(os.path.join(directory, JOURNAL_FILE), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+
+    snapshot_sequence, columns, rings = snapshot if snapshot is not None else (0, *_columns_from_states([], []))
+    changes: dict[int, AnnotationState | None] = {}
+    for _, sequence, operation, annotation_id, payload in iter_records(data):
+        if sequence <= snapshot_sequence:
+            continue
+        if last_sequence is not None and sequence > last_sequence:
+            break
+        state = decode_state(payload) if operation != Operation.ERASE else None
+        changes[annotation_id] = state if state is not None and len(state.points) >= 3 else None
+
+    if changes:
+        kept = np.array([int(annotation_id) not in changes for annotation_id in columns["polygon_id"]], dtype=bool)
+        added_ids = [annotation_id for annotation_id, state in changes.items() if state is not None]
+        added_columns, added_rings = _columns_from_states(added_ids, [changes[annotation_id] for annotation_id in added_ids])
+        columns = {name: np.concatenate((np.asarray(values)[kept], added_columns[name])) for name, values in columns.items()}
+        rings = [ring for ring, keep in zip(rings, kept) if keep] + added_rings
+    return (columns, rings) if rings else None
+
+
+class AnnotationJournal:
+    """Append-only log of annotation edits in an autosave folder, read back by load_annotations after a crash or on reopening.
+
+    \nRecords are encoded on the GUI thread into a buffer that a background task appends and fsyncs, so an edit costs one struct
+    pack. Each record carries a CRC and a sequence number: a record torn by a crash ends the replay, and records already folded into
+    the snapshot are skipped. After COMPACT_AFTER_RECORDS records, and on close, the live annotations from snapshot_source are written
+    to a memory mappable snapshot and the journal is cut down to the records after it.
+    \nSnapshots are only taken once the owner sets restored, when the saved annotations are back in snapshot_source. Before that the
+    source holds none or only some of them, and a snapshot of it would wipe the rest.
+    """
+
+    def __init__(self, directory: str, snapshot_source: Callable[[], tuple[dict[str, np.ndarray], list[np.ndarray]]]):
+        self.directory = directory
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.snapshot_source = snapshot_source
+        self._buffer = bytearray()
+        self._buffer_lock = threading.Lock()
+        self._file_lock = _directory_lock(directory)
+        self._flush_scheduled = False
+        self._compacting = False
+        self.restored = False
+
+        with self._file_lock:
+            os.makedirs(directory, exist_ok=True)
+            snapshot_sequence = _snapshot_sequence(self.snapshot_path)
+            # Drops a torn tail before anything is appended after it
+            _rewrite_journal(self.journal_path, 0)
+            with open(self.journal_path, "rb") as file:
+                sequences = [sequence for _, sequence, _, _, _ in iter_records(file.read())]
+        self.sequence = max([snapshot_sequence, *sequences])
+        self._records_since_snapshot = sum(sequence > snapshot_sequence for sequence in sequences)
+
+    def record(self, operation: Operation, annotation_id: int, state: AnnotationState = None):
+        self.sequence += 1
+        data = encode_record(self.sequence, operation, annotation_id, state)
+        with self._buffer_lock:
+            self._buffer += data
+        self._records_since_snapshot += 1
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            get_executor().submit(
+                self._flush, priority=Priority.EXPORT, name="journal flush", on_failed=lambda error: print(f"Could not write the annotation journal: {error}")
+            )
+        if self._records_since_snapshot >= COMPACT_AFTER_RECORDS and not self._compacting:
+            self.compact()
+
+    def _flush(self):
+        with self._file_lock:
+            self._flush_scheduled = False
+            self._write_buffer()
+
+    def _write_buffer(self):
+        with self._buffer_lock:
+            data, self._buffer = self._buffer, bytearray()
+        if data:
+            with open(self.journal_path, "ab") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _write_snapshot(self, sequence: int, columns: dict[str, np.ndarray], rings: list[np.ndarray]):
+        """Runs under the file lock. A snapshot queued behind a newer one is skipped"""
+        self._write_buffer()
+        if _snapshot_sequence(self.snapshot_path) >= sequence:
+            return
+        write_snapshot(self.snapshot_path, sequence, columns, rings)
+        _rewrite_journal(self.journal_path, sequence)
+
+    def compact(self):
+        """Snapshot the live annotations now and write it in the background, later if they are still being restored"""
+        if not self.restored:
+            return
+        self._submit_snapshot(*self.snapshot_source())
+
+    def replace(self, columns: dict[str, np.ndarray], rings: list[np.ndarray]):
+        """Make the given annotations the saved state in place of everything journaled so far, such as when a project is opened.
+
+        \nThe annotations saved until now are copied to a replaced-<time> subfolder first, load_annotations reads them from there.
+        """
+        self.sequence += 1
+        self._submit_snapshot(columns, rings, back_up=True)
+
+    def _back_up(self):
+        """Runs under the file lock. Copy the snapshot and the journal to a new subfolder unless both are empty or missing.
+
+        \nA snapshot that cannot be read is copied too, it may be what the autosave failed to load.
+        """
+        self._write_buffer()
+        if not os.path.exists(self.snapshot_path) and os.path.getsize(self.journal_path) <= _FILE_HEADER.size:
+            return
+        backup_directory = os.path.join(self.directory, f"replaced-{datetime.now():%Y%m%d-%H%M%S-%f}")
+        os.makedirs(backup_directory)
+        for path in (self.snapshot_path, self.journal_path):
+            if os.path.exists(path):
+                shutil.copy2(path, backup_directory)
+        print(f"The autosaved annotations were replaced, the previous ones are kept in {backup_directory}")
+
+    def _submit_snapshot(self, columns: dict[str, np.ndarray], rings: list[np.ndarray], back_up: bool = False):
+        sequence = self.sequence
+        self._records_since_snapshot = 0
+        self._compacting = True
+
+        def runnable():
+            with self._file_lock:
+                if back_up:
+                    self._back_up()
+                self._write_snapshot(sequence, columns, rings)
+
+        def failed(error: Exception):
+            self._compacting = False
+            print(f"Could not compact the annotation journal: {error}")
+
+        get_executor().submit(runnable, priority=Priority.EXPORT, name="journal compaction", on_finished=lambda _: setattr(self, "_compacting", False), on_failed=failed)
+
+    def close(self):
+        """Write everything recorded, then fold it into the snapshot on the export lane so the next open only maps the snapshot.
+
+        \nThe records are on disk when this returns. A snapshot still queued when the process exits only leaves a longer journal,
+        and one queued behind a newer snapshot of a reopened journal is skipped.
+        """
+        with self._file_lock:
+            self._write_buffer()
+        if self._records_since_snapshot and self.restored:
+            self._submit_snapshot(*self.snapshot_source())
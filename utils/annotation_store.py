@@ -0,0 +1,235 @@
+import numpy as np
+from PyQt6.QtGui import QColor
+
+from utils.annotation_journal import AnnotationJournal, AnnotationState, Operation
+from utils.polygon import Polygon
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.polygon_manager import PolygonManager
+
+
+class AnnotationStore:
+    """Column-oriented table of every annotation on the canvas, one row per PolygonManager.
+
+    \nRows are never reordered while they are in use, ids only ever increase, and an id -> row index makes lookups O(1).
+    Exports, recoloring, filtering and statistics read the columns as arrays instead of walking the scene.
+
+    \nWhile journal is set, every change to a row is also appended to it, so the annotations survive a crash.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._allocate_columns(capacity)
+        self._size = 0
+        self._rows: dict[int, int] = {}
+        self._next_id = 1
+        self.labels: list[str] = []
+        self._label_codes: dict[str, int] = {}
+        self.groups: list[str] = []
+        self._group_codes: dict[str, int] = {}
+        self.journal: AnnotationJournal = None
+
+    def _allocate_columns(self, capacity: int):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.label_codes = np.zeros(capacity, dtype=np.int32)
+        self.group_codes = np.zeros(capacity, dtype=np.int32)
+        self.colors = np.zeros((capacity, 4), dtype=np.uint8)
+        self.seed_points = np.zeros((capacity, 2), dtype=np.float64)
+        self.bboxes = np.zeros((capacity, 4), dtype=np.float64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.managers = np.empty(capacity, dtype=object)
+        self.geometries = np.empty(capacity, dtype=object)
+
+    def _grow(self):
+        old_columns = (self.ids, self.label_codes, self.group_codes, self.colors, self.seed_points, self.bboxes, self.alive, self.managers, self.geometries)
+        self._allocate_columns(len(self.ids) * 2)
+        new_columns = (self.ids, self.label_codes, self.group_codes, self.colors, self.seed_points, self.bboxes, self.alive, self.managers, self.geometries)
+        for old, new in zip(old_columns, new_columns):
+            new[: self._size] = old[: self._size]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def allocate_id(self) -> int:
+        annotation_id = self._next_id
+        self._next_id += 1
+        return annotation_id
+
+    def claim_id(self, preferred_id) -> int:
+        """Use preferred_id if it is a free positive integer, otherwise allocate a new id"""
+        try:
+            preferred_id = int(preferred_id)
+        except (TypeError, ValueError):
+            return self.allocate_id()
+        if preferred_id <= 0 or preferred_id in self._rows:
+            return self.allocate_id()
+        self._next_id = max(self._next_id, preferred_id + 1)
+        return preferred_id
+
+    def _code(self, value, table: list[str], codes: dict[str, int]) -> int:
+        value = str(value)
+        code = codes.get(value)
+        if code is None:
+            code = len(table)
+            table.append(value)
+            codes[value] = code
+        return code
+
+    def add(self, manager: "PolygonManager", seed_point: tuple[float, float], record: bool = True) -> int:
+        """Add a row for the manager's annotation, using the manager's annotation id. record is False for annotations read back from the journal"""
+        if self._size == len(self.ids):
+            self._grow()
+        row = self._size
+        self._size += 1
+        annotation_id = manager.annotation_id
+        self._rows[annotation_id] = row
+        self.ids[row] = annotation_id
+        self.managers[row] = manager
+        self.seed_points[row] = seed_point
+        self._copy(manager, row)
+        if record:
+            self._record(Operation.CREATE, row)
+        return row
+
+    def sync(self, manager: "PolygonManager"):
+        """Copy the state of the manager's displayed polygon into the columns"""
+        row = self._rows.get(manager.annotation_id)
+        if row is None:
+            return
+        self._copy(manager, row)
+        self._record(Operation.UPDATE, row)
+
+    def _copy(self, manager: "PolygonManager", row: int):
+        if manager.hasNothingDisplayed():
+            self.alive[row] = False
+            self.geometries[row] = None
+            return
+
+        polygon: Polygon = manager.getCurrentlyDisplayedMask()
+        points = polygon.get_outline()
+        self.alive[row] = True
+        self.geometries[row] = points
+        self.label_codes[row] = self._code(polygon.get_display_name(), self.labels, self._label_codes)
+        self.group_codes[row] = self._code(polygon.group_id, self.groups, self._group_codes)
+        self.colors[row] = polygon.mask_color.getRgb()
+        if len(points) > 0:
+            # An outline left in a project file is bounded by the simplified one drawn, which is within the tolerance of it
+            bounds = points if isinstance(points, np.ndarray) else polygon.mask_array
+            self.bboxes[row, :2] = bounds.min(axis=0)
+            self.bboxes[row, 2:] = bounds.max(axis=0)
+        else:
+            self.bboxes[row] = 0
+
+    def remove(self, annotation_id: int):
+        """Mark an annotation as erased. Its row stays in place so other rows keep their positions"""
+        row = self._rows.get(annotation_id)
+        if row is None:
+            return
+        self.alive[row] = False
+        self.geometries[row] = None
+        self._record(Operation.ERASE, row)
+
+    def _record(self, operation: Operation, row: int):
+        if self.journal is None:
+            return
+        annotation_id = int(self.ids[row])
+        if not self.alive[row]:
+            self.journal.record(Operation.ERASE, annotation_id)
+            return
+        state = AnnotationState(
+            tuple(self.seed_points[row]),
+            tuple(int(value) for value in self.colors[row]),
+            self.labels[self.label_codes[row]],
+            self.groups[self.group_codes[row]],
+            self.geometries[row],
+        )
+        self.journal.record(operation, annotation_id, state)
+
+    def row_of(self, annotation_id: int) -> int | None:
+        return self._rows.get(annotation_id)
+
+    def active_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.alive[: self._size])
+
+    def active_managers(self) -> list["PolygonManager"]:
+        return list(self.managers[self.active_rows()])
+
+    def label_column(self, rows: np.ndarray) -> np.ndarray:
+        return np.array(self.labels, dtype=object)[self.label_codes[rows]] if len(rows) else np.empty(0, dtype=object)
+
+    def group_column(self, rows: np.ndarray) -> np.ndarray:
+        return np.array(self.groups, dtype=object)[self.group_codes[rows]] if len(rows) else np.empty(0, dtype=object)
+
+    def filter_rows(self, label: str = None, group_id: str = None) -> np.ndarray:
+        """Active rows matching the given label and/or group id"""
+        mask = self.alive[: self._size].copy()
+        if label is not None:
+            code = self._label_codes.get(str(label))
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.label_codes[: self._size] == code
+        if group_id is not None:
+            code = self._group_codes.get(str(group_id))
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= self.group_codes[: self._size] == code
+        return np.flatnonzero(mask)
+
+    def rows_in_rect(self, left: float, top: float, right: float, bottom: float) -> np.ndarray:
+        """Active rows whose bounding box intersects the given rectangle"""
+        bboxes = self.bboxes[: self._size]
+        mask = self.alive[: self._size] & (bboxes[:, 0] <= right) & (bboxes[:, 2] >= left) & (bboxes[:, 1] <= bottom) & (bboxes[:, 3] >= top)
+        return np.flatnonzero(mask)
+
+    def labels_in_use(self) -> list[str]:
+        codes = np.unique(self.label_codes[self.active_rows()])
+        return [self.labels[code] for code in codes]
+
+    def label_statistics(self) -> dict[str, dict[str, float]]:
+        """Count and total bounding box area of the active annotations per label"""
+        rows = self.active_rows()
+        if len(rows) == 0:
+            return {}
+        codes = self.label_codes[rows]
+        bboxes = self.bboxes[rows]
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        counts = np.bincount(codes, minlength=len(self.labels))
+        area_sums = np.bincount(codes, weights=areas, minlength=len(self.labels))
+        return {self.labels[code]: {"count": int(counts[code]), "bbox_area": float(area_sums[code])} for code in np.flatnonzero(counts)}
+
+    def recolor(self, rows: np.ndarray, color: QColor):
+        """Apply a color to the displayed polygons of the given rows"""
+        self.colors[rows] = color.getRgb()
+        for row, manager in zip(rows, self.managers[rows]):
+            manager.getCurrentlyDisplayedMask().set_color(color)
+            self._record(Operation.UPDATE, row)
+
+    def export_columns(self) -> tuple[dict[str, np.ndarray], list[np.ndarray]]:
+        """Export columns and pixel rings of the active annotations with at least three points, in the form read_polygons returns"""
+        rows = self.active_rows()
+        rows = rows[[len(self.geometries[row]) >= 3 for row in rows]] if len(rows) else rows
+        colors = self.colors[rows].astype(np.int64)
+        seed_points = self.seed_points[rows]
+
+        columns = {
+            "polygon_id": self.ids[rows],
+            "group_id": self.group_column(rows),
+            "label": self.label_column(rows),
+            "seed_pnt_x": seed_points[:, 0],
+            "seed_pnt_y": seed_points[:, 1],
+            "red": colors[:, 0],
+            "green": colors[:, 1],
+            "blue": colors[:, 2],
+            "alpha": colors[:, 3],
+        }
+        return columns, list(self.geometries[rows])
+
+    def clear(self):
+        self._allocate_columns(1024)
+        self._size = 0
+        self._rows.clear()
+        self._next_id = 1
+        self.labels.clear()
+        self._label_codes.clear()
+        self.groups.clear()
+        self._group_codes.clear()
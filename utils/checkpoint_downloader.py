@@ -1,44 +1,129 @@
 from PyQt6.QtCore import pyqtSignal, pyqtBoundSignal, QObject
+import hashlib
 import os
-import requests
-from typing import Final
-from utils.async_worker import AsyncWorker
+from typing import Callable, Final
+from utils.task_executor import Priority, current_task, get_executor
+
+
+CHECKPOINT_DIRECTORY: Final[str] = "sam_checkpoints"
+
+DEFAULT_MODEL_TYPE: Final[str] = "vit_b"
+
+# Model type -> (download url, sha256 of the checkpoint)
+SAM_CHECKPOINTS: Final[dict[str, tuple[str, str]]] = {
+    "vit_h": (
+        "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
+        "a7bf3b02f3ebf1267aba913ff637d9a2d5c33d3173bb679e46d9f338c26f262e",
+    ),
+    "vit_l": (
+        "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth",
+        "3adcc4315b642a4d2101128f611684e8734c41232a17c648ed1693702a49a622",
+    ),
+    "vit_b": (
+        "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth",
+        "ec2df62732614e57411cdcf32a23ffdf28910380d03139ee0f4fcbe91eb8c912",
+    ),
+}
+
+DOWNLOAD_CHUNK_SIZE: Final[int] = 1024 * 1024
+
+
+def checkpoint_path(model_type: str, directory: str = CHECKPOINT_DIRECTORY) -> str:
+    url, _ = SAM_CHECKPOINTS[model_type]
+    return os.path.join(directory, url.split("/")[-1])
+
+
+def download_file(url: str, file_path: str, sha256: str = None, progress_callback: Callable[[int, int], None] = None, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """Stream url to file_path through a .part file, resuming a previous partial download with an HTTP Range request.
+
+    \nThe file is only renamed into place once its SHA-256 matches, so a partial or corrupt download never looks finished.
+    """
+    import requests
+
+    part_path = file_path + ".part"
+    hasher = hashlib.sha256()
+    downloaded = 0
+
+    if os.path.exists(part_path):
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+                downloaded += len(chunk)
+
+    headers = {"Range": f"bytes={downloaded}-"} if downloaded > 0 else {}
+    with requests.get(url, headers=headers, stream=True, allow_redirects=True, timeout=30) as response:
+        if downloaded > 0 and response.status_code == 416:
+            # The part file already holds the whole body
+            total = downloaded
+        else:
+            response.raise_for_status()
+            if downloaded > 0 and response.status_code != 206:
+                # The server ignored the range, start over
+                hasher = hashlib.sha256()
+                downloaded = 0
+            content_length = int(response.headers.get("Content-Length", 0))
+            total = downloaded + content_length if content_length > 0 else 0
+
+            with open(part_path, "ab" if downloaded > 0 else "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    downloaded += len(chunk)
+                    if progress_callback is not None:
+                        progress_callback(downloaded, total)
+
+    if sha256 is not None and hasher.hexdigest() != sha256:
+        os.remove(part_path)
+        raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {hasher.hexdigest()}")
+
+    os.replace(part_path, file_path)
 
 
 class CheckpointDownloader(QObject):
     checkpoints_downloaded: pyqtBoundSignal = pyqtSignal()
+    download_progress: pyqtBoundSignal = pyqtSignal("qint64", "qint64")
+    download_failed: pyqtBoundSignal = pyqtSignal(str)
 
-    def __init__(self):
+    def __init__(self, model_types: list[str] = None, checkpoints: dict[str, tuple[str, str]] = None, directory: str = CHECKPOINT_DIRECTORY):
 
         super().__init__()
 
-        self._download_urls: Final[list[str]] = [
-            "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth",
-            "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_l_0b3195.pth",
-            "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth",
-        ]
+        self._model_types: Final[list[str]] = [DEFAULT_MODEL_TYPE] if model_types is None else model_types
+        self._checkpoints: Final[dict[str, tuple[str, str]]] = SAM_CHECKPOINTS if checkpoints is None else checkpoints
+        self._directory: Final[str] = directory
+        self.download_task = None
+
+    def _file_path(self, model_type: str) -> str:
+        url, _ = self._checkpoints[model_type]
+        return os.path.join(self._directory, url.split("/")[-1])
 
     def all_checkpoints_downloaded(self):
-        for url in self._download_urls:
-            file_name = url.split("/")[-1]
-            if not os.path.exists(os.path.join("sam_checkpoints", file_name)):
+        for model_type in self._model_types:
+            if not os.path.exists(self._file_path(model_type)):
                 return False
         return True
 
     def download_sam_checkpoints(self):
         def runnable():
-            # Ensure the "sam_checkpoints" directory exists
-            os.makedirs("sam_checkpoints", exist_ok=True)
+            task = current_task()
 
-            for url in self._download_urls:
-                file_name = url.split("/")[-1]
-                file_path = os.path.join("sam_checkpoints", file_name)
+            def progress(done: int, total: int):
+                task.report_progress(done, total)
+                task.raise_if_cancelled()
+
+            # Ensure the "sam_checkpoints" directory exists
+            os.makedirs(self._directory, exist_ok=True)
 
+            for model_type in self._model_types:
+                file_path = self._file_path(model_type)
                 if not os.path.exists(file_path):
-                    r = requests.get(url, allow_redirects=True)
-                    with open(file_path, "wb") as f:
-                        f.write(r.content)
+                    url, sha256 = self._checkpoints[model_type]
+                    download_file(url, file_path, sha256, progress)
 
-        self._downloader_worker = AsyncWorker(runnable)
-        self._downloader_worker.job_done.connect(self.checkpoints_downloaded.emit)
-        self._downloader_worker.start()
+        self.download_task = get_executor().submit(
+            runnable,
+            priority=Priority.EXPORT,
+            on_finished=lambda _: self.checkpoints_downloaded.emit(),
+            on_failed=lambda error: self.download_failed.emit(str(error)),
+            on_progress=self.download_progress.emit,
+        )
@@ -0,0 +1,97 @@
+import json
+from datetime import datetime
+from itertools import islice
+from typing import Iterable
+
+import numpy as np
+from pycocotools import mask as maskUtils
+
+
+# pycocotools' area() counts the RLEs it is given in a uint8, more than 255 at once overflow
+ENCODE_BATCH_SIZE = 255
+
+
+def write_coco_annotations(file_path: str, image_path: str, width: int, height: int, annotations: Iterable[tuple[list[np.ndarray], str]]):
+    """Stream a COCO json file to disk.
+
+    \nEach annotation is a (rings, label) pair, where rings is a list of (N, 2) arrays in image pixel coordinates.
+    Annotations are RLE-encoded in batches at the true image size, so memory use stays flat no matter how many are written.
+    """
+    categories: dict[str, int] = {}
+    annotation_id = 1
+
+    with open(file_path, "w") as f:
+        info = {"date_created": str(datetime.now()), "version": 1, "description": "Exported from SegmentationPainter"}
+        images = [{"id": 0, "file_name": image_path, "height": height, "width": width, "date_captured": "unknown"}]
+
+        f.write('{"info": ')
+        json.dump(info, f)
+        f.write(', "images": ')
+        json.dump(images, f)
+        f.write(', "annotations": [')
+
+        iterator = iter(annotations)
+        first = True
+        while True:
+            batch = list(islice(iterator, ENCODE_BATCH_SIZE))
+            if len(batch) == 0:
+                break
+
+            for annotation in _encode_batch(batch, width, height, categories, annotation_id):
+                if not first:
+                    f.write(", ")
+                json.dump(annotation, f)
+                first = False
+                annotation_id += 1
+
+        f.write('], "categories": ')
+        json.dump([{"id": category_id, "name": name, "supercategory": "none"} for name, category_id in categories.items()], f)
+        f.write("}")
+
+
+def _encode_batch(batch: list[tuple[list[np.ndarray], str]], width: int, height: int, categories: dict[str, int], first_id: int) -> list[dict]:
+    """RLE-encode every ring of a batch in a single pycocotools call and merge multi-ring annotations"""
+    flat_rings = []
+    ring_counts = []
+    labels = []
+    for rings, label in batch:
+        rings = [np.asarray(ring, dtype=np.float64).ravel().tolist() for ring in rings if len(ring) >= 3]
+        if len(rings) == 0:
+            continue
+        flat_rings.extend(rings)
+        ring_counts.append(len(rings))
+        labels.append(label)
+
+    if len(flat_rings) == 0:
+        return []
+
+    ring_rles = maskUtils.frPyObjects(flat_rings, height, width)
+
+    rles = []
+    start = 0
+    for count in ring_counts:
+        if count == 1:
+            rles.append(ring_rles[start])
+        else:
+            rles.append(maskUtils.merge(ring_rles[start : start + count]))
+        start += count
+
+    areas = maskUtils.area(rles)
+    bboxes = maskUtils.toBbox(rles)
+
+    encoded = []
+    for index, (rle, label) in enumerate(zip(rles, labels)):
+        if label not in categories:
+            categories[label] = len(categories) + 1
+        encoded.append(
+            {
+                "id": first_id + index,
+                "image_id": 0,
+                "category_id": categories[label],
+                "bbox": bboxes[index].tolist(),
+                "area": int(areas[index]),
+                "segmentation": {"size": rle["size"], "counts": rle["counts"].decode("utf-8")},
+                "iscrowd": 0,
+            }
+        )
+    return encoded
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Final
+
+import numpy as np
+
+CACHE_DIRECTORY: Final[str] = "embedding_cache"
+DEFAULT_MAX_BYTES: Final[int] = 2 * 1024**3
+SETTINGS_FILE: Final[str] = "cache_settings.json"
+
+
+def file_digest(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's content, so a renamed or copied image still finds its embeddings"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """Image embeddings kept on disk between sessions, keyed by a tuple such as (file digest, crop rectangle, model type, device).
+
+    \nEach entry is a .npy file that is opened memory mapped, next to a small .json holding the sizes the decoder needs. Hits refresh
+    the entry's modification time, and the least recently used entries are deleted once the directory grows past max_bytes. Entries
+    are written to a temporary file and renamed, so several processes can share the directory.
+
+    \nWithout an explicit max_bytes the limit saved in the directory by set_max_bytes is used, so a large limit chosen when
+    precomputing embeddings is not undone by the application's default.
+
+    \nEntries kept elsewhere, such as the embeddings saved in a project, can be mounted. They are served ahead of the directory
+    without being copied into it.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY, max_bytes: int = None):
+        self.directory = directory
+        self.max_bytes = max_bytes if max_bytes is not None else self._saved_max_bytes()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._mounted: dict[str, tuple[np.ndarray, tuple[int, int], tuple[int, int]]] = {}
+
+    def _settings_path(self) -> str:
+        return os.path.join(self.directory, SETTINGS_FILE)
+
+    def _saved_max_bytes(self) -> int:
+        try:
+            with open(self._settings_path()) as file:
+                return int(json.load(file)["max_bytes"])
+        except (OSError, ValueError, KeyError):
+            return DEFAULT_MAX_BYTES
+
+    def set_max_bytes(self, max_bytes: int):
+        """Change the size limit and save it with the cache for every later user of the directory"""
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._settings_path(), "w") as file:
+            json.dump({"max_bytes": max_bytes}, file)
+
+    @staticmethod
+    def entry_name(key: tuple) -> str:
+        return hashlib.sha1(json.dumps(list(key)).encode()).hexdigest()
+
+    def mount(self, entries: dict[tuple, tuple[np.ndarray, tuple[int, int], tuple[int, int]]]):
+        """Serve (features, original_size, input_size) for the given full keys until they are unmounted"""
+        for key, entry in entries.items():
+            self._mounted[self.entry_name(key)] = entry
+
+    def unmount(self, keys):
+        for key in keys:
+            self._mounted.pop(self.entry_name(key), None)
+
+    def _paths(self, key: tuple) -> tuple[str, str]:
+        name = os.path.join(self.directory, self.entry_name(key))
+        return f"{name}.npy", f"{name}.json"
+
+    def get(self, key: tuple) -> tuple[np.ndarray, tuple[int, int], tuple[int, int]] | None:
+        """(features, original_size, input_size) for the key, or None. The features are a read only memory map"""
+        mounted = self._mounted.get(self.entry_name(key))
+        if mounted is not None:
+            self.hits += 1
+            return mounted
+        array_path, metadata_path = self._paths(key)
+        try:
+            with open(metadata_path) as file:
+                metadata = json.load(file)
+            features = np.load(array_path, mmap_mode="r")
+            os.utime(array_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return features, tuple(metadata["original_size"]), tuple(metadata["input_size"])
+
+    def contains(self, key: tuple) -> bool:
+        return self.entry_name(key) in self._mounted or os.path.exists(self._paths(key)[1])
+
+    def size(self) -> int:
+        """Bytes used by the cached arrays"""
+        if not os.path.isdir(self.directory):
+            return 0
+        with os.scandir(self.directory) as scanner:
+            return sum(entry.stat().st_size for entry in scanner if entry.name.endswith(".npy"))
+
+    def put(self, key: tuple, features: np.ndarray, original_size: tuple[int, int], input_size: tuple[int, int]):
+        array_path, metadata_path = self._paths(key)
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(array_path + temporary_suffix, "wb") as file:
+            np.save(file, np.ascontiguousarray(features))
+        with open(metadata_path + temporary_suffix, "w") as file:
+            json.dump({"original_size": list(original_size), "input_size": list(input_size)}, file)
+        # The array goes first so a visible .json always has its array
+        os.replace(array_path + temporary_suffix, array_path)
+        os.replace(metadata_path + temporary_suffix, metadata_path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            with os.scandir(self.directory) as scanner:
+                for entry in scanner:
+                    if entry.name.endswith(".npy"):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, array_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(array_path)
+                total -= size
+
+    @staticmethod
+    def _remove(array_path: str):
+        for path in (array_path[: -len(".npy")] + ".json", array_path):
+            try:
+                os.remove(path)
+            except OSError:
+                # Another process removed it first, or it is still mapped on Windows and goes with a later eviction
+                pass
+
+    def clear(self):
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                return
+            for name in os.listdir(self.directory):
+                if name.endswith(".npy"):
+                    self._remove(os.path.join(self.directory, name))
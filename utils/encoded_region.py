@@ -0,0 +1,47 @@
+import numpy as np
+
+# SAM's low resolution logits cover the padded 1024 x 1024 encoder input at a quarter of its resolution
+LOGIT_SIZE = 256
+
+
+def crop_rect_around(minimum: np.ndarray, maximum: np.ndarray, width: int, height: int, margin_ratio: float = 0.15, min_margin: int = 16) -> tuple[int, int, int, int]:
+    """Integer (x0, y0, x1, y1) rectangle around a bounding box, padded for context and clamped to the image"""
+    margin = np.maximum((maximum - minimum) * margin_ratio, min_margin)
+    x0, y0 = np.floor(np.maximum(minimum - margin, 0)).astype(int)
+    x1, y1 = np.ceil(np.minimum(maximum + margin, (width, height))).astype(int)
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def logit_scale(height: int, width: int) -> float:
+    """Image pixels -> low resolution logit pixels for an image of the given size"""
+    return LOGIT_SIZE / max(height, width)
+
+
+def translation(x: float, y: float) -> np.ndarray:
+    return np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=np.float64)
+
+
+def qtransform_matrix(transform) -> np.ndarray:
+    """3 x 3 matrix of an affine QTransform, acting on column vectors"""
+    return np.array([[transform.m11(), transform.m21(), transform.dx()], [transform.m12(), transform.m22(), transform.dy()], [0, 0, 1]], dtype=np.float64)
+
+
+def warp_logits(logits: np.ndarray, target_to_source: np.ndarray, source_size: tuple[int, int], target_size: tuple[int, int], fill: float = -20.0) -> np.ndarray:
+    """Resample low resolution logits predicted for a source image into the logit frame of a target image.
+
+    \ntarget_to_source maps target image pixels to source image pixels, and the sizes are (height, width). Areas outside the source get
+    a strongly negative fill so the decoder treats them as background.
+    """
+    import cv2
+
+    source_scale = logit_scale(*source_size)
+    target_scale = logit_scale(*target_size)
+    matrix = np.diag([source_scale, source_scale, 1]) @ target_to_source @ np.diag([1 / target_scale, 1 / target_scale, 1])
+    return cv2.warpAffine(
+        logits.astype(np.float32),
+        matrix[:2],
+        (LOGIT_SIZE, LOGIT_SIZE),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=fill,
+    )
@@ -0,0 +1,131 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+
+SHAPE_COLUMNS = ["polygon_id", "group_id", "label", "seed_pnt_x", "seed_pnt_y", "red", "green", "blue", "alpha"]
+
+VECTOR_DRIVERS = {
+    ".shp": "ESRI Shapefile",
+    ".gpkg": "GPKG",
+    ".fgb": "FlatGeobuf",
+}
+
+GEOPARQUET_EXTENSIONS = (".parquet", ".geoparquet")
+
+# Without a georeference, polygons are written in pixel space with the Y axis flipped
+FLIP_Y = np.array([[1.0, 0.0, 0.0], [0.0, -1.0, 0.0], [0.0, 0.0, 1.0]])
+
+
+def affine_matrix(transform) -> np.ndarray:
+    """Convert a rasterio/affine transform into a 3x3 matrix, falling back to a Y flip when there is none"""
+    if transform is None:
+        return FLIP_Y
+    return np.array([[transform.a, transform.b, transform.c], [transform.d, transform.e, transform.f], [0.0, 0.0, 1.0]])
+
+
+def apply_matrix(coords: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """Apply a 3x3 affine matrix to an (N, 2) array of coordinates"""
+    return coords @ matrix[:2, :2].T + matrix[:2, 2]
+
+
+def rings_to_geometries(rings: list[np.ndarray], matrix: np.ndarray) -> np.ndarray:
+    """Build shapely polygons from pixel-space rings, transforming every vertex in a single pass"""
+    if len(rings) == 0:
+        return np.empty(0, dtype=object)
+    lengths = np.fromiter((len(ring) for ring in rings), dtype=np.int64, count=len(rings))
+    coords = np.concatenate(rings).astype(np.float64, copy=False)
+    ring_index = np.repeat(np.arange(len(rings)), lengths)
+    linear_rings = shapely.linearrings(coords, indices=ring_index)
+    geometries = shapely.polygons(linear_rings)
+    return shapely.transform(geometries, lambda points: apply_matrix(points, matrix))
+
+
+def geometries_to_rings(geometries: np.ndarray, matrix: np.ndarray) -> list[np.ndarray]:
+    """Extract the exterior ring of each polygon as a pixel-space (N, 2) array, inverting the given matrix in one pass"""
+    if len(geometries) == 0:
+        return []
+    geometries = shapely.transform(np.asarray(geometries), lambda points: apply_matrix(points, np.linalg.inv(matrix)))
+    exteriors = shapely.get_exterior_ring(geometries)
+    coords, ring_index = shapely.get_coordinates(exteriors, return_index=True)
+    split_points = np.cumsum(np.bincount(ring_index, minlength=len(geometries)))[:-1]
+    return np.split(coords, split_points)
+
+
+def read_georeference(image_path: str):
+    """Return the affine transform and CRS of a GeoTIFF, otherwise (None, None)"""
+    if image_path is None or os.path.splitext(image_path)[-1].lower() not in [".tif", ".tiff"]:
+        return None, None
+    import rasterio
+
+    with rasterio.open(image_path) as src:
+        return src.transform, src.crs
+
+
+def is_geoparquet(file_path: str) -> bool:
+    return os.path.splitext(file_path)[-1].lower() in GEOPARQUET_EXTENSIONS
+
+
+def write_polygons(file_path: str, columns: dict[str, np.ndarray | list], rings: list[np.ndarray], transform=None, crs=None):
+    """Write polygons and their attribute columns to a shapefile, GeoPackage, FlatGeobuf or GeoParquet file.
+
+    \nThe polygons are given bottom first and written topmost first, the order files have always had, see read_polygons.
+    """
+    geometries = rings_to_geometries(list(rings)[::-1], affine_matrix(transform))
+    gdf = gpd.GeoDataFrame({name: np.asarray(columns[name])[::-1] for name in SHAPE_COLUMNS}, geometry=geometries, crs=crs)
+
+    if is_geoparquet(file_path):
+        gdf.to_parquet(file_path)
+        return
+
+    extension = os.path.splitext(file_path)[-1].lower()
+    driver = VECTOR_DRIVERS.get(extension, "ESRI Shapefile")
+    options = {}
+    if driver == "FlatGeobuf":
+        # The spatial index reorders features, which would break the stacking order on import
+        options["SPATIAL_INDEX"] = "NO"
+    gdf.to_file(file_path, driver=driver, engine="pyogrio", **options)
+
+
+def read_polygons(file_path: str, transform=None, notes: list[str] = None) -> tuple[dict[str, np.ndarray], list[np.ndarray]]:
+    """Read polygons written by write_polygons, returning their attribute columns and pixel-space rings bottom first.
+
+    \nFiles list features topmost first. Each part of a multipart polygon becomes a polygon with the feature's attributes.
+    Annotations have no holes, so only the outline of a polygon with holes is read, and empty features or ones that are
+    not polygons are skipped. Both are described in notes if a list is given, otherwise printed.
+    """
+    if is_geoparquet(file_path):
+        gdf = gpd.read_parquet(file_path)
+    else:
+        gdf = gpd.read_file(file_path, engine="pyogrio", use_arrow=True)
+
+    missing_columns = set(SHAPE_COLUMNS) - set(gdf.columns)
+    if missing_columns:
+        raise ValueError(f"Shapefile is missing required columns: {missing_columns}")
+
+    skipped = 0
+    if (shapely.get_type_id(gdf.geometry.values) == shapely.GeometryType.MULTIPOLYGON).any():
+        # explode drops features without a geometry
+        skipped = int(gdf.geometry.isna().sum())
+        gdf = gdf.explode(index_parts=False, ignore_index=True)
+    is_polygon = (shapely.get_type_id(gdf.geometry.values) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(gdf.geometry.values)
+    if not is_polygon.all():
+        skipped += int((~is_polygon).sum())
+        gdf = gdf[is_polygon]
+    with_holes = int((shapely.get_num_interior_rings(gdf.geometry.values) > 0).sum())
+    messages = []
+    if with_holes:
+        messages.append(f"{with_holes} polygons in {file_path} have holes, only their outlines were imported")
+    if skipped:
+        messages.append(f"{skipped} features in {file_path} are empty or not polygons and were skipped")
+    if notes is None:
+        for message in messages:
+            print(message)
+    else:
+        notes.extend(messages)
+
+    rings = geometries_to_rings(gdf.geometry.values, affine_matrix(transform))[::-1]
+    columns = {name: gdf[name].to_numpy()[::-1] for name in SHAPE_COLUMNS}
+    return columns, rings
@@ -1,4 +1,5 @@
-from PyQt6.QtWidgets import QFileDialog
+from PyQt6.QtWidgets import QFileDialog, QMessageBox, QWidget
+from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QIcon
 import os
 
@@ -8,11 +9,23 @@ def createIcon(filename):
     return QIcon(os.path.join(directory_path, filename))
 
 
+def show_error(parent: QWidget, title: str, text: str):
+    """Show an error without blocking the caller, so it is safe from a task's failure callback. Also printed for the console"""
+    print(f"{title}: {text}")
+    box = QMessageBox(QMessageBox.Icon.Critical, title, text, QMessageBox.StandardButton.Ok, parent)
+    box.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+    box.open()
+
+
 def get_file_path():
     path, _ = QFileDialog.getOpenFileName(None, "Choose Image", "", "Image (*.png *.jpg *.jpeg *.gif *.tif *.tiff *.sgmt)")
     return path
 
 
+def get_folder_path():
+    return QFileDialog.getExistingDirectory(None, "Choose Image Folder")
+
+
 def get_project_path():
     path, _ = QFileDialog.getOpenFileName(None, "Choose Segmentation Project", "", "Project (*.sgmt)")
     return path
@@ -35,9 +48,17 @@ def save_project_path():
 
 
 def save_shapefile_path():
-    path, _ = QFileDialog.getSaveFileName(None, "Save shapefile", "annotated-shapes.shp", "Shape (*.shp)")
+    path, _ = QFileDialog.getSaveFileName(
+        None, "Save shapefile", "annotated-shapes.shp", "Shape (*.shp);;GeoPackage (*.gpkg);;FlatGeobuf (*.fgb);;GeoParquet (*.parquet)"
+    )
     return path
 
+
+def save_latency_path():
+    path, _ = QFileDialog.getSaveFileName(None, "Save latency samples", "latency.jsonl", "JSON lines (*.jsonl)")
+    return path
+
+
 def import_shapefile_path():
-    path, _ = QFileDialog.getOpenFileName(None, "Choose shapefile", "annotated-shapes.shp", "Shape (*.shp)")
+    path, _ = QFileDialog.getOpenFileName(None, "Choose shapefile", "annotated-shapes.shp", "Vector data (*.shp *.gpkg *.fgb *.parquet)")
     return path
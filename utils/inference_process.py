@@ -0,0 +1,223 @@
+import multiprocessing
+import threading
+import weakref
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from utils.checkpoint_downloader import DEFAULT_MODEL_TYPE
+from utils.slider_strength import SliderStrength
+
+
+def pack_mask(mask: np.ndarray) -> tuple[bytes, tuple[int, ...]]:
+    """Compress a boolean mask, or a stack of them, to one bit per pixel for the trip back over the pipe"""
+    return np.packbits(mask.ravel()).tobytes(), mask.shape
+
+
+def unpack_mask(packed: bytes, shape: tuple[int, ...]) -> np.ndarray:
+    bits = np.frombuffer(packed, dtype=np.uint8)
+    return np.unpackbits(bits, count=int(np.prod(shape))).reshape(shape).astype(bool)
+
+
+def _worker_main(connection: Connection, model_type: str, device: str):
+    """Entry point of the inference process. Serves requests from the GUI process one at a time until told to close"""
+    from segment_agent import SegmentAgent
+
+    agent = SegmentAgent(model_type, device, load_encoder=True)
+    connection.send(("ok", agent.load_timings))
+
+    shared_memory: SharedMemory = None
+    while True:
+        try:
+            command, *args = connection.recv()
+        except EOFError:
+            break
+
+        try:
+            if command == "close":
+                connection.send(("ok", None))
+                break
+            elif command == "set_image":
+                name, shape, cache_key = args
+                if shared_memory is None or shared_memory.name != name:
+                    if shared_memory is not None:
+                        shared_memory.close()
+                    shared_memory = SharedMemory(name=name)
+                image = np.ndarray(shape, dtype=np.uint8, buffer=shared_memory.buf)
+                agent.setImage(image, cache_key)
+                # SamPredictor keeps a resized copy, so no view of the shared block outlives this request
+                del image
+                result = None
+            elif command == "predict_point":
+                result = pack_mask(agent.generateMaskFromPoint(*args))
+            elif command == "predict_points":
+                result = pack_mask(agent.generateMaskFromPoints(*args))
+            elif command == "preview_point":
+                mask = agent.previewMask(*args)
+                result = None if mask is None else pack_mask(mask)
+            elif command == "predict_seeds":
+                result = pack_mask(np.stack(agent.generateMasksFromSeeds(*args)))
+            elif command == "set_mask_level":
+                agent.set_mask_level(SliderStrength.fromValue(args[0]))
+                result = None
+            else:
+                raise ValueError(f"Unknown command {command}")
+            connection.send(("ok", result))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+    if shared_memory is not None:
+        shared_memory.close()
+
+
+def _shutdown(process_state: dict):
+    connection: Connection = process_state.get("connection")
+    process = process_state.get("process")
+    try:
+        if connection is not None:
+            connection.send(("close",))
+    except (OSError, ValueError):
+        pass
+    if process is not None:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+    shared_memory: SharedMemory = process_state.get("shared_memory")
+    if shared_memory is not None:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+class RemoteSegmentAgent:
+    """Runs SegmentAgent in a separate process so PyTorch never competes with Qt for the GUI process's GIL.
+
+    \nImages are written into a shared memory block and only its name crosses the pipe. Masks come back bit-packed. setImage does not
+    wait for the encoder, its reply is collected before the next request. If the process dies it is restarted, and the current image
+    and mask level are sent again before the failed request is retried; annotations live in the GUI process and are not affected.
+    """
+
+    def __init__(self, model_type: str = DEFAULT_MODEL_TYPE, device: str = None):
+        self.model_type = model_type
+        self.device = device
+        self.load_timings: dict[str, float] = {}
+        self.mask_level = SliderStrength.AUTO
+        self._lock = threading.RLock()
+        self._unanswered = 0
+        self._ready = threading.Event()
+        self._image_shape: tuple[int, ...] = None
+        self._cache_key: tuple = None
+        self._state = {}
+        self._finalizer = weakref.finalize(self, _shutdown, self._state)
+        self._start_process()
+
+    def _start_process(self):
+        context = multiprocessing.get_context("spawn")
+        parent_connection, child_connection = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_connection, self.model_type, self.device), name="sam-inference", daemon=True)
+        process.start()
+        child_connection.close()
+        self._state["connection"] = parent_connection
+        self._state["process"] = process
+        self._ready.clear()
+        self._unanswered = 0
+
+    def _receive(self):
+        status, value = self._state["connection"].recv()
+        if status == "error":
+            raise RuntimeError(f"Inference process error: {value}")
+        return value
+
+    def _wait_until_ready(self):
+        if not self._ready.is_set():
+            self.load_timings = self._receive()
+            self._ready.set()
+
+    def _drain(self):
+        """Collect the replies of requests that were sent without waiting"""
+        while self._unanswered > 0:
+            self._unanswered -= 1
+            self._receive()
+
+    def _restart(self):
+        print("Inference process stopped unexpectedly, restarting it")
+        process = self._state["process"]
+        if process.is_alive():
+            process.kill()
+        process.join()
+        self._state["connection"].close()
+        self._start_process()
+        self._wait_until_ready()
+        self._state["connection"].send(("set_mask_level", self.mask_level.value))
+        self._receive()
+        if self._image_shape is not None:
+            self._state["connection"].send(("set_image", self._state["shared_memory"].name, self._image_shape, self._cache_key))
+            self._receive()
+
+    def _request(self, message: tuple, wait: bool = True):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    self._wait_until_ready()
+                    self._drain()
+                    self._state["connection"].send(message)
+                    if not wait:
+                        self._unanswered += 1
+                        return None
+                    return self._receive()
+                except (EOFError, OSError):
+                    if attempt == 1:
+                        raise
+                    self._restart()
+                    # The restart already sent the current image again
+                    if message[0] == "set_image":
+                        return None
+
+    def load_encoder(self):
+        """Block until the inference process has loaded the whole model"""
+        with self._lock:
+            try:
+                self._wait_until_ready()
+            except (EOFError, OSError):
+                self._restart()
+
+    def is_encoder_loaded(self) -> bool:
+        return self._ready.is_set()
+
+    def setImage(self, image_array: np.ndarray, cache_key: tuple = None):
+        with self._lock:
+            # The process may still be reading the block for the previous image
+            try:
+                self._drain()
+            except (EOFError, OSError):
+                pass
+            shared_memory: SharedMemory = self._state.get("shared_memory")
+            if shared_memory is None or shared_memory.size < image_array.nbytes:
+                if shared_memory is not None:
+                    shared_memory.close()
+                    shared_memory.unlink()
+                shared_memory = self._state["shared_memory"] = SharedMemory(create=True, size=image_array.nbytes)
+            np.ndarray(image_array.shape, dtype=np.uint8, buffer=shared_memory.buf)[...] = image_array
+            self._image_shape = image_array.shape
+            self._cache_key = cache_key
+            self._request(("set_image", shared_memory.name, image_array.shape, cache_key), wait=False)
+
+    def generateMaskFromPoint(self, x, y):
+        return unpack_mask(*self._request(("predict_point", x, y)))
+
+    def generateMaskFromPoints(self, points):
+        return unpack_mask(*self._request(("predict_points", [tuple(point) for point in points])))
+
+    def generateMasksFromSeeds(self, seeds: list[tuple[int, int]]) -> list[np.ndarray]:
+        return list(unpack_mask(*self._request(("predict_seeds", [tuple(seed) for seed in seeds]))))
+
+    def previewMask(self, x, y) -> np.ndarray | None:
+        result = self._request(("preview_point", x, y))
+        return None if result is None else unpack_mask(*result)
+
+    def set_mask_level(self, mask_level: SliderStrength):
+        self.mask_level = mask_level
+        self._request(("set_mask_level", mask_level.value))
+
+    def close(self):
+        self._finalizer()
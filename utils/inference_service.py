@@ -0,0 +1,397 @@
+import http.client
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from time import monotonic, perf_counter
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from utils.inference_process import pack_mask, unpack_mask
+from utils.slider_strength import SliderStrength
+
+if TYPE_CHECKING:
+    from segment_agent import ImageState, SegmentAgent
+
+
+DEFAULT_PORT = 8765
+SESSION_IDLE_TIMEOUT = 60 * 60
+
+
+class UnknownSession(LookupError):
+    """The session id is not open on this service, it was closed or expired"""
+
+
+class BadRequest(ValueError):
+    """A request whose headers or body the service cannot read"""
+
+
+class _DecodeRequest:
+    def __init__(self, state: "ImageState", points: np.ndarray, labels: np.ndarray, mask_level: SliderStrength):
+        self.state = state
+        self.points = points
+        self.labels = labels
+        self.mask_level = mask_level
+        self.mask: np.ndarray = None
+        self.error: Exception = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Collects decoder requests for a few milliseconds and decodes the ones with the same prompt length in one pass, across sessions.
+
+    \nEach request is decoded against its own session's image embedding, see SegmentAgent.predict_across_images, and the predictor's
+    image state is never set, so sessions never see each other's image.
+    """
+
+    def __init__(self, agent: "SegmentAgent", window: float = 0.005, max_batch: int = 16):
+        self.agent = agent
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self._queue: Queue[_DecodeRequest] = Queue()
+        self._thread = threading.Thread(target=self._run, name="decoder-batcher", daemon=True)
+        self._thread.start()
+
+    def decode(self, state: "ImageState", points: np.ndarray, labels: np.ndarray, mask_level: SliderStrength) -> np.ndarray:
+        return self.decode_many(state, [(points, labels)], mask_level)[0]
+
+    def decode_many(self, state: "ImageState", prompts: list[tuple[np.ndarray, np.ndarray]], mask_level: SliderStrength) -> list[np.ndarray]:
+        """Queue several prompts at once so they land in the same batch"""
+        requests = [_DecodeRequest(state, points, labels, mask_level) for points, labels in prompts]
+        for request in requests:
+            self._queue.put(request)
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+        return [request.mask for request in requests]
+
+    def _run(self):
+        from segment_agent import select_mask
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            # Prompts are not padded, see predict_batch, so only prompts of the same length share a pass
+            groups: dict[int, list[_DecodeRequest]] = {}
+            for request in batch:
+                groups.setdefault(len(request.points), []).append(request)
+
+            for requests in groups.values():
+                try:
+                    results = self.agent.predict_across_images([r.state for r in requests], [r.points for r in requests], [r.labels for r in requests])
+                    for request, (request_masks, request_scores) in zip(requests, results):
+                        request.mask = select_mask(request_masks, request_scores, request.mask_level)
+                except Exception as e:
+                    for request in requests:
+                        request.error = e
+                finally:
+                    for request in requests:
+                        request.done.set()
+                self.batches += 1
+                self.requests += len(requests)
+
+
+class Session:
+    def __init__(self):
+        self.state: "ImageState" = None
+        self.last_used = monotonic()
+
+
+class InferenceService:
+    """One SegmentAgent shared by many annotator sessions. Each session only holds its own image embedding"""
+
+    def __init__(self, agent: "SegmentAgent", batch_window: float = 0.005, max_batch: int = 16):
+        self.agent = agent
+        self.batcher = MicroBatcher(agent, batch_window, max_batch)
+        self.sessions: dict[str, Session] = {}
+        self._lock = threading.Lock()
+
+    def create_session(self) -> str:
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire_idle_sessions()
+            self.sessions[session_id] = Session()
+        return session_id
+
+    def close_session(self, session_id: str):
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def _expire_idle_sessions(self):
+        now = monotonic()
+        for session_id in [key for key, session in self.sessions.items() if now - session.last_used > SESSION_IDLE_TIMEOUT]:
+            del self.sessions[session_id]
+
+    def session(self, session_id: str) -> Session:
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            raise UnknownSession(f"Unknown session {session_id}")
+        session.last_used = monotonic()
+        return session
+
+    def set_image(self, session_id: str, image_array: np.ndarray, cache_key: tuple = None):
+        session = self.session(session_id)
+        session.state = self.agent.compute_image_state(image_array, cache_key)
+
+    def predict(self, session_id: str, points: list, labels: list, mask_level: SliderStrength) -> np.ndarray:
+        session = self.session(session_id)
+        if session.state is None:
+            raise ValueError("No image has been set for this session")
+        return self.batcher.decode(session.state, np.asarray(points, dtype=np.float64), np.asarray(labels, dtype=np.int64), mask_level)
+
+    def predict_many(self, session_id: str, prompts: list[tuple[list, list]], mask_level: SliderStrength) -> list[np.ndarray]:
+        session = self.session(session_id)
+        if session.state is None:
+            raise ValueError("No image has been set for this session")
+        prompts = [(np.asarray(points, dtype=np.float64), np.asarray(labels, dtype=np.int64)) for points, labels in prompts]
+        return self.batcher.decode_many(session.state, prompts, mask_level)
+
+    def status(self) -> dict:
+        with self._lock:
+            encoded = sum(session.state is not None for session in self.sessions.values())
+            return {
+                "model_type": self.agent.model_type,
+                "device": self.agent.device,
+                "sessions": len(self.sessions),
+                "encoded_sessions": encoded,
+                "batches": self.batcher.batches,
+                "requests": self.batcher.requests,
+                "load_timings": self.agent.load_timings,
+            }
+
+
+class _ServiceRequestHandler(BaseHTTPRequestHandler):
+    """POST /sessions, DELETE /sessions/<id>, POST /sessions/<id>/image (raw RGB bytes), POST /sessions/<id>/predict, GET /status.
+
+    \nAn image request may carry an X-Cache-Key header, a JSON list looked up in the agent's embedding cache before encoding.
+    A predict body holding "prompts" instead of "points" and "labels" decodes them together and returns a stack of masks.
+    A session that is not open answers 404 with "session_expired" set, which clients take as expired, other unknown paths answer a
+    plain 404 and an unreadable header or body answers 400.
+    """
+
+    protocol_version = "HTTP/1.1"
+    service: InferenceService = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, value):
+        self._send(status, json.dumps(value).encode())
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _read_image(self, body: bytes) -> tuple[np.ndarray, tuple | None]:
+        try:
+            shape = tuple(int(value) for value in self.headers["X-Shape"].split(","))
+            image_array = np.frombuffer(body, dtype=np.uint8).reshape(shape)
+            cache_key = self.headers.get("X-Cache-Key")
+            return image_array, None if cache_key is None else tuple(json.loads(cache_key))
+        except (AttributeError, TypeError, ValueError) as e:
+            raise BadRequest(f"Unreadable image: {e}") from e
+
+    def _read_prompt(self, body: bytes) -> tuple[list | None, list, list, SliderStrength]:
+        """(prompts, points, labels, mask_level) of a predict body, prompts is None for a single prompt"""
+        try:
+            prompt = json.loads(body)
+            mask_level = SliderStrength.fromValue(prompt.get("mask_level", 0))
+            if "prompts" in prompt:
+                return [(entry["points"], entry["labels"]) for entry in prompt["prompts"]], None, None, mask_level
+            return None, prompt["points"], prompt["labels"], mask_level
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise BadRequest(f"Unreadable prompt, missing or invalid {e}") from e
+
+    def _dispatch(self, method: str):
+        parts = [part for part in self.path.split("/") if part]
+        body = self._body() if method == "POST" else b""
+        try:
+            if method == "GET" and parts == ["status"]:
+                self._send_json(200, self.service.status())
+            elif method == "POST" and parts == ["sessions"]:
+                self._send_json(200, {"session": self.service.create_session()})
+            elif method == "DELETE" and len(parts) == 2 and parts[0] == "sessions":
+                self.service.close_session(parts[1])
+                self._send_json(200, {})
+            elif method == "POST" and len(parts) == 3 and parts[0] == "sessions" and parts[2] == "image":
+                image_array, cache_key = self._read_image(body)
+                self.service.set_image(parts[1], image_array, cache_key)
+                self._send_json(200, {})
+            elif method == "POST" and len(parts) == 3 and parts[0] == "sessions" and parts[2] == "predict":
+                prompts, points, labels, mask_level = self._read_prompt(body)
+                if prompts is not None:
+                    mask = np.stack(self.service.predict_many(parts[1], prompts, mask_level))
+                else:
+                    mask = self.service.predict(parts[1], points, labels, mask_level)
+                packed, shape = pack_mask(mask)
+                self._send(200, packed, "application/octet-stream", {"X-Shape": ",".join(str(size) for size in shape)})
+            else:
+                self._send_json(404, {"error": f"No route for {method} {self.path}"})
+        except UnknownSession as e:
+            self._send_json(404, {"error": str(e), "session_expired": True})
+        except BadRequest as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+def make_server(service: InferenceService, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    handler = type("ServiceRequestHandler", (_ServiceRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class SessionExpired(RuntimeError):
+    """The service no longer knows the session, usually because it sat idle past SESSION_IDLE_TIMEOUT"""
+
+
+class ServiceSegmentAgent:
+    """Client for a running inference service with the interface the canvas expects from SegmentAgent"""
+
+    def __init__(self, url: str):
+        address = urlsplit(url if "://" in url else f"http://{url}")
+        self._host = address.hostname or "127.0.0.1"
+        self._port = address.port or DEFAULT_PORT
+        self._local = threading.local()
+        self.mask_level = SliderStrength.AUTO
+        self._image_array: np.ndarray = None
+        self._cache_key: tuple = None
+        status = self._request_json("GET", "/status")
+        self.model_type = status["model_type"]
+        self.device = status["device"]
+        self.load_timings: dict[str, float] = status["load_timings"]
+        self.session_id: str = self._request_json("POST", "/sessions")["session"]
+
+    def _connection(self) -> http.client.HTTPConnection:
+        # http.client connections are not thread safe, so every thread keeps its own persistent connection
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self._host, self._port, timeout=600)
+        return connection
+
+    def _request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> tuple[http.client.HTTPResponse, bytes]:
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closes idle keep-alive connections, reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt == 1:
+                    raise
+        if response.status != 200:
+            error = json.loads(data)
+            if response.status == 404 and error.get("session_expired"):
+                raise SessionExpired(error.get("error"))
+            raise RuntimeError(f"Inference service error: {error.get('error')}")
+        return response, data
+
+    def _request_json(self, method: str, path: str, value=None) -> dict:
+        body = None if value is None else json.dumps(value).encode()
+        _, data = self._request(method, path, body, {"Content-Type": "application/json"})
+        return json.loads(data)
+
+    def load_encoder(self):
+        """The service loads the whole model before it accepts connections"""
+
+    def is_encoder_loaded(self) -> bool:
+        return True
+
+    def setImage(self, image_array: np.ndarray, cache_key: tuple = None):
+        # Kept so an expired session can be re-encoded without asking the canvas for a new screenshot
+        self._image_array = np.ascontiguousarray(image_array, dtype=np.uint8)
+        self._cache_key = cache_key
+        self._send_image()
+
+    def _renew_session(self):
+        """Open a new session in place of one the service expired"""
+        self.session_id = self._request_json("POST", "/sessions")["session"]
+
+    def _send_image(self):
+        shape = ",".join(str(size) for size in self._image_array.shape)
+        headers = {"X-Shape": shape, "Content-Type": "application/octet-stream"}
+        if self._cache_key is not None:
+            headers["X-Cache-Key"] = json.dumps(list(self._cache_key))
+        body = self._image_array.tobytes()
+        try:
+            self._request("POST", f"/sessions/{self.session_id}/image", body, headers)
+        except SessionExpired:
+            self._renew_session()
+            self._request("POST", f"/sessions/{self.session_id}/image", body, headers)
+
+    def _predict(self, points: list, labels: list) -> np.ndarray:
+        return self._decode({"points": points, "labels": labels})
+
+    def _decode(self, prompt: dict) -> np.ndarray:
+        prompt = json.dumps({**prompt, "mask_level": self.mask_level.value}).encode()
+        try:
+            response, data = self._request("POST", f"/sessions/{self.session_id}/predict", prompt, {"Content-Type": "application/json"})
+        except SessionExpired:
+            if self._image_array is None:
+                raise
+            self._renew_session()
+            self._send_image()
+            response, data = self._request("POST", f"/sessions/{self.session_id}/predict", prompt, {"Content-Type": "application/json"})
+        shape = tuple(int(value) for value in response.getheader("X-Shape").split(","))
+        return unpack_mask(data, shape)
+
+    def generateMaskFromPoint(self, x, y):
+        return self._predict([[x, y]], [1])
+
+    def generateMaskFromPoints(self, points):
+        return self._predict([list(point[0]) for point in points], [point[1] for point in points])
+
+    def previewMask(self, x, y) -> np.ndarray | None:
+        if self._image_array is None:
+            return None
+        return self._predict([[x, y]], [1])
+
+    def generateMasksFromSeeds(self, seeds: list[tuple[int, int]]) -> list[np.ndarray]:
+        return list(self._decode({"prompts": [{"points": [list(seed)], "labels": [1]} for seed in seeds]}))
+
+    def set_mask_level(self, mask_level: SliderStrength):
+        self.mask_level = mask_level
+
+    def close(self):
+        try:
+            self._request_json("DELETE", f"/sessions/{self.session_id}")
+        except (OSError, RuntimeError, http.client.HTTPException):
+            pass
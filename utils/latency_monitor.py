@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Final
+
+import numpy as np
+
+# Most recent samples kept per stage, older ones are overwritten
+SAMPLES_PER_STAGE: Final[int] = 1024
+REPORTED_PERCENTILES: Final[tuple[int, ...]] = (50, 95, 99)
+
+# Returned by span() while the monitor is disabled, so an instrumented call costs one attribute check
+_DISABLED_SPAN = nullcontext()
+
+
+class LatencyHistogram:
+    """Durations of the last `capacity` runs of one stage, in a ring buffer"""
+
+    def __init__(self, capacity: int = SAMPLES_PER_STAGE):
+        self.starts = np.zeros(capacity, dtype=np.float64)
+        self.durations = np.zeros(capacity, dtype=np.float64)
+        # Samples recorded since the histogram was created, including overwritten ones
+        self.count = 0
+
+    def add(self, start: float, duration: float):
+        index = self.count % len(self.durations)
+        self.starts[index] = start
+        self.durations[index] = duration
+        self.count += 1
+
+    def samples(self) -> tuple[np.ndarray, np.ndarray]:
+        """Start times and durations of the kept samples, oldest first"""
+        capacity = len(self.durations)
+        if self.count <= capacity:
+            return self.starts[: self.count].copy(), self.durations[: self.count].copy()
+        order = np.roll(np.arange(capacity), -(self.count % capacity))
+        return self.starts[order], self.durations[order]
+
+    def summary(self) -> dict[str, float]:
+        """Sample count, last duration and percentiles in milliseconds"""
+        _, durations = self.samples()
+        if len(durations) == 0:
+            return {"count": 0}
+        last = float(self.durations[(self.count - 1) % len(self.durations)])
+        percentiles = (np.percentile(durations, REPORTED_PERCENTILES) * 1000).tolist()
+        return {"count": self.count, "last": last * 1000, **{f"p{p}": value for p, value in zip(REPORTED_PERCENTILES, percentiles)}}
+
+
+class _Span:
+    __slots__ = ("monitor", "name", "start")
+
+    def __init__(self, monitor: "LatencyMonitor", name: str):
+        self.monitor = monitor
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.monitor.record(self.name, self.start, perf_counter() - self.start)
+
+
+class LatencyMonitor:
+    """Named latency spans around the interactive hot paths, kept per stage as ring-buffer histograms.
+
+    \nInstrumented code wraps a stage in `with get_monitor().span("stage"):`. Spans are recorded from any thread, and nothing is
+    recorded while the monitor is disabled.
+    """
+
+    def __init__(self, capacity: int = SAMPLES_PER_STAGE):
+        self.enabled = False
+        self.capacity = capacity
+        self._stages: dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        # perf_counter has no fixed epoch, dumps add this to report wall clock times
+        self._epoch_offset = time.time() - perf_counter()
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _DISABLED_SPAN
+        return _Span(self, name)
+
+    def record(self, name: str, start: float, duration: float):
+        """Add one run of a stage that started at the perf_counter time start"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(name)
+            if histogram is None:
+                histogram = self._stages[name] = LatencyHistogram(self.capacity)
+            histogram.add(start, duration)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Per stage sample count, last duration and percentiles in milliseconds, in the order stages were first seen"""
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in self._stages.items()}
+
+    def dump(self, file_path: str) -> int:
+        """Write every kept sample as one JSON object per line, ordered by start time. Returns the number of samples written"""
+        with self._lock:
+            stage_samples = [(name, *histogram.samples()) for name, histogram in self._stages.items()]
+
+        records = []
+        for name, starts, durations in stage_samples:
+            records.extend((start, name, duration) for start, duration in zip(starts.tolist(), durations.tolist()))
+        records.sort()
+        with open(file_path, "w") as f:
+            for start, name, duration in records:
+                f.write(json.dumps({"stage": name, "start": start + self._epoch_offset, "duration_ms": duration * 1000}) + "\n")
+        return len(records)
+
+
+_monitor: LatencyMonitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_monitor() -> LatencyMonitor:
+    """The application-wide latency monitor, created disabled on first use"""
+    global _monitor
+    # Checked without the lock first, spans are opened on every click and every traced contour
+    if _monitor is not None:
+        return _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = LatencyMonitor()
+        return _monitor
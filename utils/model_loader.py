@@ -0,0 +1,62 @@
+import itertools
+import os
+
+import torch
+from segment_anything import sam_model_registry
+from segment_anything.modeling import Sam
+
+
+# Sam registers these as non-persistent buffers, so they are not part of the checkpoint and have to be recreated
+SAM_PIXEL_MEAN = [123.675, 116.28, 103.53]
+SAM_PIXEL_STD = [58.395, 57.12, 57.375]
+
+DECODER_PREFIXES = ("prompt_encoder.", "mask_decoder.")
+ENCODER_PREFIXES = ("image_encoder.",)
+
+
+def mmap_checkpoint_path(checkpoint_path: str) -> str:
+    return os.path.splitext(checkpoint_path)[0] + ".mmap.pt"
+
+
+def load_state_dict_mmap(checkpoint_path: str) -> dict[str, torch.Tensor]:
+    """Memory-map a checkpoint's tensors instead of deserializing them into fresh memory.
+
+    \nCheckpoints in the legacy (non-zip) format cannot be mapped, so they are converted once into a .mmap.pt file next to the original.
+    """
+    converted_path = mmap_checkpoint_path(checkpoint_path)
+    if os.path.exists(converted_path):
+        return torch.load(converted_path, map_location="cpu", mmap=True, weights_only=True)
+
+    try:
+        return torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError:
+        state_dict = torch.load(checkpoint_path, map_location="cpu", weights_only=True)
+        temporary_path = converted_path + ".tmp"
+        torch.save(state_dict, temporary_path)
+        os.replace(temporary_path, converted_path)
+        del state_dict
+        return torch.load(converted_path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def build_empty_sam(model_type: str) -> Sam:
+    """Build the SAM module tree on the meta device, skipping weight allocation and random initialization"""
+    with torch.device("meta"):
+        sam = sam_model_registry[model_type](checkpoint=None)
+    return sam
+
+
+def assign_weights(sam: Sam, state_dict: dict[str, torch.Tensor], prefixes: tuple[str, ...], device: str):
+    """Assign the checkpoint tensors under the given prefixes in place, then move those submodules to the device"""
+    subset = {name: tensor for name, tensor in state_dict.items() if name.startswith(prefixes)}
+    sam.load_state_dict(subset, strict=False, assign=True)
+    for prefix in prefixes:
+        getattr(sam, prefix.rstrip(".")).to(device=device)
+
+
+def finish_sam(sam: Sam, device: str):
+    """Recreate the non-persistent normalization buffers and make sure nothing was left on the meta device"""
+    sam.pixel_mean = torch.tensor(SAM_PIXEL_MEAN, device=device).view(-1, 1, 1)
+    sam.pixel_std = torch.tensor(SAM_PIXEL_STD, device=device).view(-1, 1, 1)
+    missing = [name for name, tensor in itertools.chain(sam.named_parameters(), sam.named_buffers()) if tensor.is_meta]
+    if missing:
+        raise RuntimeError(f"Checkpoint is missing weights for: {missing[:5]}")
@@ -1,9 +1,60 @@
 from PyQt6.QtWidgets import QGraphicsPolygonItem, QGraphicsView
 from PyQt6.QtGui import QBrush, QPolygonF, QColor, QPen
-from PyQt6.QtCore import QPointF
-import cv2
+from itertools import count
 import numpy as np
 
+from utils.latency_monitor import get_monitor
+
+
+# Shared across all polygons so (name, geometry_version) never repeats, even after undo/redo swaps polygon states
+_geometry_versions = count(1)
+
+
+def polygon_to_array(polygon: QPolygonF) -> np.ndarray:
+    """Copy the points of a QPolygonF into an (N, 2) float64 array without iterating in Python"""
+    count = polygon.size()
+    if count == 0:
+        return np.empty((0, 2), dtype=np.float64)
+    buffer = polygon.data()
+    buffer.setsize(count * 2 * 8)
+    return np.frombuffer(buffer, dtype=np.float64).reshape(count, 2).copy()
+
+
+def array_to_polygon(points: np.ndarray) -> QPolygonF:
+    """Build a QPolygonF from an (N, 2) array by filling its point buffer directly"""
+    points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+    polygon = QPolygonF()
+    if len(points) == 0:
+        return polygon
+    polygon.resize(len(points))
+    buffer = polygon.data()
+    buffer.setsize(len(points) * 2 * 8)
+    np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+def mask_to_contour(mask_array: np.ndarray) -> np.ndarray:
+    """Outline of the largest connected region of a mask as an (N, 2) float64 array in mask pixels.
+
+    \nOnly uses numpy and OpenCV, which release the GIL, so batches of masks can be traced on worker threads.
+    """
+    import cv2
+
+    with get_monitor().span("find contours"):
+        contours, _ = cv2.findContours(mask_array.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        if not contours:
+            return np.empty((0, 2), dtype=np.float64)
+        largest_contour = max(contours, key=cv2.contourArea)
+    return largest_contour.reshape(-1, 2).astype(np.float64)
+
+
+def view_to_scene(graphics_view: QGraphicsView, points: np.ndarray) -> np.ndarray:
+    """Vectorized QGraphicsView.mapToScene for an (N, 2) array of viewport coordinates"""
+    transform, _ = graphics_view.viewportTransform().inverted()
+    x = points[:, 0]
+    y = points[:, 1]
+    return np.column_stack((transform.m11() * x + transform.m21() * y + transform.dx(), transform.m12() * x + transform.m22() * y + transform.dy()))
+
 
 class Polygon(QGraphicsPolygonItem):
     """Used to represent a mask polygon"""
@@ -18,41 +69,38 @@ class Polygon(QGraphicsPolygonItem):
         self.manager = manager
         self.unique_point = unique_point
         self.mask_array = None
+        # Full resolution outline of a polygon drawn simplified, a ProjectRing for one opened from a project. None once it is drawn
+        # from a new contour
+        self.full_points: np.ndarray = None
         self.id = unique_id
         self.group_id = group_id
+        self.geometry_version = 0
 
     def draw(self, graphics_view: QGraphicsView, mask_array: np.ndarray, map=True):
         self.mask_array = mask_array
-        contours, _ = cv2.findContours(mask_array.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-
-        if contours:
-            largest_contour = max(contours, key=cv2.contourArea)
-            polygon = QPolygonF()
-
-            for point in largest_contour:
-                x, y = point[0]
-                if map:
-                    scene_point = graphics_view.mapToScene(x, y)
-                    polygon.append(scene_point)
-                else:
-                    qpoint = QPointF(x, y)
-                    polygon.append(qpoint)
-
-            self.setPolygon(polygon)
+        self.drawContour(graphics_view, mask_to_contour(mask_array), map)
+
+    def drawContour(self, graphics_view: QGraphicsView, contour: np.ndarray, map=True):
+        """Display a contour traced from a viewport-sized mask, mapping it into the scene unless map is False"""
+        if len(contour) == 0:
+            return
+        with get_monitor().span("build polygon"):
+            if map:
+                contour = view_to_scene(graphics_view, contour)
+            self.full_points = None
+            self.setPolygon(array_to_polygon(contour))
+        self.geometry_version = next(_geometry_versions)
 
-            brush = QBrush(self.mask_color)
-            self.setBrush(brush)
-            self.setPen(QPen(QColor(0, 0, 0, 0)))
+        brush = QBrush(self.mask_color)
+        self.setBrush(brush)
+        self.setPen(QPen(QColor(0, 0, 0, 0)))
 
-    def drawFixed(self, pixel_array):
+    def drawFixed(self, pixel_array, full_points: np.ndarray = None):
+        """Display an outline given in image pixels. full_points is the outline pixel_array was simplified from, if it was"""
         self.mask_array = pixel_array
-        polygon = QPolygonF()
-
-        for point in pixel_array:
-            test = QPointF(point[0], point[1])
-            polygon.append(test)
-
-        self.setPolygon(polygon)
+        self.full_points = full_points
+        self.setPolygon(array_to_polygon(pixel_array))
+        self.geometry_version = next(_geometry_versions)
         brush = QBrush(self.mask_color)
         self.setBrush(brush)
         self.setPen(QPen(QColor(0, 0, 0, 0)))
@@ -81,6 +129,18 @@ class Polygon(QGraphicsPolygonItem):
     def get_unique_point(self):
         return self.unique_point
 
+    def get_points_array(self) -> np.ndarray:
+        """Polygon outline in scene (image pixel) coordinates as an (N, 2) array, at full resolution if it is drawn simplified"""
+        if self.full_points is not None:
+            return np.array(self.full_points, dtype=np.float64)
+        return polygon_to_array(self.polygon())
+
+    def get_outline(self) -> np.ndarray:
+        """Outline for the annotation table, like get_points_array but a full resolution outline is returned as is, not read"""
+        if self.full_points is not None:
+            return self.full_points
+        return polygon_to_array(self.polygon())
+
     def to_dictionary(self):
         return {
             "name": self.name,
@@ -10,7 +10,7 @@ if TYPE_CHECKING:
 class PolygonManager:
     """Manages a collection of polygons. Includes undo/redo functionality as well as placing polygons onto a QGraphicsView"""
 
-    def __init__(self, name):
+    def __init__(self, name, annotation_id=None):
         self.masks = []
         self.clicked_points = []
         self.root_mask = Polygon(QColor(0, 0, 0, 0))
@@ -20,6 +20,7 @@ class PolygonManager:
         self.displayed_mask = self.root_mask
         self.isSelected = True
         self.name = name
+        self.annotation_id = annotation_id
         self.graphics_view: ImageCanvas = None
 
     def appendMaskItem(self, mask_item: Polygon):
@@ -37,6 +38,7 @@ class PolygonManager:
             self.graphics_view.scene.addItem(self.displayed_mask)
             unique_point = self.displayed_mask.get_unique_point()
             self.addClickedPoint(unique_point[0], unique_point[1], unique_point[2])
+            self.graphics_view.annotations.sync(self)
 
             if display_bar == None:
                 return
@@ -54,6 +56,7 @@ class PolygonManager:
             if self.displayed_mask != self.root_mask:
                 self.graphics_view.scene.addItem(self.displayed_mask)
                 self.removeMostRecentPoint()
+            self.graphics_view.annotations.sync(self)
             if self.hasNothingDisplayed():
                 display_bar.get_toolbox().remove_polygon_from_polygon_list(self.displayed_mask)
             else:
@@ -0,0 +1,136 @@
+import os
+from typing import Final
+
+import numpy as np
+
+from utils.annotation_journal import annotation_arrays, annotation_columns, map_array_file, ring_arrays, split_rings, write_array_file
+
+PROJECT_EXTENSION: Final[str] = ".sgmt"
+PROJECT_MAGIC: Final[bytes] = b"SGMTPROJ"
+# Largest distance in pixels between an outline and the simplified one drawn when a project opens
+SIMPLIFY_TOLERANCE: Final[float] = 0.5
+
+
+def simplify_ring(ring: np.ndarray, tolerance: float = SIMPLIFY_TOLERANCE) -> np.ndarray:
+    """Douglas-Peucker simplification of a closed outline, the outline itself if simplifying would leave fewer than three points"""
+    import cv2
+
+    simplified = cv2.approxPolyDP(np.ascontiguousarray(ring, dtype=np.float32).reshape(-1, 1, 2), tolerance, True).reshape(-1, 2)
+    return simplified if len(simplified) >= 3 else np.asarray(ring, dtype=np.float32)
+
+
+def save_project(
+    path: str,
+    image_path: str,
+    image_size: tuple[int, int],
+    columns: dict[str, np.ndarray],
+    rings: list[np.ndarray],
+    embeddings: dict[tuple, tuple[np.ndarray, tuple[int, int], tuple[int, int]]] = None,
+):
+    """Write a project: a reference to the image, the annotations with simplified outlines, and optionally embeddings under their
+    full cache keys.
+
+    \nEverything is one file of aligned arrays after a JSON header, see write_array_file, so Project can map it without reading it.
+    """
+    embeddings = embeddings or {}
+    header, arrays = annotation_arrays(columns, rings)
+    arrays.update(ring_arrays([simplify_ring(ring) for ring in rings], prefix="simplified_"))
+
+    embedding_entries = []
+    for index, (key, (features, original_size, input_size)) in enumerate(embeddings.items()):
+        arrays[f"embedding_{index}"] = np.asarray(features)
+        embedding_entries.append({"key": list(key), "original_size": list(original_size), "input_size": list(input_size)})
+
+    project_directory = os.path.dirname(os.path.abspath(path))
+    header.update(
+        {
+            # Relative first so a project moved together with its image still finds it
+            "image_path": os.path.relpath(os.path.abspath(image_path), project_directory),
+            "image_absolute_path": os.path.abspath(image_path),
+            "image_size": list(image_size),
+            "simplify_tolerance": SIMPLIFY_TOLERANCE,
+            "embeddings": embedding_entries,
+        }
+    )
+    write_array_file(path, PROJECT_MAGIC, header, arrays)
+
+
+class ProjectRing:
+    """Full resolution outline of one annotation in an opened project, read from the project's memory map each time it is used.
+
+    \nIt stands in for the (N, 2) float32 array in len() and numpy calls, so the outlines drawn simplified are only read on an edit
+    or an export. detach keeps a copy in memory instead, after which the file can be replaced.
+    """
+
+    __slots__ = ("_project", "_row", "_points")
+
+    def __init__(self, project: "Project", row: int):
+        self._project = project
+        self._row = row
+        self._points: np.ndarray = None
+
+    def __len__(self) -> int:
+        return self._project.ring_length(self._row)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        points = self._points if self._points is not None else self._project.full_ring(self._row)
+        return points if dtype is None else points.astype(dtype, copy=False)
+
+    def detach(self):
+        if self._points is None:
+            self._points = self._project.full_ring(self._row)
+
+
+class Project:
+    """An opened .sgmt project. Opening maps the file and reads only the header.
+
+    \nThe columns and simplified outlines are small and are what the canvas draws, they are copied out when opening. The full outlines
+    are ProjectRings that read the memory map when they are used, and the embeddings are mounted straight from it. release drops
+    the map so the file can be saved over.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        header, self._arrays = map_array_file(path, PROJECT_MAGIC)
+        self.image_size: tuple[int, int] = tuple(header["image_size"])
+        self.image_path = self._resolve_image(header["image_path"], header["image_absolute_path"])
+        self.columns = annotation_columns(header, self._arrays)
+        self._ring_offsets = np.array(self._arrays["ring_offsets"])
+        self.rings = [ProjectRing(self, row) for row in range(len(self._ring_offsets) - 1)]
+        self.simplified_rings = split_rings(self._arrays, prefix="simplified_")
+        self._embedding_entries = header["embeddings"]
+
+    def _resolve_image(self, relative_path: str, absolute_path: str) -> str:
+        candidate = os.path.join(os.path.dirname(os.path.abspath(self.path)), relative_path)
+        if os.path.exists(candidate):
+            return os.path.normpath(candidate)
+        if os.path.exists(absolute_path):
+            return absolute_path
+        raise FileNotFoundError(f"The image of {self.path} was not found at {candidate} or {absolute_path}")
+
+    def __len__(self) -> int:
+        return len(self.rings)
+
+    def ring_length(self, row: int) -> int:
+        return int(self._ring_offsets[row + 1] - self._ring_offsets[row])
+
+    def full_ring(self, row: int) -> np.ndarray:
+        """Copy of one full resolution outline, read from the memory map"""
+        return np.array(self._arrays["points"][self._ring_offsets[row] : self._ring_offsets[row + 1]])
+
+    def detach_rings(self):
+        """Keep a copy of every full resolution outline in memory, the reads of saving over the project"""
+        for ring in self.rings:
+            ring.detach()
+
+    def release(self):
+        """Drop the memory map once nothing reads it, Windows does not replace a file while it is mapped"""
+        self.detach_rings()
+        self._arrays = None
+
+    def embeddings(self) -> dict[tuple, tuple[np.ndarray, tuple[int, int], tuple[int, int]]]:
+        """Saved embeddings under their full cache keys, as memory mapped arrays for EmbeddingCache.mount"""
+        return {
+            tuple(entry["key"]): (self._arrays[f"embedding_{index}"], tuple(entry["original_size"]), tuple(entry["input_size"]))
+            for index, entry in enumerate(self._embedding_entries)
+        }
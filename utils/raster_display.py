@@ -0,0 +1,141 @@
+import os
+import warnings
+from typing import Final
+
+import numpy as np
+
+from utils.task_executor import get_executor
+
+RASTER_EXTENSIONS: Final[tuple[str, ...]] = (".tif", ".tiff")
+# Values below the low and above the high percentile of each band saturate to black and white
+STRETCH_PERCENTILES: Final[tuple[float, float]] = (2.0, 98.0)
+# Longest side of the decimated read statistics are computed from
+STATISTICS_SAMPLE_SIZE: Final[int] = 1024
+# Without overviews, statistics come from a grid of windows this many pixels on a side instead of a full decimated read
+SAMPLE_WINDOW_SIZE: Final[int] = 256
+SAMPLE_WINDOW_GRID: Final[int] = 6
+# Rows read and stretched by one compute thread at a time
+STRIP_ROWS: Final[int] = 512
+
+
+def _open(file_path: str):
+    import rasterio
+    from rasterio.errors import NotGeoreferencedWarning
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        return rasterio.open(file_path)
+
+
+def raster_size(file_path: str) -> tuple[int, int]:
+    """Width and height of a raster, read from its header"""
+    with _open(file_path) as dataset:
+        return dataset.width, dataset.height
+
+
+def needs_stretch(file_path: str) -> bool:
+    """Whether a file is a raster PIL would mangle: more than 8 bits per sample, or a band count other than gray, RGB or RGBA"""
+    if os.path.splitext(file_path)[-1].lower() not in RASTER_EXTENSIONS:
+        return False
+    try:
+        with _open(file_path) as dataset:
+            return any(dtype != "uint8" for dtype in dataset.dtypes) or dataset.count not in (1, 3, 4)
+    except Exception:
+        # Left to PIL, which reports anything it cannot read either
+        return False
+
+
+def display_bands(dataset) -> list[int]:
+    """1-based bands shown as red, green and blue: the bands tagged as such, otherwise the first three, otherwise the first as gray"""
+    from rasterio.enums import ColorInterp
+
+    interpretation = list(dataset.colorinterp)
+    tagged = [interpretation.index(color) + 1 for color in (ColorInterp.red, ColorInterp.green, ColorInterp.blue) if color in interpretation]
+    if len(tagged) == 3:
+        return tagged
+    if dataset.count >= 3:
+        return [1, 2, 3]
+    return [1, 1, 1]
+
+
+def _sample(dataset, bands: list[int]) -> np.ma.MaskedArray:
+    """Pixels of the bands to compute statistics from, (bands, N) with nodata masked"""
+    from rasterio.enums import Resampling
+    from rasterio.windows import Window
+
+    scale = max(dataset.width, dataset.height) / STATISTICS_SAMPLE_SIZE
+    if scale <= 1 or dataset.overviews(bands[0]) or scale <= SAMPLE_WINDOW_GRID:
+        # GDAL answers a decimated read from the closest overview when the file has them
+        out_shape = (len(bands), max(1, round(dataset.height / max(scale, 1))), max(1, round(dataset.width / max(scale, 1))))
+        return dataset.read(bands, out_shape=out_shape, resampling=Resampling.nearest, masked=True).reshape(len(bands), -1)
+
+    windows = []
+    size = SAMPLE_WINDOW_SIZE
+    for row in np.linspace(0, dataset.height - size, SAMPLE_WINDOW_GRID).astype(int):
+        for column in np.linspace(0, dataset.width - size, SAMPLE_WINDOW_GRID).astype(int):
+            windows.append(dataset.read(bands, window=Window(column, row, size, size), masked=True).reshape(len(bands), -1))
+    return np.ma.concatenate(windows, axis=1)
+
+
+def stretch_limits(dataset, bands: list[int], percentiles: tuple[float, float] = STRETCH_PERCENTILES) -> np.ndarray:
+    """(bands, 2) low and high values per band, from overviews or sampled windows rather than the full raster"""
+    sample = _sample(dataset, bands)
+    values = sample.astype(np.float64).filled(np.nan)
+    values[~np.isfinite(values)] = np.nan
+    with warnings.catch_warnings():
+        # All-nodata bands give NaN limits, handled below
+        warnings.simplefilter("ignore", RuntimeWarning)
+        limits = np.nanpercentile(values, percentiles, axis=1).T
+    limits = np.nan_to_num(limits, nan=0.0)
+    # A constant band would divide by zero
+    limits[:, 1] = np.maximum(limits[:, 1], limits[:, 0] + np.finfo(np.float32).eps)
+    return limits
+
+
+def stretch_lookup(dtype: np.dtype, low: float, high: float) -> np.ndarray | None:
+    """uint8 table indexed by value - dtype minimum, for integer types of up to 16 bits. None for wider or float types"""
+    dtype = np.dtype(dtype)
+    if dtype.kind not in "ui" or dtype.itemsize > 2:
+        return None
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1, dtype=np.float64)
+    return np.clip((values - low) * (255.0 / (high - low)) + 0.5, 0, 255).astype(np.uint8)
+
+
+def apply_stretch(band: np.ndarray, low: float, high: float, lookup: np.ndarray | None) -> np.ndarray:
+    if lookup is not None:
+        offset = np.iinfo(band.dtype).min
+        return lookup[band.astype(np.int32) - offset] if offset else lookup[band]
+    stretched = (band.astype(np.float32) - np.float32(low)) * np.float32(255.0 / (high - low)) + np.float32(0.5)
+    return np.clip(np.nan_to_num(stretched, nan=0.0), 0, 255).astype(np.uint8)
+
+
+def read_display_rgba(file_path: str) -> np.ndarray:
+    """Display pixels of a raster as (H, W, 4) uint8: chosen bands stretched to their percentile limits, nodata transparent.
+
+    \nStrips are read and stretched on the compute pool, each thread with its own dataset handle since GDAL handles are not thread
+    safe. Integer bands go through a lookup table, float bands through one vectorized expression.
+    """
+    from rasterio.windows import Window
+
+    with _open(file_path) as dataset:
+        bands = display_bands(dataset)
+        limits = stretch_limits(dataset, bands)
+        width, height = dataset.width, dataset.height
+        dtypes = [dataset.dtypes[band - 1] for band in bands]
+    lookups = [stretch_lookup(dtype, low, high) for dtype, (low, high) in zip(dtypes, limits)]
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+
+    def render_strip(row: int):
+        rows = min(STRIP_ROWS, height - row)
+        with _open(file_path) as dataset:
+            data = dataset.read(bands, window=Window(0, row, width, rows), masked=True)
+        for channel, (band, (low, high), lookup) in enumerate(zip(data, limits, lookups)):
+            rgba[row : row + rows, :, channel] = apply_stretch(band.data, low, high, lookup)
+        valid = ~np.ma.getmaskarray(data).any(axis=0)
+        if np.issubdtype(data.dtype, np.floating):
+            valid &= np.isfinite(data.data).all(axis=0)
+        rgba[row : row + rows, :, 3] = np.where(valid, 255, 0)
+
+    list(get_executor().compute_pool.map(render_strip, range(0, height, STRIP_ROWS)))
+    return rgba
@@ -0,0 +1,64 @@
+import json
+from datetime import datetime
+from time import perf_counter
+from typing import Final
+
+SESSION_FORMAT: Final[str] = "segmenter-session"
+SESSION_VERSION: Final[int] = 1
+
+# Every action the canvas records and the fields it carries besides the time "t", positions are image pixels
+SESSION_ACTIONS: Final[dict[str, tuple[str, ...]]] = {
+    "open": ("path", "image", "viewport", "window"),
+    "click": ("x", "y", "polarity", "refine"),
+    "queue": ("x", "y"),
+    "segment_queued": (),
+    "clear_queued": (),
+    "erase": ("x", "y"),
+    "zoom": ("x", "y", "steps"),
+    "pan": ("dx", "dy"),
+    "undo": (),
+    "redo": (),
+}
+
+
+class SessionRecorder:
+    """Writes the input the image canvas acts on to a JSON lines log that replay_session.py plays back.
+
+    \nThe first line is a header, then one line per action with its time in seconds since recording started. Lines are flushed as
+    they are written so a session that ends in a crash or a hang is still complete up to the last action.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.file = open(file_path, "w", encoding="utf-8", buffering=1)
+        self.start = perf_counter()
+        self._write({"format": SESSION_FORMAT, "version": SESSION_VERSION, "started": datetime.now().isoformat(timespec="seconds")})
+
+    def _write(self, line: dict):
+        self.file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    def record(self, action: str, **fields):
+        if self.file is None:
+            return
+        self._write({"t": round(perf_counter() - self.start, 4), "action": action, **fields})
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_session(file_path: str) -> tuple[dict, list[dict]]:
+    """Header and actions of a recorded session. Raises ValueError for files that are not a session log or use unknown actions"""
+    with open(file_path, encoding="utf-8") as file:
+        lines = [json.loads(line) for line in file if line.strip()]
+    if not lines or lines[0].get("format") != SESSION_FORMAT:
+        raise ValueError(f"{file_path} is not a recorded session")
+    if lines[0].get("version", 0) > SESSION_VERSION:
+        raise ValueError(f"{file_path} was recorded by a newer version, format {lines[0]['version']}")
+    header, actions = lines[0], lines[1:]
+    for number, action in enumerate(actions, start=2):
+        missing = [field for field in SESSION_ACTIONS.get(action.get("action"), ()) if field not in action]
+        if action.get("action") not in SESSION_ACTIONS or missing:
+            raise ValueError(f"{file_path}, line {number}: unknown action or missing fields {missing}")
+    return header, actions
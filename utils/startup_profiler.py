@@ -0,0 +1,91 @@
+import builtins
+import json
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class StartupProfiler:
+    """Records how long each first-time module import and each named startup phase takes.
+
+    \nImports are timed by wrapping builtins.__import__, so only modules that were not already in sys.modules are counted.
+    Self time excludes the time spent importing the module's own dependencies.
+    """
+
+    def __init__(self):
+        self._start = perf_counter()
+        self._original_import = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.imports: dict[str, dict[str, float]] = {}
+        self.phases: list[dict[str, float]] = []
+        self.marks: dict[str, float] = {}
+
+    def install(self):
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._original_import is None:
+            return
+        builtins.__import__ = self._original_import
+        self._original_import = None
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)
+        start = perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                if name not in self.imports:
+                    self.imports[name] = {
+                        "cumulative": elapsed,
+                        "self": elapsed - children,
+                        "thread": threading.current_thread().name,
+                    }
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append({"name": name, "start": start - self._start, "duration": perf_counter() - start})
+
+    def mark(self, name: str):
+        """Record the time since the profiler was created under the given name"""
+        self.marks[name] = perf_counter() - self._start
+
+    def report(self) -> dict:
+        imports = sorted(({"module": name, **timing} for name, timing in self.imports.items()), key=lambda entry: entry["cumulative"], reverse=True)
+        return {"total": perf_counter() - self._start, "phases": self.phases, "marks": self.marks, "imports": imports}
+
+    def write(self, file_path: str, top: int = 15):
+        """Write the full report as JSON and print the phases and the slowest top-level imports"""
+        report = self.report()
+        with open(file_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"Startup profile written to {file_path} (total {report['total']:.3f}s)")
+        for phase in report["phases"]:
+            print(f"  {phase['name']:<32} {phase['duration']:8.3f}s")
+        for name, seconds in report["marks"].items():
+            print(f"  {name:<32} {seconds:8.3f}s after start")
+        print("Slowest imports (cumulative / self):")
+        top_level = [entry for entry in report["imports"] if "." not in entry["module"]]
+        for entry in top_level[:top]:
+            print(f"  {entry['module']:<32} {entry['cumulative']:8.3f}s {entry['self']:8.3f}s  [{entry['thread']}]")
@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from enum import IntEnum
+from typing import Callable
+
+from PyQt6.QtCore import QObject, pyqtSignal, pyqtBoundSignal
+
+
+class Priority(IntEnum):
+    """Executor lanes, lower values run first"""
+
+    INTERACTIVE = 0  # work the user is waiting on: inference, image loading, thumbnails
+    PREFETCH = 1  # speculative background work: model warm-up, embedding prefetch
+    EXPORT = 2  # bulk file I/O: exports, imports and downloads
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task that noticed its cancellation token was set"""
+
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled()
+
+
+class TaskHandle(QObject):
+    """A submitted task. Its signals are delivered on the thread that submitted it, normally the GUI thread.
+
+    \nExactly one of finished, failed or cancelled is emitted. A task that completes after cancel() was called reports cancelled,
+    so callers never receive stale results.
+    """
+
+    finished: pyqtBoundSignal = pyqtSignal(object)
+    failed: pyqtBoundSignal = pyqtSignal(object)
+    progress: pyqtBoundSignal = pyqtSignal("qint64", "qint64")
+    cancelled: pyqtBoundSignal = pyqtSignal()
+    _settled: pyqtBoundSignal = pyqtSignal()
+
+    def __init__(self, function: Callable, args: tuple, priority: Priority, name: str):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.name = name
+        self.token = CancellationToken()
+        self._done = threading.Event()
+        self._result = None
+        self._error: BaseException = None
+
+    def cancel(self):
+        self.token.cancel()
+
+    def is_cancelled(self) -> bool:
+        return self.token.is_cancelled()
+
+    def raise_if_cancelled(self):
+        self.token.raise_if_cancelled()
+
+    def report_progress(self, done: int, total: int):
+        self.progress.emit(done, total)
+
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+    def result(self, timeout: float = None):
+        """Block until the task is done and return its result, re-raising its exception if it failed"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Task {self.name} did not finish in time")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _run(self):
+        try:
+            self.token.raise_if_cancelled()
+            result = self.function(*self.args)
+            self.token.raise_if_cancelled()
+        except TaskCancelled as e:
+            self._error = e
+            self._done.set()
+            self.cancelled.emit()
+        except Exception as e:
+            self._error = e
+            self._done.set()
+            print(f"Task {self.name} failed:")
+            traceback.print_exception(e)
+            self.failed.emit(e)
+        else:
+            self._result = result
+            self._done.set()
+            self.finished.emit(result)
+        finally:
+            self._settled.emit()
+
+
+_current_task = threading.local()
+
+
+def current_task() -> TaskHandle | None:
+    """The task running on this thread, used by task code to report progress or check for cancellation"""
+    return getattr(_current_task, "handle", None)
+
+
+class TaskExecutor(QObject):
+    """Bounded pool of worker threads shared by the whole application, fed from a priority queue.
+
+    \nOne worker only takes INTERACTIVE tasks so a long export or download can never delay a click. CPU-bound helpers can fan out on
+    compute_pool, and work that needs its own interpreter goes through run_in_process.
+    """
+
+    def __init__(self, workers: int = None):
+        super().__init__()
+        if workers is None:
+            workers = max(2, min(4, (os.cpu_count() or 2) - 1))
+        self._queue: list[tuple[int, int, TaskHandle]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._pending: set[TaskHandle] = set()
+        self._compute_pool: ThreadPoolExecutor = None
+        self._process_pool: ProcessPoolExecutor = None
+        self._pool_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._worker_loop, args=(True,), name="task-interactive", daemon=True)]
+        self._threads += [threading.Thread(target=self._worker_loop, args=(False,), name=f"task-worker-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self,
+        function: Callable,
+        *args,
+        priority: Priority = Priority.INTERACTIVE,
+        name: str = None,
+        on_finished: Callable = None,
+        on_failed: Callable = None,
+        on_progress: Callable = None,
+        on_cancelled: Callable = None,
+    ) -> TaskHandle:
+        """Queue function(*args) and return its handle. Must be called from a thread with an event loop to receive the signals.
+
+        \nThe callbacks are connected before the task is queued, signals connected to the returned handle afterwards may miss a fast task.
+        """
+        handle = TaskHandle(function, args, priority, name or getattr(function, "__qualname__", "task"))
+        for signal, callback in ((handle.finished, on_finished), (handle.failed, on_failed), (handle.progress, on_progress), (handle.cancelled, on_cancelled)):
+            if callback is not None:
+                signal.connect(callback)
+        # Keep the handle alive until its signals have been delivered
+        self._pending.add(handle)
+        handle._settled.connect(lambda: self._pending.discard(handle))
+        with self._condition:
+            heapq.heappush(self._queue, (int(priority), next(self._sequence), handle))
+            self._condition.notify_all()
+        return handle
+
+    def _worker_loop(self, interactive_only: bool):
+        while True:
+            with self._condition:
+                while not self._queue or (interactive_only and self._queue[0][0] != Priority.INTERACTIVE):
+                    self._condition.wait()
+                _, _, handle = heapq.heappop(self._queue)
+            _current_task.handle = handle
+            try:
+                handle._run()
+            finally:
+                _current_task.handle = None
+
+    @property
+    def compute_pool(self) -> ThreadPoolExecutor:
+        """Thread pool for fanning out CPU-bound numpy/OpenCV work that releases the GIL"""
+        with self._pool_lock:
+            if self._compute_pool is None:
+                self._compute_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="compute")
+            return self._compute_pool
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        """Process pool for pure-Python work, created on first use"""
+        with self._pool_lock:
+            if self._process_pool is None:
+                import multiprocessing
+
+                self._process_pool = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) - 1), mp_context=multiprocessing.get_context("spawn"))
+            return self._process_pool
+
+    def run_in_process(self, function: Callable, *args, priority: Priority = Priority.EXPORT, name: str = None, **callbacks) -> TaskHandle:
+        """Run a picklable function in the process pool. A lane worker waits on it so priorities and cancellation still apply"""
+
+        def runnable():
+            future = self.process_pool.submit(function, *args)
+            handle = current_task()
+            while True:
+                try:
+                    return future.result(timeout=0.1)
+                except FutureTimeoutError:
+                    if handle.is_cancelled():
+                        future.cancel()
+                        raise TaskCancelled()
+
+        return self.submit(runnable, priority=priority, name=name or getattr(function, "__qualname__", "process task"), **callbacks)
+
+    def pending(self, priority: Priority = None) -> int:
+        """Tasks submitted whose signals have not been delivered yet, optionally only those in one lane"""
+        return sum(1 for handle in list(self._pending) if priority is None or handle.priority == priority)
+
+    def cancel_all(self, priority: Priority = None):
+        """Cancel queued and running tasks, optionally only those in one lane"""
+        with self._condition:
+            handles = [handle for _, _, handle in self._queue]
+        handles += list(self._pending)
+        for handle in handles:
+            if priority is None or handle.priority == priority:
+                handle.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        with self._pool_lock:
+            if self._compute_pool is not None:
+                self._compute_pool.shutdown(wait=False, cancel_futures=True)
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executor: TaskExecutor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> TaskExecutor:
+    """The application-wide executor, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = TaskExecutor()
+        return _executor
@@ -0,0 +1,114 @@
+import os
+from typing import Final
+
+from PIL import ExifTags, Image
+
+from utils.embedding_cache import file_digest
+
+# Survey images and orthomosaics are routinely larger than PIL's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+
+IMAGE_EXTENSIONS: Final[tuple[str, ...]] = (".png", ".jpg", ".jpeg", ".gif", ".tif", ".tiff")
+
+# Native resolution tiles match the encoder input, and a stride of half a tile means any region up to TILE_STRIDE pixels on a side
+# lies wholly inside one of them
+TILE_SIZE: Final[int] = 1024
+TILE_STRIDE: Final[int] = 512
+
+
+def rotate_by_exif_tag(image: Image.Image) -> Image.Image:
+    try:
+        for orientation in ExifTags.TAGS.keys():
+            if ExifTags.TAGS[orientation] == "Orientation":
+                exif = dict(image.getexif().items())
+
+                if exif[orientation] == 3:
+                    image = image.rotate(180, expand=True)
+                elif exif[orientation] == 6:
+                    image = image.rotate(270, expand=True)
+                elif exif[orientation] == 8:
+                    image = image.rotate(90, expand=True)
+                return image
+    except (AttributeError, KeyError, IndexError):
+        return image
+
+
+def open_image(file_path: str) -> Image.Image:
+    """Open an image the way the canvas shows it, upright and RGBA, so cached regions hold the same pixels in every tool.
+
+    \n16-bit, float and multiband rasters are stretched for display by raster_display, and the encoder sees the stretched pixels too.
+    """
+    from utils.raster_display import needs_stretch, read_display_rgba
+
+    if needs_stretch(file_path):
+        return Image.fromarray(read_display_rgba(file_path), "RGBA")
+    image = Image.open(file_path)
+    image = rotate_by_exif_tag(image)
+    return image.convert("RGBA")
+
+
+def decoded_size_bytes(file_path: str) -> int:
+    """Bytes of the RGBA image open_image decodes a file into, read from the header without decoding it"""
+    from utils.raster_display import needs_stretch, raster_size
+
+    if needs_stretch(file_path):
+        width, height = raster_size(file_path)
+    else:
+        with Image.open(file_path) as image:
+            width, height = image.size
+    return width * height * 4
+
+
+def find_images(folder: str, recursive: bool = False) -> list[str]:
+    """Image files in a folder, in name order"""
+    if not recursive:
+        names = sorted(os.listdir(folder))
+        return [os.path.join(folder, name) for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+    paths = []
+    for directory, subdirectories, names in os.walk(folder):
+        subdirectories.sort()
+        paths.extend(os.path.join(directory, name) for name in sorted(names) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+
+def image_digest(file_path: str) -> str:
+    """Embedding cache digest of the pixels open_image returns: the file digest, marked with the stretch for stretched rasters"""
+    from utils.raster_display import STRETCH_PERCENTILES, needs_stretch
+
+    digest = file_digest(file_path)
+    if needs_stretch(file_path):
+        digest += "-stretch-{}-{}".format(*STRETCH_PERCENTILES)
+    return digest
+
+
+def tile_starts(length: int, tile_size: int = TILE_SIZE, stride: int = TILE_STRIDE) -> list[int]:
+    """Offsets of the tiles along one axis. The last tile is pulled back to end at the edge, so only short axes get short tiles"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_grid(width: int, height: int, tile_size: int = TILE_SIZE, stride: int = TILE_STRIDE) -> list[tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) rectangles of the native resolution tiles of an image, row by row"""
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in tile_starts(height, tile_size, stride)
+        for x0 in tile_starts(width, tile_size, stride)
+    ]
+
+
+def covering_tile(rect: tuple[int, int, int, int], width: int, height: int, tile_size: int = TILE_SIZE, stride: int = TILE_STRIDE) -> tuple[int, int, int, int] | None:
+    """The grid tile that contains the rectangle with the most room around it, or None if no single tile contains it"""
+    x0, y0, x1, y1 = rect
+    center_x, center_y = (x0 + x1) / 2, (y0 + y1) / 2
+    containing = [tile for tile in tile_grid(width, height, tile_size, stride) if tile[0] <= x0 and tile[1] <= y0 and x1 <= tile[2] and y1 <= tile[3]]
+    if not containing:
+        return None
+    return min(containing, key=lambda tile: abs((tile[0] + tile[2]) / 2 - center_x) + abs((tile[1] + tile[3]) / 2 - center_y))
+
+
+def region_cache_key(image_digest: str, rect: tuple[int, int, int, int]) -> tuple:
+    """Embedding cache key of a native resolution region of an image file"""
+    return ("region", image_digest, *(int(value) for value in rect))